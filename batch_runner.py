@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic
+
+import langgraph
+
+from .config import EnvConfig
+from .workflows.agent_workflow import plan_and_execute_app
+from .workflows.answer_workflow import ANSWER_NOT_FOUND
+from .utils.metrics import MetricsCallbackHandler, serve_metrics
+from .utils.tracing import TraceCallbackHandler, tracing
+from .utils.retriever_registry import retriever_registry
+from .utils.run_stats import RunStatsCallbackHandler, percentile
+
+
+def read_questions(path, question_field="question"):
+    """
+    Streams the questions of a JSONL file.
+
+    Args:
+        path: The path to the JSONL file, one JSON object per line.
+        question_field: The field holding the question.
+
+    Yields:
+        (id, question) tuples. The id is the 'id' field of the line, or its line number.
+    """
+    with open(path, 'r', encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record.get("id", line_number), record[question_field]
+
+
+def answer_question(question_id, question, recursion_limit=45, trace_dir=None):
+    """
+    Runs one question through the agent workflow.
+
+    Args:
+        question_id: The id of the question.
+        question: The question.
+        recursion_limit: The recursion limit of the agent graph.
+        trace_dir: Optional directory the Chrome trace of the run is written to, as <id>.trace.json.
+
+    Returns:
+        A dict with the answer and the question stats: latency, LLM call count, prompt and
+        completion tokens, retrieval count, documents and distillations skipped by the retrieval
+        dedup, whether the recursion limit was hit and the per node and per chain metrics.
+    """
+    stats = RunStatsCallbackHandler()
+    metrics = MetricsCallbackHandler()
+    trace_path = os.path.join(trace_dir, f"{question_id}.trace.json") if trace_dir else None
+    start_time = monotonic()
+    response = None
+    error = None
+    recursion_limit_hit = False
+    with tracing(trace_path) as tracer:
+        callbacks = [stats, metrics] + ([TraceCallbackHandler(tracer)] if tracer else [])
+        config = {"recursion_limit": recursion_limit, "callbacks": callbacks}
+        try:
+            for plan_output in plan_and_execute_app.stream({"question": question}, config=config):
+                for _, agent_state_value in plan_output.items():
+                    pass
+            response = agent_state_value['response']
+        except langgraph.pregel.GraphRecursionError:
+            recursion_limit_hit = True
+            response = ANSWER_NOT_FOUND
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return {
+        "id": question_id,
+        "question": question,
+        "answer": response,
+        "error": error,
+        "latency": monotonic() - start_time,
+        "llm_calls": stats.llm_calls,
+        "prompt_tokens": stats.prompt_tokens,
+        "completion_tokens": stats.completion_tokens,
+        "retrievals": stats.retrievals,
+        "duplicate_documents_skipped": stats.duplicate_documents_skipped,
+        "distillations_skipped": stats.distillations_skipped,
+        "recursion_limit_hit": recursion_limit_hit,
+        "metrics": metrics.summary(),
+    }
+
+
+def summarize_results(results, wall_time):
+    """Builds the end of run summary: throughput and latency percentiles."""
+    latencies = [result["latency"] for result in results]
+    return {
+        "questions": len(results),
+        "errors": sum(1 for result in results if result["error"]),
+        "recursion_limit_hits": sum(1 for result in results if result["recursion_limit_hit"]),
+        "wall_time": wall_time,
+        "throughput_per_minute": 60 * len(results) / wall_time if wall_time else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "llm_calls": sum(result["llm_calls"] for result in results),
+        "prompt_tokens": sum(result["prompt_tokens"] for result in results),
+        "completion_tokens": sum(result["completion_tokens"] for result in results),
+        "retrievals": sum(result["retrievals"] for result in results),
+        "duplicate_documents_skipped": sum(result["duplicate_documents_skipped"] for result in results),
+        "distillations_skipped": sum(result["distillations_skipped"] for result in results),
+    }
+
+
+def run_batch(input_path, output_path, workers=4, recursion_limit=45, question_field="question", metrics_port=0, trace_dir=None):
+    """
+    Answers every question of a JSONL file with a pool of workers, writing each answer
+    and its stats to the output JSONL file as soon as it completes.
+
+    Returns:
+        The run summary.
+    """
+    if metrics_port:
+        serve_metrics(metrics_port)
+    if trace_dir:
+        os.makedirs(trace_dir, exist_ok=True)
+    retriever_registry.warm_up()
+    results = []
+    start_time = monotonic()
+    with open(output_path, 'w', encoding="utf-8") as output_file, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+
+        def write_done(done):
+            for future in done:
+                result = future.result()
+                results.append(result)
+                output_file.write(json.dumps(result) + "\n")
+                output_file.flush()
+                print(f"[{len(results)}] {result['id']}: {result['latency']:.1f}s, {result['llm_calls']} LLM calls")
+
+        # Only a few questions are read ahead of the workers, so large files are streamed
+        for question_id, question in read_questions(input_path, question_field):
+            pending.add(executor.submit(answer_question, question_id, question, recursion_limit, trace_dir))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                write_done(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            write_done(done)
+
+    summary = summarize_results(results, monotonic() - start_time)
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer the questions of a JSONL file with the agent workflow.")
+    parser.add_argument("input", help="JSONL file with one question per line")
+    parser.add_argument("output", help="JSONL file the answers and per question stats are written to")
+    parser.add_argument("--workers", type=int, default=4, help="number of questions answered concurrently")
+    parser.add_argument("--recursion-limit", type=int, default=45)
+    parser.add_argument("--question-field", default="question", help="field of the input lines holding the question")
+    parser.add_argument("--summary", help="optional JSON file the run summary is written to")
+    parser.add_argument("--metrics-port", type=int, default=EnvConfig.METRICS_PORT, help="port the Prometheus metrics are served on during the run, 0 disables it")
+    parser.add_argument("--trace-dir", help="optional directory a Chrome trace of every question is written to")
+    args = parser.parse_args()
+
+    summary = run_batch(args.input, args.output, args.workers, args.recursion_limit, args.question_field, args.metrics_port, args.trace_dir)
+    if args.summary:
+        with open(args.summary, 'w', encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
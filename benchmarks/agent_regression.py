@@ -0,0 +1,503 @@
+import argparse
+import asyncio
+import json
+import re
+import sys
+from time import monotonic
+
+from langchain_core.documents import Document
+
+from ..config import EnvConfig
+from ..utils.evidence import set_token_counter, set_evidence_embeddings
+from ..utils.hybrid_retriever import HybridRetriever
+from ..utils.lexical_index import BM25Index
+from ..utils.llm_clients import set_llm_factory
+from ..utils.retriever_registry import retriever_registry
+from ..utils.run_stats import RunStatsCallbackHandler
+from ..chains.plan_chain import can_be_answered, acan_be_answered
+from ..workflows.agent_workflow import build_agent_workflow, agent_nodes, async_agent_nodes
+from ..workflows.answer_workflow import ANSWER_NOT_FOUND
+from .local_embeddings import HashEmbeddings
+from .scripted_llm import Script, ScriptedChatModel, count_tokens
+
+DOCUMENTS = {
+    "chunks": [
+        Document(page_content="Ron Weasley sat down in Harry's compartment and they became best friends on the way to Hogwarts.", metadata={"page": 90}),
+        Document(page_content="Hermione Granger told them they had better change into their robes before arriving.", metadata={"page": 94}),
+    ],
+    "summaries": [
+        Document(page_content="Letters from Hogwarts keep arriving and Uncle Vernon hides them so Harry never learns he is a wizard.", metadata={"chapter": 3}),
+        Document(page_content="Hagrid finds Harry on the rock and tells him he is a wizard.", metadata={"chapter": 4}),
+    ],
+    "quotes": [
+        Document(page_content="Yer a wizard, Harry. And a thumpin' good one, I'd say, once yeh've been trained up a bit.", metadata={"page": 50}),
+        Document(page_content="No post on Sundays, Uncle Vernon reminded them happily as he spread marmalade on his newspapers.", metadata={"page": 40}),
+    ],
+}
+
+RETRIEVER_K = {"chunks": 1, "summaries": 1, "quotes": 10}
+
+
+def grounded(value):
+    return {"grounded": value, "explanation": "scripted"}
+
+
+def controller(can_be_answered, steps=(), tool="answer_from_context", query="", independent_steps=1):
+    return {"can_be_answered": can_be_answered, "steps": list(steps), "tool": tool, "query": query, "curr_context": "", "independent_steps": independent_steps}
+
+
+def by_prompt(pattern, outputs):
+    """
+    An output picked by what the prompt is about, for the calls of a chain made concurrently in the parallel
+    execution mode, whose order varies. The first outputs key contained in the pattern's group is picked.
+    """
+    def output(prompt):
+        subject = re.search(pattern, prompt, re.DOTALL).group(1)
+        for key, value in outputs.items():
+            if key in subject:
+                return value
+        raise ValueError(f"No scripted output for {subject!r}")
+    return output
+
+
+def by_task(outputs):
+    """A task handler output picked by the task of the prompt, see by_prompt."""
+    return by_prompt(r"receives a task (.*?) and have to decide", outputs)
+
+
+def by_query(outputs):
+    """A keep relevant content output picked by the query of the prompt, see by_prompt."""
+    return by_prompt(r"you receive a query: (.*?) and retrieved documents", outputs)
+
+
+def dependent_steps_scenario(name, dependent_step, independent_steps):
+    """
+    A parallel scenario whose second retrieval, worded as dependent_step, needs what the first one finds, so
+    they must run one after the other. The break down plan chain counts independent_steps independent leading
+    steps. The task handler has no output for dependent_step, so batching it with the first step fails the run.
+    """
+    return {
+        "name": name,
+        "execution_mode": "parallel",
+        "question": "Who is Harry's best friend and what did Hermione tell him?",
+        "responses": {
+            "anonymize_question": {"anonymized_question": "Who is X's best friend and what did Y tell him?", "mapping": {"X": "Harry", "Y": "Hermione"}, "explanation": "scripted"},
+            "planner": {"steps": ["Retrieve the book chunks about X's best friend.", "Retrieve the book chunks about what Y told that friend.", "Answer the question."]},
+            "break_down_plan": [
+                {"steps": ["Retrieve the book chunks about Harry's best friend.", dependent_step, "Answer the question."], "independent_steps": independent_steps},
+                {"steps": ["Retrieve the book chunks about what Hermione told Ron Weasley.", "Answer the question."]},
+            ],
+            "task_handler": by_task({
+                "Harry's best friend": {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+                "Ron Weasley": {"query": "Hermione told them", "curr_context": "", "tool": "retrieve_chunks"},
+            }),
+            "keep_relevant_content": by_query({
+                "best friend": {"relevant_content": "Ron Weasley and Harry became best friends."},
+                "Hermione": {"relevant_content": "Hermione Granger told them they had better change into their robes before arriving."},
+            }),
+            "is_distilled_content_grounded_on_content": grounded(True),
+            "replanner": [
+                {"plan": {"steps": ["Retrieve the book chunks about what Hermione told Ron Weasley.", "Answer the question."]}, "explanation": "scripted"},
+                {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            ],
+            "can_be_answered_already": [{"can_be_answered": False}, {"can_be_answered": True}],
+            "controller": [
+                controller(False, ["Retrieve the book chunks about what Hermione told Ron Weasley.", "Answer the question."], "retrieve_chunks", "Hermione told them"),
+                controller(True),
+            ],
+            "question_answer_from_context": {"answer_based_on_content": "Ron Weasley, Hermione told them to change into their robes."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "Ron Weasley, Hermione told them to change into their robes.",
+        "budget": {
+            "multi_call": {"llm_calls": 15, "prompt_tokens": 4600, "graph_steps": 10, "wall_time": 10.0},
+            "fused": {"llm_calls": 11, "prompt_tokens": 3350, "graph_steps": 9, "wall_time": 10.0},
+        },
+    }
+
+
+# Representative questions with the canned outputs of every chain and the budgets their run must stay within,
+# with each controller mode. The budgets leave a little room for prompt wording changes, an extra LLM round trip
+# or graph step exceeds them. Scenarios run with the serial plan execution mode unless they set another one, and
+# with the EnvConfig settings of main unless they override some.
+SCENARIOS = [
+    {
+        "name": "single_retrieval",
+        "question": "Who is Harry's best friend?",
+        "responses": {
+            "anonymize_question": {"anonymized_question": "Who is X's best friend?", "mapping": {"X": "Harry"}, "explanation": "scripted"},
+            "planner": {"steps": ["Retrieve the book chunks about X's friends.", "Answer who X's best friend is."]},
+            "break_down_plan": {"steps": ["Retrieve the book chunks about Harry's friends.", "Answer who Harry's best friend is."]},
+            "task_handler": {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+            "keep_relevant_content": {"relevant_content": "Ron Weasley and Harry became best friends."},
+            "is_distilled_content_grounded_on_content": grounded(True),
+            "replanner": {"plan": {"steps": ["Answer who Harry's best friend is."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": {"answer_based_on_content": "Ron Weasley."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "Ron Weasley.",
+        "budget": {
+            "multi_call": {"llm_calls": 10, "prompt_tokens": 3000, "graph_steps": 8, "wall_time": 10.0},
+            "fused": {"llm_calls": 9, "prompt_tokens": 2700, "graph_steps": 8, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "two_retrievals_with_grounding_retry",
+        "question": "Why did Uncle Vernon hide Harry's letters and what did Hagrid tell Harry?",
+        "responses": {
+            "anonymize_question": {
+                "anonymized_question": "Why did X hide Y's letters and what did Z tell Y?",
+                "mapping": {"X": "Uncle Vernon", "Y": "Harry", "Z": "Hagrid"},
+                "explanation": "scripted",
+            },
+            "planner": {"steps": ["Retrieve the chapter summaries about X hiding Y's letters.", "Retrieve the quotes of Z talking to Y.", "Answer the question."]},
+            "break_down_plan": [
+                {"steps": ["Retrieve the chapter summaries about Uncle Vernon hiding Harry's letters.", "Retrieve the quotes of Hagrid talking to Harry.", "Answer the question."]},
+                {"steps": ["Retrieve the quotes of Hagrid talking to Harry.", "Answer the question."]},
+            ],
+            "task_handler": [
+                {"query": "Uncle Vernon hides Harry's letters", "curr_context": "", "tool": "retrieve_summaries"},
+                {"query": "Hagrid tells Harry", "curr_context": "", "tool": "retrieve_quotes"},
+            ],
+            "keep_relevant_content": [
+                {"relevant_content": "Uncle Vernon hides the letters so Harry never learns he is a wizard."},
+                {"relevant_content": "Uncle Vernon hides the letters so Harry never learns he is a wizard."},
+                {"relevant_content": "Yer a wizard, Harry."},
+            ],
+            # The first distilled content is rejected once, so the retrieval workflow distills it again.
+            # The quote is kept verbatim, so it is accepted without the grounding LLM call
+            "is_distilled_content_grounded_on_content": [grounded(False), grounded(True)],
+            "replanner": [
+                {"plan": {"steps": ["Retrieve the quotes of Hagrid talking to Harry.", "Answer the question."]}, "explanation": "scripted"},
+                {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            ],
+            "can_be_answered_already": [{"can_be_answered": False}, {"can_be_answered": True}],
+            "controller": [
+                controller(False, ["Retrieve the quotes of Hagrid talking to Harry.", "Answer the question."], "retrieve_quotes", "Hagrid tells Harry"),
+                controller(True),
+            ],
+            "question_answer_from_context": {"answer_based_on_content": "To keep Harry from learning he is a wizard, which Hagrid told him."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "To keep Harry from learning he is a wizard, which Hagrid told him.",
+        "budget": {
+            "multi_call": {"llm_calls": 17, "prompt_tokens": 5200, "graph_steps": 12, "wall_time": 10.0},
+            "fused": {"llm_calls": 13, "prompt_tokens": 3950, "graph_steps": 10, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "ambiguous_placeholder_and_answer_step",
+        "question": "What did Hagrid call Harry?",
+        "responses": {
+            # 'A' is also an English word, so the steps using it are de-anonymized by the LLM
+            "anonymize_question": {"anonymized_question": "What did A call B?", "mapping": {"A": "Hagrid", "B": "Harry"}, "explanation": "scripted"},
+            "planner": {"steps": ["Find what A called B in the context.", "Answer the question."]},
+            "de_anonymize_plan": {"plan": ["Find what Hagrid called Harry in the context."]},
+            "break_down_plan": {"steps": ["Answer what Hagrid called Harry from the context.", "Answer the question."]},
+            "task_handler": {"query": "What did Hagrid call Harry?", "curr_context": "Hagrid told Harry he is a wizard.", "tool": "answer_from_context"},
+            "replanner": {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": {"answer_based_on_content": "A wizard."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "A wizard.",
+        "budget": {
+            "multi_call": {"llm_calls": 11, "prompt_tokens": 3200, "graph_steps": 8, "wall_time": 10.0},
+            "fused": {"llm_calls": 10, "prompt_tokens": 2850, "graph_steps": 8, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "repeated_lookup",
+        "question": "Who is Harry's best friend and who became his best friend on the train?",
+        "responses": {
+            "anonymize_question": {
+                "anonymized_question": "Who is X's best friend and who became his best friend on the train?",
+                "mapping": {"X": "Harry"},
+                "explanation": "scripted",
+            },
+            "planner": {"steps": ["Retrieve the book chunks about X's best friend.", "Retrieve the book chunks about X's friends on the train.", "Answer the question."]},
+            "break_down_plan": [
+                {"steps": ["Retrieve the book chunks about Harry's best friend.", "Retrieve the book chunks about Harry's friends on the train.", "Answer the question."]},
+                {"steps": ["Retrieve the book chunks about Harry's friends on the train.", "Answer the question."]},
+            ],
+            # The second lookup only finds the chunk the first one distilled, so it is not distilled again
+            "task_handler": [
+                {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+                {"query": "Who is Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+            ],
+            "keep_relevant_content": {"relevant_content": "Ron Weasley and Harry became best friends on the way to Hogwarts."},
+            "is_distilled_content_grounded_on_content": grounded(True),
+            "replanner": [
+                {"plan": {"steps": ["Retrieve the book chunks about Harry's friends on the train.", "Answer the question."]}, "explanation": "scripted"},
+                {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            ],
+            "can_be_answered_already": [{"can_be_answered": False}, {"can_be_answered": True}],
+            "controller": [
+                controller(False, ["Retrieve the book chunks about Harry's friends on the train.", "Answer the question."], "retrieve_chunks", "Who is Harry's best friend"),
+                controller(True),
+            ],
+            "question_answer_from_context": {"answer_based_on_content": "Ron Weasley, on the way to Hogwarts."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "Ron Weasley, on the way to Hogwarts.",
+        "budget": {
+            "multi_call": {"llm_calls": 14, "prompt_tokens": 4500, "graph_steps": 12, "wall_time": 10.0},
+            "fused": {"llm_calls": 10, "prompt_tokens": 3200, "graph_steps": 10, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "stubborn_hallucination",
+        "question": "Who is Harry's best friend?",
+        "responses": {
+            "anonymize_question": {"anonymized_question": "Who is X's best friend?", "mapping": {"X": "Harry"}, "explanation": "scripted"},
+            "planner": {"steps": ["Retrieve the book chunks about X's friends.", "Answer who X's best friend is."]},
+            "break_down_plan": {"steps": ["Retrieve the book chunks about Harry's friends.", "Answer who Harry's best friend is."]},
+            "task_handler": {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+            # Every distillation and answer is rejected, so both grounding loops stop at their retry cap
+            "keep_relevant_content": {"relevant_content": "Draco Malfoy is Harry's best friend."},
+            "is_distilled_content_grounded_on_content": grounded(False),
+            "replanner": {"plan": {"steps": ["Answer who Harry's best friend is."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": {"answer_based_on_content": "Draco Malfoy."},
+            "is_grounded_on_facts": {"grounded_on_facts": False},
+        },
+        "expected_answer": ANSWER_NOT_FOUND,
+        "budget": {
+            "multi_call": {"llm_calls": 18, "prompt_tokens": 5300, "graph_steps": 8, "wall_time": 10.0},
+            "fused": {"llm_calls": 17, "prompt_tokens": 5000, "graph_steps": 8, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "parallel_independent_retrievals",
+        "execution_mode": "parallel",
+        "question": "Why did Uncle Vernon hide Harry's letters and what did Hagrid tell Harry?",
+        "responses": {
+            "anonymize_question": {
+                "anonymized_question": "Why did X hide Y's letters and what did Z tell Y?",
+                "mapping": {"X": "Uncle Vernon", "Y": "Harry", "Z": "Hagrid"},
+                "explanation": "scripted",
+            },
+            "planner": {"steps": ["Retrieve the chapter summaries about X hiding Y's letters.", "Retrieve the quotes of Z talking to Y.", "Answer the question."]},
+            # Both retrievals run in one batch, the answer step is left out of it
+            "break_down_plan": {"steps": ["Retrieve the chapter summaries about Uncle Vernon hiding Harry's letters.", "Retrieve the quotes of Hagrid talking to Harry.", "Answer the question."], "independent_steps": 2},
+            "task_handler": by_task({
+                "Uncle Vernon": {"query": "Uncle Vernon hides Harry's letters", "curr_context": "", "tool": "retrieve_summaries"},
+                "Hagrid": {"query": "Hagrid tells Harry", "curr_context": "", "tool": "retrieve_quotes"},
+            }),
+            "keep_relevant_content": by_query({
+                "Uncle Vernon": {"relevant_content": "Uncle Vernon hides the letters so Harry never learns he is a wizard."},
+                "Hagrid": {"relevant_content": "Yer a wizard, Harry."},
+            }),
+            "is_distilled_content_grounded_on_content": grounded(True),
+            "replanner": {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": {"answer_based_on_content": "To keep Harry from learning he is a wizard, which Hagrid told him."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "To keep Harry from learning he is a wizard, which Hagrid told him.",
+        "budget": {
+            "multi_call": {"llm_calls": 12, "prompt_tokens": 3700, "graph_steps": 7, "wall_time": 10.0},
+            "fused": {"llm_calls": 11, "prompt_tokens": 3350, "graph_steps": 7, "wall_time": 10.0},
+        },
+    },
+    # The break down plan chain wrongly counts both retrievals as independent, the wording of the second one
+    # still keeps it out of the batch
+    dependent_steps_scenario("parallel_dependent_steps", "Retrieve the book chunks about what Hermione told that friend.", 2),
+    dependent_steps_scenario("parallel_dependent_step_found_above", "Retrieve the book chunks about what Hermione told Harry's friend, using the name found above.", 2),
+    # Nothing in the wording of the second retrieval shows it depends on the first, the count alone keeps it out of the batch
+    dependent_steps_scenario("parallel_undeclared_dependency", "Retrieve the book chunks about what Hermione told Harry's closest friend.", 1),
+    {
+        "name": "parallel_overlapping_retrievals",
+        "execution_mode": "parallel",
+        "question": "Who is Harry's best friend and how did Ron Weasley meet Harry?",
+        "responses": {
+            "anonymize_question": {"anonymized_question": "Who is X's best friend and how did Y meet X?", "mapping": {"X": "Harry", "Y": "Ron Weasley"}, "explanation": "scripted"},
+            "planner": {"steps": ["Retrieve the book chunks about X's best friend.", "Retrieve the book chunks about Y meeting X.", "Answer the question."]},
+            # Both retrievals of the batch find the same chunk: both distilled contexts are kept and the chunk is counted once
+            "break_down_plan": {"steps": ["Retrieve the book chunks about Harry's best friend.", "Retrieve the book chunks about Ron Weasley meeting Harry.", "Answer the question."], "independent_steps": 2},
+            "task_handler": by_task({
+                "best friend": {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+                "Ron Weasley": {"query": "Ron Weasley sat down in Harry's compartment", "curr_context": "", "tool": "retrieve_chunks"},
+            }),
+            "keep_relevant_content": by_query({
+                "best friend": {"relevant_content": "Ron Weasley and Harry became best friends."},
+                "compartment": {"relevant_content": "Ron Weasley sat down in Harry's compartment and they became best friends on the way to Hogwarts."},
+            }),
+            "is_distilled_content_grounded_on_content": grounded(True),
+            "replanner": {"plan": {"steps": ["Answer the question."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": {"answer_based_on_content": "Ron Weasley, they met in Harry's compartment."},
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "Ron Weasley, they met in Harry's compartment.",
+        "expected_evidence": 2,
+        "expected_duplicates": 1,
+        "budget": {
+            "multi_call": {"llm_calls": 12, "prompt_tokens": 3600, "graph_steps": 7, "wall_time": 10.0},
+            "fused": {"llm_calls": 11, "prompt_tokens": 3250, "graph_steps": 7, "wall_time": 10.0},
+        },
+    },
+    {
+        "name": "evidence_over_budget",
+        "question": "Who is Harry's best friend?",
+        # No evidence item fits in the budget, the most similar one still reaches the prompts truncated
+        "settings": {"EVIDENCE_TOKEN_BUDGET": 8},
+        "responses": {
+            "anonymize_question": {"anonymized_question": "Who is X's best friend?", "mapping": {"X": "Harry"}, "explanation": "scripted"},
+            "planner": {"steps": ["Retrieve the book chunks about X's friends.", "Answer who X's best friend is."]},
+            "break_down_plan": {"steps": ["Retrieve the book chunks about Harry's friends.", "Answer who Harry's best friend is."]},
+            "task_handler": {"query": "Harry's best friend", "curr_context": "", "tool": "retrieve_chunks"},
+            "keep_relevant_content": {"relevant_content": "Ron Weasley sat down in Harry's compartment and they became best friends on the way to Hogwarts."},
+            "replanner": {"plan": {"steps": ["Answer who Harry's best friend is."]}, "explanation": "scripted"},
+            "can_be_answered_already": {"can_be_answered": True},
+            "controller": controller(True),
+            "question_answer_from_context": lambda prompt: {
+                "answer_based_on_content": "Ron Weasley." if "Ron Weasley sat down" in prompt else ANSWER_NOT_FOUND,
+            },
+            "is_grounded_on_facts": {"grounded_on_facts": True},
+        },
+        "expected_answer": "Ron Weasley.",
+        "budget": {
+            "multi_call": {"llm_calls": 10, "prompt_tokens": 3000, "graph_steps": 8, "wall_time": 10.0},
+            "fused": {"llm_calls": 9, "prompt_tokens": 2700, "graph_steps": 8, "wall_time": 10.0},
+        },
+    },
+]
+
+
+def register_scripted_retrievers():
+    """Replaces the FAISS retrievers by BM25 searches over the canned documents, no index or embedding model is needed."""
+    for name, documents in DOCUMENTS.items():
+        lexical_index = BM25Index(documents)
+        retriever_registry.register(
+            name, lambda lexical_index=lexical_index, k=RETRIEVER_K[name]: HybridRetriever(lexical_index=lexical_index, mode="lexical", k=k),
+        )
+
+
+def build_apps(controller_mode, execution_mode="serial"):
+    """Compiles the sync and async agent graphs with the given controller and plan execution modes."""
+    return (build_agent_workflow(agent_nodes, can_be_answered, execution_mode, controller_mode).compile(),
+            build_agent_workflow(async_agent_nodes, acan_be_answered, execution_mode, controller_mode).compile())
+
+
+def run_scenario(scenario, apps, use_async=False, recursion_limit=45):
+    """
+    Runs the question of a scenario through the agent workflow with the scripted chat model.
+    apps are the sync and async graphs, see build_apps.
+
+    Returns:
+        The measures of the run: LLM calls (in total and per chain), prompt tokens, graph steps, wall time,
+        documents and distillations skipped by the retrieval dedup, evidence items and answer.
+    """
+    script = Script(scenario["responses"])
+    set_llm_factory(lambda deployment, **kwargs: ScriptedChatModel(script=script))
+    stats = RunStatsCallbackHandler()
+    config = {"recursion_limit": recursion_limit, "callbacks": [stats]}
+    inputs = {"question": scenario["question"]}
+    updates = []
+    plan_and_execute_app, async_plan_and_execute_app = apps
+
+    async def astream():
+        async for update in async_plan_and_execute_app.astream(inputs, config=config):
+            updates.append(update)
+
+    settings = scenario.get("settings", {})
+    defaults = {name: getattr(EnvConfig, name) for name in settings}
+    for name, value in settings.items():
+        setattr(EnvConfig, name, value)
+    start_time = monotonic()
+    try:
+        if use_async:
+            asyncio.run(astream())
+        else:
+            updates.extend(plan_and_execute_app.stream(inputs, config=config))
+    finally:
+        for name, value in defaults.items():
+            setattr(EnvConfig, name, value)
+    wall_time = monotonic() - start_time
+
+    final_state = next(iter(updates[-1].values()))
+    return {
+        "llm_calls": stats.llm_calls,
+        "prompt_tokens": stats.prompt_tokens,
+        "graph_steps": len(updates),
+        "wall_time": round(wall_time, 3),
+        "duplicate_documents_skipped": stats.duplicate_documents_skipped,
+        "distillations_skipped": stats.distillations_skipped,
+        "evidence_items": len(final_state["evidence"] or []),
+        "answer": final_state["response"],
+        "calls_per_chain": dict(script.calls),
+    }
+
+
+def check_budget(scenario, controller_mode, measures):
+    """Returns the list of budget violations and unexpected answers of a scenario run."""
+    failures = [
+        f"{name} {measures[name]} exceeds the budget of {limit}"
+        for name, limit in scenario["budget"][controller_mode].items() if measures[name] > limit
+    ]
+    if measures["answer"] != scenario["expected_answer"]:
+        failures.append(f"answer {measures['answer']!r} differs from {scenario['expected_answer']!r}")
+    if "expected_evidence" in scenario and measures["evidence_items"] != scenario["expected_evidence"]:
+        failures.append(f"{measures['evidence_items']} evidence items instead of {scenario['expected_evidence']}")
+    if "expected_duplicates" in scenario and measures["duplicate_documents_skipped"] != scenario["expected_duplicates"]:
+        failures.append(f"{measures['duplicate_documents_skipped']} duplicate documents instead of {scenario['expected_duplicates']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the agent on scripted questions offline and check its LLM call, token, step and time budgets.")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="both", help="graph to run the scenarios with")
+    parser.add_argument("--controller-mode", choices=["multi_call", "fused", "both"], default="both", help="controller of the agent loop, see CONTROLLER_MODE")
+    parser.add_argument("--scenarios", nargs="*", help="names of the scenarios to run, all by default")
+    parser.add_argument("--output", help="optional JSON file the measures are written to")
+    args = parser.parse_args()
+
+    EnvConfig.LLM_CACHE_ENABLED = False
+    EnvConfig.DEANONYMIZE_MODE = "local"
+    EnvConfig.DISTILLATION_MAX_RETRIES = 2
+    EnvConfig.ANSWER_MAX_RETRIES = 2
+    EnvConfig.MAX_PARALLEL_STEPS = 4
+    register_scripted_retrievers()
+    set_token_counter(count_tokens)
+    set_evidence_embeddings(HashEmbeddings())
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    controller_modes = ["multi_call", "fused"] if args.controller_mode == "both" else [args.controller_mode]
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenarios or scenario["name"] in args.scenarios]
+
+    results = []
+    failed = False
+    try:
+        for controller_mode in controller_modes:
+            apps = {execution_mode: build_apps(controller_mode, execution_mode) for execution_mode in ["serial", "parallel"]}
+            for scenario in scenarios:
+                for mode in modes:
+                    measures = run_scenario(scenario, apps[scenario.get("execution_mode", "serial")], use_async=mode == "async")
+                    failures = check_budget(scenario, controller_mode, measures)
+                    failed = failed or bool(failures)
+                    results.append({"scenario": scenario["name"], "mode": mode, "controller_mode": controller_mode,
+                                    "budget": scenario["budget"][controller_mode], **measures, "failures": failures})
+                    status = "FAIL" if failures else "ok"
+                    print(f"[{status}] {scenario['name']} ({mode}, {controller_mode}): {measures['llm_calls']} LLM calls, {measures['prompt_tokens']} prompt tokens, "
+                          f"{measures['graph_steps']} graph steps, {measures['wall_time']}s")
+                    for failure in failures:
+                        print(f"    {failure}")
+    finally:
+        set_llm_factory(None)
+        set_token_counter(None)
+        set_evidence_embeddings(None)
+
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
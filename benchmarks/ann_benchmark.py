@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import tempfile
+from time import monotonic
+
+import faiss
+import numpy as np
+
+from ..utils.ann_index import ANN_INDEX_TYPES, ANN_INDEX_PARAMS, DEFAULT_ANN_PARAMS, HnswlibVectorStore, create_faiss_index, apply_search_params
+from ..utils.helper_functions import parse_key_value_pairs
+from ..utils.run_stats import percentile
+
+
+def synthetic_corpus(num_vectors, num_queries, dimension, num_clusters=50, seed=0):
+    """
+    Generates clustered random vectors standing in for document embeddings, and queries drawn near them.
+
+    Returns:
+        A (vectors, queries) tuple of float32 arrays.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dimension))
+    vectors = centers[rng.integers(num_clusters, size=num_vectors)] + 0.5 * rng.normal(size=(num_vectors, dimension))
+    queries = vectors[rng.integers(num_vectors, size=num_queries)] + 0.1 * rng.normal(size=(num_queries, dimension))
+    return vectors.astype("float32"), queries.astype("float32")
+
+
+def parse_index_config(text):
+    """Parses an index configuration written as 'type' or 'type:param=value,param=value'."""
+    index_type, _, params_text = text.partition(":")
+    if index_type not in ANN_INDEX_TYPES:
+        raise ValueError(f"Invalid index type '{index_type}'. Must be one of {', '.join(ANN_INDEX_TYPES)}")
+    overrides = parse_key_value_pairs(params_text)
+    params = {param: overrides.get(param, DEFAULT_ANN_PARAMS[param]) for param in ANN_INDEX_PARAMS[index_type]}
+    return index_type, params
+
+
+class FaissBenchmarkIndex:
+    def __init__(self, index_type, params, vectors):
+        self.index = create_faiss_index(vectors.shape[1], index_type, params, len(vectors))
+        if not self.index.is_trained:
+            self.index.train(vectors)
+        self.index.add(vectors)
+        apply_search_params(self.index, index_type, params)
+
+    def memory_bytes(self):
+        return int(faiss.serialize_index(self.index).nbytes)
+
+    def search(self, query, k):
+        _, labels = self.index.search(query.reshape(1, -1), k)
+        return labels[0]
+
+
+class HnswlibBenchmarkIndex:
+    def __init__(self, params, vectors):
+        self.index = HnswlibVectorStore.create_index(vectors.shape[1], len(vectors), params["hnsw_m"], params["ef_construction"])
+        self.index.add_items(vectors, np.arange(len(vectors)))
+        self.ef_search = params["ef_search"]
+
+    def memory_bytes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.hnswlib")
+            self.index.save_index(path)
+            return os.path.getsize(path)
+
+    def search(self, query, k):
+        self.index.set_ef(max(self.ef_search, k))
+        labels, _ = self.index.knn_query(query.reshape(1, -1), k=k)
+        return labels[0]
+
+
+def benchmark_index(index_type, params, vectors, queries, ground_truth, k):
+    """
+    Builds an index over the vectors, then times every query and measures its recall@k against the exact neighbors.
+
+    Returns:
+        A dict of the build time, memory footprint, query latency percentiles and mean recall@k.
+    """
+    start_time = monotonic()
+    if index_type == "hnswlib":
+        index = HnswlibBenchmarkIndex(params, vectors)
+    else:
+        index = FaissBenchmarkIndex(index_type, params, vectors)
+    build_time = monotonic() - start_time
+
+    latencies = []
+    recalls = []
+    for query, expected in zip(queries, ground_truth):
+        start_time = monotonic()
+        labels = index.search(query, k)
+        latencies.append((monotonic() - start_time) * 1000)
+        recalls.append(len(set(labels.tolist()) & set(expected.tolist())) / k)
+
+    return {
+        "index_type": index_type,
+        "params": params,
+        "build_time": round(build_time, 3),
+        "memory_mb": round(index.memory_bytes() / (1024 * 1024), 2),
+        "latency_p50_ms": round(percentile(latencies, 50), 3),
+        "latency_p95_ms": round(percentile(latencies, 95), 3),
+        "latency_p99_ms": round(percentile(latencies, 99), 3),
+        f"recall@{k}": round(sum(recalls) / len(recalls), 4),
+    }
+
+
+def run_benchmark(index_configs, num_vectors=20000, num_queries=200, dimension=1024, k=10, seed=0):
+    """
+    Benchmarks index configurations on a synthetic corpus, the exact flat index being the recall baseline.
+
+    Args:
+        index_configs: A list of (index type, parameters) tuples.
+        num_vectors: The size of the corpus.
+        num_queries: The number of queries timed.
+        dimension: The dimension of the vectors, 1024 like GIST-large embeddings.
+        k: The number of neighbors searched.
+        seed: The seed of the synthetic corpus.
+
+    Returns:
+        The list of the results of every configuration.
+    """
+    vectors, queries = synthetic_corpus(num_vectors, num_queries, dimension, seed=seed)
+    baseline = faiss.IndexFlatL2(dimension)
+    baseline.add(vectors)
+    _, ground_truth = baseline.search(queries, k)
+
+    results = []
+    for index_type, params in index_configs:
+        print(f"Benchmarking {index_type} {params}...")
+        result = benchmark_index(index_type, params, vectors, queries, ground_truth, k)
+        print(result)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the build time, memory, latency and recall of the ANN index types.")
+    parser.add_argument("--indexes", nargs="+", default=list(ANN_INDEX_TYPES),
+                        help="index configurations, e.g. flat ivf:nlist=256,nprobe=16 hnsw:ef_search=128 hnswlib")
+    parser.add_argument("--vectors", type=int, default=20000, help="number of vectors of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="optional JSON file the results are written to")
+    args = parser.parse_args()
+
+    index_configs = [parse_index_config(text) for text in args.indexes]
+    results = run_benchmark(index_configs, args.vectors, args.queries, args.dimension, args.k, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+
+import faiss
+import numpy as np
+
+from ..utils.ann_index import ANN_INDEX_TYPES, DEFAULT_ANN_PARAMS, ANN_INDEX_PARAMS, create_faiss_index, apply_search_params
+from .ann_benchmark import synthetic_corpus
+
+
+def book_corpus(path, num_queries, seed=0):
+    """
+    Embeds the chunks of a PDF with the shared embedding model. The queries are the beginnings of random chunks.
+
+    Returns:
+        A (vectors, queries) tuple of float32 arrays.
+    """
+    from ..utils.embeddings import get_embedding_service
+    from ..utils.ingestion import ingest_pdf, chunk_documents
+
+    embeddings = get_embedding_service()
+    chunks = chunk_documents(ingest_pdf(path), chunk_size=1000, chunk_overlap=200)
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    rng = np.random.default_rng(seed)
+    query_texts = [chunks[i].page_content[:200] for i in rng.integers(len(chunks), size=num_queries)]
+    queries = embeddings.embed_documents(query_texts)
+    return np.asarray(vectors, dtype="float32"), np.asarray(queries, dtype="float32")
+
+
+def build_index(vectors, index_type, compaction):
+    params = {param: DEFAULT_ANN_PARAMS[param] for param in ANN_INDEX_PARAMS[index_type]}
+    index = create_faiss_index(vectors.shape[1], index_type, params, len(vectors), compaction)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    apply_search_params(index, index_type, params)
+    return index
+
+
+def compaction_report(vectors, queries, compactions, index_type="flat", k=10):
+    """
+    Compares compacted indexes with the full precision index of the same type on the same queries.
+
+    Args:
+        vectors: The indexed vectors.
+        queries: The query vectors.
+        compactions: The compactions to compare, see utils.ann_index.parse_compaction.
+        index_type: 'flat', 'ivf' or 'hnsw'.
+        k: The number of neighbors searched.
+
+    Returns:
+        The list of the reports of every compaction: memory, memory saved, the share of queries whose
+        first result is unchanged and the mean overlap of the top k results with the full precision ones.
+    """
+    full_index = build_index(vectors, index_type, None)
+    full_bytes = faiss.serialize_index(full_index).nbytes
+    _, full_labels = full_index.search(queries, k)
+
+    reports = []
+    for compaction in compactions:
+        index = build_index(vectors, index_type, compaction)
+        index_bytes = faiss.serialize_index(index).nbytes
+        _, labels = index.search(queries, k)
+        overlaps = [len(set(row.tolist()) & set(full_row.tolist())) / k for row, full_row in zip(labels, full_labels)]
+        report = {
+            "compaction": compaction,
+            "index_type": index_type,
+            "memory_mb": round(index_bytes / (1024 * 1024), 2),
+            "full_memory_mb": round(full_bytes / (1024 * 1024), 2),
+            "memory_saved": round(1 - index_bytes / full_bytes, 4),
+            "top1_agreement": round(float(np.mean(labels[:, 0] == full_labels[:, 0])), 4),
+            f"overlap@{k}": round(sum(overlaps) / len(overlaps), 4),
+        }
+        print(report)
+        reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory saved by compacted indexes and their agreement with the full precision index.")
+    parser.add_argument("--compactions", nargs="+", default=["fp16", "pca256", "pca256+fp16"])
+    parser.add_argument("--index-type", default="flat", choices=[index_type for index_type in ANN_INDEX_TYPES if index_type != "hnswlib"])
+    parser.add_argument("--pdf", help="embed the chunks of this PDF instead of using a synthetic corpus")
+    parser.add_argument("--vectors", type=int, default=20000, help="number of vectors of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=1024)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="optional JSON file the report is written to")
+    args = parser.parse_args()
+
+    if args.pdf:
+        vectors, queries = book_corpus(args.pdf, args.queries, args.seed)
+    else:
+        vectors, queries = synthetic_corpus(args.vectors, args.queries, args.dimension, seed=args.seed)
+    reports = compaction_report(vectors, queries, args.compactions, args.index_type, args.k)
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import sys
+
+from langchain_core.documents import Document
+
+from ..utils.ann_index import ANN_INDEX_PARAMS, DEFAULT_ANN_PARAMS, INCREMENTAL_INDEX_TYPES
+from ..utils.ann_index import build_vector_index, update_vector_index
+from .local_embeddings import HashEmbeddings
+
+
+def source_documents(start, count, prefix="source"):
+    """Documents with words of their own, so every one of them is the nearest neighbour of its own text."""
+    return [
+        Document(page_content=f"{prefix} {i} " + " ".join(f"{prefix}{i}word{j}" for j in range(8)), metadata={"position": i})
+        for i in range(start, start + count)
+    ]
+
+
+def check_index_update(index_type, compaction="none", num_documents=200, num_removed=60, num_added=40, dimension=256):
+    """
+    Builds an index, updates it like a changed PDF would (removing sources and adding new ones) and checks
+    that every current source is still returned for its own text, and that no removed one is.
+
+    Returns:
+        The list of the failures, empty when the updated index is consistent.
+    """
+    embeddings = HashEmbeddings(dimension)
+    params = {param: DEFAULT_ANN_PARAMS[param] for param in ANN_INDEX_PARAMS[index_type]}
+    documents = source_documents(0, num_documents)
+    ids = [f"source-{i}" for i in range(num_documents)]
+    vectorstore = build_vector_index(documents, embeddings, index_type, params, compaction, ids=ids)
+
+    # Every third source is removed until num_removed are gone, then num_added new ones are appended
+    removed = set(ids[::3][:num_removed])
+    kept = [(id, document) for id, document in zip(ids, documents) if id not in removed]
+    added = source_documents(num_documents, num_added, prefix="added")
+    sources = [document for _, document in kept] + added
+    source_ids = [id for id, _ in kept] + [f"added-{i}" for i in range(num_added)]
+    vectorstore = update_vector_index(vectorstore, sources, source_ids, lambda new_sources: new_sources)
+
+    failures = []
+    if vectorstore.index.ntotal != len(sources):
+        failures.append(f"the index holds {vectorstore.index.ntotal} vectors instead of {len(sources)}")
+    current = {document.page_content for document in sources}
+    for document in sources:
+        try:
+            results = vectorstore.similarity_search(document.page_content, k=1)
+        except KeyError as error:
+            failures.append(f"'{document.page_content[:20]}...' hit a position missing from the docstore mapping: {error}")
+            continue
+        if not results or results[0].page_content != document.page_content:
+            found = results[0].page_content[:20] if results else None
+            failures.append(f"'{document.page_content[:20]}...' returned '{found}...'")
+        elif results[0].page_content not in current:
+            failures.append(f"'{document.page_content[:20]}...' returned a removed document")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check offline that incrementally updated indexes return the right documents.")
+    parser.add_argument("--index-types", nargs="+", default=list(INCREMENTAL_INDEX_TYPES), choices=["flat", "ivf", "hnsw"])
+    parser.add_argument("--compactions", nargs="+", default=["none", "fp16"], help="see INDEX_COMPACTION")
+    parser.add_argument("--documents", type=int, default=200)
+    args = parser.parse_args()
+
+    failed = False
+    for index_type in args.index_types:
+        for compaction in args.compactions:
+            try:
+                failures = check_index_update(index_type, compaction, args.documents)
+            except RuntimeError as error:
+                failures = [f"update failed: {error}"]
+            print(f"[{'FAIL' if failures else 'ok'}] {index_type} ({compaction})")
+            for failure in failures[:5]:
+                print(f"  {failure}")
+            if len(failures) > 5:
+                print(f"  ... and {len(failures) - 5} more")
+            failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from time import monotonic
+
+from ..utils.ann_index import ANN_INDEX_TYPES, ANN_INDEX_PARAMS, DEFAULT_ANN_PARAMS, build_vector_index
+from ..utils.helper_functions import split_into_chapters, extract_book_quotes_as_documents
+from ..utils.index_store import file_content_hash
+from ..utils.ingestion import IngestedBook, extract_pages, chunk_documents, chapter_documents, quote_documents
+from ..utils.lexical_index import BM25Index
+from ..utils.run_stats import percentile
+from .local_embeddings import HashEmbeddings
+from .synthetic_pdf import write_synthetic_book
+
+DEFAULT_PDF_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hp1.pdf")
+
+
+def timed(function, repeat=1):
+    """Calls a function repeat times and returns its last result with the median duration in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start_time = monotonic()
+        result = function()
+        durations.append(monotonic() - start_time)
+    return result, statistics.median(durations)
+
+
+def peak_rss_mb():
+    """The peak resident set size of the process so far (ru_maxrss is in kilobytes on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if os.uname().sysname == "Darwin" else 1024), 1)
+
+
+def latency_percentiles(search, queries):
+    """Times search(query) for every query and returns the p50/p95/p99 latencies in milliseconds."""
+    latencies = []
+    for query in queries:
+        start_time = monotonic()
+        search(query)
+        latencies.append((monotonic() - start_time) * 1000)
+    return {f"p{p}_ms": round(percentile(latencies, p), 3) for p in (50, 95, 99)}
+
+
+def benchmark_pdf(path, embeddings, index_types, num_queries=100, k=4, repeat=3, workers=1, seed=0):
+    """
+    Benchmarks the ingestion of a PDF and the retrieval over it.
+
+    Args:
+        path: The path to the PDF.
+        embeddings: The embeddings used to build the indexes and embed the queries.
+        index_types: The vector index types to build and query.
+        num_queries: The number of queries timed, the beginnings of random chunks.
+        k: The number of documents retrieved per query.
+        repeat: The number of runs the parsing and extraction times are the median of.
+        workers: The number of processes extracting PDF pages.
+        seed: The seed of the query sampling.
+
+    Returns:
+        A flat dict of the measures.
+    """
+    results = {"pdf_bytes": os.path.getsize(path)}
+
+    pages, results["parse_time"] = timed(lambda: extract_pages(path, workers), repeat)
+    book = IngestedBook(path, file_content_hash(path), pages)
+    results["pages"] = len(pages)
+
+    chapters, results["split_into_chapters_time"] = timed(lambda: split_into_chapters(path), repeat)
+    _, results["extract_book_quotes_time"] = timed(lambda: extract_book_quotes_as_documents(chapters), repeat)
+    chunks, results["chunk_time"] = timed(lambda: chunk_documents(book), repeat)
+    chapter_docs, results["chapter_time"] = timed(lambda: chapter_documents(book), repeat)
+    quotes, results["quote_time"] = timed(lambda: quote_documents(book), repeat)
+    results.update(chunks=len(chunks), chapters=len(chapter_docs), quotes=len(quotes))
+
+    texts = [chunk.page_content for chunk in chunks]
+    _, embedding_time = timed(lambda: embeddings.embed_documents(texts))
+    results["embedding_docs_per_sec"] = round(len(texts) / embedding_time, 1) if embedding_time else None
+
+    rng = random.Random(seed)
+    queries = [rng.choice(texts)[:200] for _ in range(num_queries)]
+
+    for index_type in index_types:
+        params = {param: DEFAULT_ANN_PARAMS[param] for param in ANN_INDEX_PARAMS[index_type]}
+        vectorstore, results[f"{index_type}_build_time"] = timed(lambda: build_vector_index(chunks, embeddings, index_type, params))
+        for name, value in latency_percentiles(lambda query: vectorstore.similarity_search(query, k=k), queries).items():
+            results[f"{index_type}_query_{name}"] = value
+
+    lexical_index, results["bm25_build_time"] = timed(lambda: BM25Index(chunks))
+    for name, value in latency_percentiles(lambda query: lexical_index.search(query, k), queries).items():
+        results[f"bm25_query_{name}"] = value
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    return {name: round(value, 4) if isinstance(value, float) else value for name, value in results.items()}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(DEFAULT_PDF_PATH), capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(previous, current):
+    """Prints the relative change of every measure present in two benchmark result files."""
+    for source, measures in current["results"].items():
+        previous_measures = previous["results"].get(source)
+        if previous_measures is None:
+            continue
+        print(f"{source} ({previous.get('git_commit')} -> {current.get('git_commit')}):")
+        for name, value in measures.items():
+            previous_value = previous_measures.get(name)
+            if not isinstance(value, (int, float)) or not isinstance(previous_value, (int, float)) or not previous_value:
+                continue
+            print(f"  {name}: {previous_value} -> {value} ({(value - previous_value) / previous_value:+.1%})")
+
+
+def run_benchmark(pdf_paths, synthetic_pages, index_types, dimension=1024, num_queries=100, k=4, repeat=3, workers=1, seed=0):
+    """
+    Benchmarks the given PDFs and synthetic PDFs of the given numbers of pages, fully offline.
+
+    Returns:
+        The results, keyed by source name, with the commit and settings they were measured with.
+    """
+    embeddings = HashEmbeddings(dimension)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        sources = [(os.path.basename(path), path) for path in pdf_paths]
+        for num_pages in synthetic_pages:
+            path = os.path.join(directory, f"synthetic_{num_pages}p.pdf")
+            write_synthetic_book(path, num_pages, num_chapters=max(num_pages // 10, 1), seed=seed)
+            sources.append((f"synthetic_{num_pages}p", path))
+        for name, path in sources:
+            print(f"Benchmarking {name}...")
+            results[name] = benchmark_pdf(path, embeddings, index_types, num_queries, k, repeat, workers, seed)
+            print(results[name])
+    return {
+        "git_commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            "index_types": index_types, "dimension": dimension, "queries": num_queries, "k": k,
+            "repeat": repeat, "workers": workers, "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF ingestion and retrieval offline, with a local hashing embedding stand-in.")
+    parser.add_argument("--pdf", nargs="*", default=[DEFAULT_PDF_PATH] if os.path.exists(DEFAULT_PDF_PATH) else [])
+    parser.add_argument("--synthetic-pages", nargs="*", type=int, default=[100], help="sizes of the synthetic PDFs, in pages")
+    parser.add_argument("--index-types", nargs="+", default=["flat"], choices=ANN_INDEX_TYPES)
+    parser.add_argument("--dimension", type=int, default=1024, help="dimension of the stand-in embeddings")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="runs the parsing and extraction times are the median of")
+    parser.add_argument("--workers", type=int, default=1, help="processes extracting PDF pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="optional JSON file the results are written to")
+    parser.add_argument("--compare", help="optional JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.pdf, args.synthetic_pages, args.index_types, args.dimension, args.queries, args.k, args.repeat, args.workers, args.seed,
+    )
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding="utf-8") as f:
+            compare_results(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
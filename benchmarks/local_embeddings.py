@@ -0,0 +1,32 @@
+import hashlib
+import math
+import re
+
+from langchain_core.embeddings import Embeddings
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic offline stand-in for the embedding model: every token is hashed into one of `dimension`
+    buckets and the bag of tokens is L2 normalized. It has none of the model's quality, only its interface
+    and a comparable output size, so indexes and retrievers can be benchmarked without downloading the model.
+    """
+
+    def __init__(self, dimension=1024):
+        self.dimension = dimension
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimension
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            bucket = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[bucket % self.dimension] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
@@ -0,0 +1,106 @@
+import json
+import re
+import threading
+from typing import Any, Callable
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers.openai_tools import JsonOutputKeyToolsParser, PydanticToolsParser
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import BaseModel as BaseModelV1
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# A phrase only the prompt of each chain contains, checked in order (the replanner prompt also contains the planner's)
+PROMPT_SIGNATURES = [
+    ("controller", "You are the controller of an agent"),
+    ("replanner", "Your original plan was this"),
+    ("anonymize_question", "You are a question anonymizer"),
+    ("de_anonymize_plan", "replace all the variables in the list of tasks"),
+    ("break_down_plan", "you need to go through the plan refine it"),
+    ("planner", "come up with a simple step by step plan"),
+    ("task_handler", "You are a task handler"),
+    ("keep_relevant_content", "You need to filter out all the non relevant information"),
+    ("is_distilled_content_grounded_on_content", "you need to determine if the distilled content is grounded"),
+    ("can_be_answered_already", "determine if the question can be fully answered"),
+    ("question_answer_from_context", "just like in the previous examples"),
+    ("answer", "Examples of Chain-of-Thought Reasoning"),
+    ("is_grounded_on_facts", "You are a fact-checker"),
+]
+
+
+def count_tokens(text):
+    """Approximates the token count of a text by its words and punctuation marks, so budgets need no tokenizer download."""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def identify_chain(prompt):
+    """Returns the name of the chain a rendered prompt belongs to."""
+    for chain_name, signature in PROMPT_SIGNATURES:
+        if signature in prompt:
+            return chain_name
+    raise ValueError(f"Unknown prompt, update PROMPT_SIGNATURES: {prompt[:200]!r}")
+
+
+class Script:
+    """
+    Canned outputs of every chain. The outputs of a chain are returned in order, the last one being
+    repeated once they run out. An output is a dict or a callable (prompt) returning a dict.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, chain_name, prompt):
+        if chain_name not in self.responses:
+            raise ValueError(f"No scripted output for the '{chain_name}' chain")
+        outputs = self.responses[chain_name]
+        outputs = outputs if isinstance(outputs, list) else [outputs]
+        with self._lock:
+            call = self.calls.get(chain_name, 0)
+            self.calls[chain_name] = call + 1
+        output = outputs[min(call, len(outputs) - 1)]
+        return output(prompt) if callable(output) else output
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Local chat model answering every chain with the output of a script instead of calling a deployment.
+    Structured output chains get the output as a tool call of the bound schema, JSON parser chains as the
+    message text, and token usage is reported like AzureChatOpenAI does.
+    """
+
+    script: Callable[[str, str], Any]
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs):
+        """Parses the tool call like AzureChatOpenAI does: pydantic v1 schemas into objects, other schemas into dicts."""
+        llm = self.bind_tools([schema], tool_choice="any")
+        if isinstance(schema, type) and issubclass(schema, BaseModelV1):
+            parser = PydanticToolsParser(tools=[schema], first_tool_only=True)
+        else:
+            parser = JsonOutputKeyToolsParser(key_name=convert_to_openai_tool(schema)["function"]["name"], first_tool_only=True)
+        return llm | parser
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(message.content for message in messages)
+        output = self.script(identify_chain(prompt), prompt)
+        completion = json.dumps(output)
+        tools = kwargs.get("tools")
+        if tools:
+            tool_call = {"name": tools[0]["function"]["name"], "args": output, "id": "call_scripted"}
+            message = AIMessage(content="", tool_calls=[tool_call])
+        else:
+            message = AIMessage(content=completion)
+        token_usage = {"prompt_tokens": count_tokens(prompt), "completion_tokens": count_tokens(completion)}
+        token_usage["total_tokens"] = token_usage["prompt_tokens"] + token_usage["completion_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": token_usage})
@@ -0,0 +1,105 @@
+import random
+
+NUMBER_WORDS = [
+    "ONE", "TWO", "THREE", "FOUR", "FIVE", "SIX", "SEVEN", "EIGHT", "NINE", "TEN",
+    "ELEVEN", "TWELVE", "THIRTEEN", "FOURTEEN", "FIFTEEN", "SIXTEEN", "SEVENTEEN", "EIGHTEEN", "NINETEEN",
+]
+TENS_WORDS = ["TWENTY", "THIRTY", "FORTY", "FIFTY", "SIXTY", "SEVENTY", "EIGHTY", "NINETY"]
+
+VOCABULARY = (
+    "the a of and to in was he she it that his her they said had with for at on as but not be have from "
+    "wizard castle letter owl wand broom train school house forest dragon stone cupboard street window "
+    "door night morning table uncle aunt cousin friend teacher garden snake mirror key lesson match "
+    "quickly slowly suddenly quietly never always again only still very little great old new dark"
+).split()
+
+LINE_WIDTH = 90
+LINES_PER_PAGE = 60
+
+
+def number_words(number):
+    """Spells a chapter number the way chapter titles do ('TWENTY ONE'), up to 99."""
+    if number < 20:
+        return NUMBER_WORDS[number - 1]
+    tens, units = divmod(number, 10)
+    return TENS_WORDS[tens - 2] + (f" {NUMBER_WORDS[units - 1]}" if units else "")
+
+
+def synthetic_book_lines(num_pages, num_chapters, seed=0):
+    """
+    Generates the lines of a book: every chapter starts on a new page with a 'CHAPTER <NUMBER>' title, and
+    paragraphs of random words contain quotes long enough to be extracted.
+
+    Returns:
+        A list of pages, each a list of lines.
+    """
+    rng = random.Random(seed)
+    chapter_starts = {round(i * num_pages / num_chapters) for i in range(num_chapters)}
+    pages = []
+    chapter = 0
+    for page_number in range(num_pages):
+        lines = []
+        if page_number in chapter_starts:
+            chapter += 1
+            lines += [f"CHAPTER {number_words(chapter)}", ""]
+        while len(lines) < LINES_PER_PAGE:
+            words = [rng.choice(VOCABULARY) for _ in range(rng.randint(60, 120))]
+            if rng.random() < 0.5:
+                start = rng.randrange(len(words) - 15)
+                words[start] = "“" + words[start]
+                words[start + 14] = words[start + 14] + "”"
+            line = ""
+            for word in words:
+                if len(line) + len(word) + 1 > LINE_WIDTH:
+                    lines.append(line)
+                    line = ""
+                line = f"{line} {word}" if line else word
+            lines += [line, ""]
+        pages.append(lines[:LINES_PER_PAGE])
+    return pages
+
+
+def _escape(line):
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """
+    Writes a minimal PDF with one Helvetica text page per list of lines. Text is encoded with WinAnsiEncoding,
+    so curly quotes survive text extraction.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # The page tree, written once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_numbers = []
+    for lines in pages:
+        text = "".join(f"({_escape(line)}) Tj T*\n" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td\n{text}ET".encode("cp1252")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects)
+        )
+        page_numbers.append(len(objects))
+    kids = " ".join(f"{number} 0 R" for number in page_numbers)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode()
+
+    content = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref_offset = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def write_synthetic_book(path, num_pages=100, num_chapters=10, seed=0):
+    """Writes a synthetic book PDF with chapters and quotes, see synthetic_book_lines."""
+    write_pdf(path, synthetic_book_lines(num_pages, num_chapters, seed))
+    return path
@@ -1,10 +1,10 @@
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
 from pprint import pprint
 
-from ..config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
 from ..models.state_models import PlanExecute
 
 
@@ -28,6 +28,7 @@ anonymize_question_prompt_template = """ You are a question anonymizer. The inpu
   output the anonymized question and the mapping in a json format. {format_instructions}"""
 
 
+@cached_chain
 def init_anonymize_question_chain():
     anonymize_question_prompt = PromptTemplate(
         template=anonymize_question_prompt_template,
@@ -35,14 +36,9 @@ def init_anonymize_question_chain():
         partial_variables={"format_instructions": anonymize_question_parser.get_format_instructions()},
     )
 
-    anonymize_question_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    anonymize_question_llm = get_llm()
     
-    anonymize_question_chain = anonymize_question_prompt | anonymize_question_llm | anonymize_question_parser
+    anonymize_question_chain = anonymize_question_prompt | with_response_cache(anonymize_question_llm | anonymize_question_parser, "anonymize_question", AnonymizeQuestion)
     return anonymize_question_chain
 
 def anonymize_queries(state: PlanExecute):
@@ -58,6 +54,19 @@ def anonymize_queries(state: PlanExecute):
     pprint("--------------------")
     anonymize_question_chain = init_anonymize_question_chain()
     anonymized_question_output = anonymize_question_chain.invoke(state.question)
+    return apply_anonymized_question(state, anonymized_question_output)
+
+async def aanonymize_queries(state: PlanExecute):
+    """Async version of anonymize_queries."""
+    state.curr_state = "anonymize_question"
+    print("Anonymizing question")
+    pprint("--------------------")
+    anonymize_question_chain = init_anonymize_question_chain()
+    anonymized_question_output = await anonymize_question_chain.ainvoke(state.question)
+    return apply_anonymized_question(state, anonymized_question_output)
+
+def apply_anonymized_question(state: PlanExecute, anonymized_question_output):
+    """Updates the state with the output of the anonymize question chain."""
     anonymized_question = anonymized_question_output["anonymized_question"]
     print(f'anonimized_querry: {anonymized_question}')
     pprint("--------------------")
@@ -1,7 +1,8 @@
 from langchain.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import AzureChatOpenAI
-from ..config.env_config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
+from ..config import EnvConfig
 
 class QuestionAnswerFromContext(BaseModel):
     answer_based_on_content: str = Field(description="Answer generated from context")
@@ -16,18 +17,14 @@ Context
 Question
 {question}
 """
+@cached_chain
 def init_answer_chains():
-    llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    llm = get_llm()
     answer_prompt = PromptTemplate(
         template=cot_template,
         input_variables=["context", "question"],
     )
-    answer_chain = answer_prompt | llm.with_structured_output(QuestionAnswerFromContext)
+    answer_chain = answer_prompt | with_response_cache(llm.with_structured_output(QuestionAnswerFromContext), "answer", QuestionAnswerFromContext, cacheable=False)
     return answer_chain
 
 class QuestionAnswerFromContext(BaseModel):
@@ -78,18 +75,19 @@ Question
 {question}
 """
 
+@cached_chain
 def init_question_answer_from_context_chain():
-    question_answer_from_context_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    question_answer_from_context_llm = get_llm()
     question_answer_from_context_cot_prompt = PromptTemplate(
         template=question_answer_cot_prompt_template,
         input_variables=["context", "question"],
     )
-    question_answer_from_context_cot_chain = question_answer_from_context_cot_prompt | question_answer_from_context_llm.with_structured_output(QuestionAnswerFromContext)
+    question_answer_from_context_cot_chain = question_answer_from_context_cot_prompt | with_response_cache(
+        question_answer_from_context_llm.with_structured_output(QuestionAnswerFromContext),
+        "question_answer_from_context",
+        QuestionAnswerFromContext,
+        cacheable=False,  # Final answers are sampled again on purpose when they were not grounded
+    )
     return question_answer_from_context_cot_chain
 
 def answer_question_from_context(state):
@@ -117,7 +115,24 @@ def answer_question_from_context(state):
     output = question_answer_from_context_cot_chain.invoke(input_data)
     answer = output.answer_based_on_content
     print(f'answer before checking hallucination: {answer}')
-    return {"answer": answer, "context": context, "question": question}
+    return {"answer": answer, "context": context, "question": question, "attempts": (state.get("attempts") or 0) + 1}
+
+async def aanswer_question_from_context(state):
+    """Async version of answer_question_from_context."""
+    question = state["question"]
+    context = state["aggregated_context"] if "aggregated_context" in state else state["context"]
+
+    input_data = {
+    "question": question,
+    "context": context
+}
+    print("Answering the question from the retrieved context...")
+
+    question_answer_from_context_cot_chain = init_question_answer_from_context_chain()
+    output = await question_answer_from_context_cot_chain.ainvoke(input_data)
+    answer = output.answer_based_on_content
+    print(f'answer before checking hallucination: {answer}')
+    return {"answer": answer, "context": context, "question": question, "attempts": (state.get("attempts") or 0) + 1}
 
 class is_grounded_on_facts(BaseModel):
     """
@@ -125,13 +140,9 @@ class is_grounded_on_facts(BaseModel):
     """
     grounded_on_facts: bool = Field(description="Answer is grounded in the facts, 'yes' or 'no'")
 
+@cached_chain
 def init_is_grounded_on_facts_chain():
-    is_grounded_on_facts_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    is_grounded_on_facts_llm = get_llm()
     is_grounded_on_facts_prompt_template = """You are a fact-checker that determines if the given answer {answer} is grounded in the given context {context}
     you don't mind if it doesn't make sense, as long as it is grounded in the context.
     output a json containing the answer to the question, and appart from the json format don't output any additional text.
@@ -141,7 +152,7 @@ def init_is_grounded_on_facts_chain():
         template=is_grounded_on_facts_prompt_template,
         input_variables=["context", "answer"],
     )
-    is_grounded_on_facts_chain = is_grounded_on_facts_prompt | is_grounded_on_facts_llm.with_structured_output(is_grounded_on_facts)
+    is_grounded_on_facts_chain = is_grounded_on_facts_prompt | with_response_cache(is_grounded_on_facts_llm.with_structured_output(is_grounded_on_facts), "is_grounded_on_facts", is_grounded_on_facts)
     return is_grounded_on_facts_chain
 
 def is_answer_grounded_on_context(state):
@@ -156,8 +167,22 @@ def is_answer_grounded_on_context(state):
     
     is_grounded_on_facts_chain = init_is_grounded_on_facts_chain()
     result = is_grounded_on_facts_chain.invoke({"context": context, "answer": answer})
+    return answer_grounded_decision(result, state.get("attempts") or 1)
+
+async def ais_answer_grounded_on_context(state):
+    """Async version of is_answer_grounded_on_context."""
+    print("Checking if the answer is grounded in the facts...")
+    is_grounded_on_facts_chain = init_is_grounded_on_facts_chain()
+    result = await is_grounded_on_facts_chain.ainvoke({"context": state["context"], "answer": state["answer"]})
+    return answer_grounded_decision(result, state.get("attempts") or 1)
+
+def answer_grounded_decision(result, attempts):
+    """Turns the output of the is grounded on facts chain and the number of answers made into the name of the next edge."""
     grounded_on_facts = result.grounded_on_facts
-    if not grounded_on_facts:
+    if not grounded_on_facts and attempts > EnvConfig.ANSWER_MAX_RETRIES:
+        print(f"The answer is hallucination after {attempts} attempts.")
+        return "answer retries exhausted"
+    elif not grounded_on_facts:
         print("The answer is hallucination.")
         return "hallucination"
     else:
@@ -1,8 +1,10 @@
 from langchain.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import AzureChatOpenAI
-from ..config.env_config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
 from ..utils.helper_functions import escape_quotes
+from ..utils.grounding import is_extractive
+from ..config import EnvConfig
 from pprint import pprint
 
 from langchain_core.output_parsers import JsonOutputParser
@@ -21,18 +23,15 @@ output the filtered relevant content.
 """
 
 # Initialize chains
+@cached_chain
 def init_keep_relevant_chain():
-    llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    llm = get_llm()
     keep_relevant_prompt = PromptTemplate(
         template=keep_relevant_content_template,
         input_variables=["query", "retrieved_documents"],
     )
-    keep_relevant_chain = keep_relevant_prompt | llm.with_structured_output(KeepRelevantContent)
+    # Distillations are sampled again on purpose when they were not grounded, so they are never cached
+    keep_relevant_chain = keep_relevant_prompt | with_response_cache(llm.with_structured_output(KeepRelevantContent), "keep_relevant_content", KeepRelevantContent, cacheable=False)
     return keep_relevant_chain
 
 def keep_only_relevant_content(state):
@@ -58,11 +57,30 @@ def keep_only_relevant_content(state):
     pprint("--------------------")
     keep_relevant_chain = init_keep_relevant_chain()
     output = keep_relevant_chain.invoke(input_data)
+    return relevant_content_update(output, context, question, (state.get("attempts") or 0) + 1)
+
+async def akeep_only_relevant_content(state):
+    """Async version of keep_only_relevant_content."""
+    question = state["question"]
+    context = state["context"]
+
+    input_data = {
+    "query": question,
+    "retrieved_documents": context
+}
+    print("keeping only the relevant content...")
+    pprint("--------------------")
+    keep_relevant_chain = init_keep_relevant_chain()
+    output = await keep_relevant_chain.ainvoke(input_data)
+    return relevant_content_update(output, context, question, (state.get("attempts") or 0) + 1)
+
+def relevant_content_update(output, context, question, attempts):
+    """Builds the retrieval graph state update from the output of the keep relevant chain and its attempt count."""
     relevant_content = output.relevant_content
     relevant_content = "".join(relevant_content)
     relevant_content = escape_quotes(relevant_content)
 
-    return {"relevant_context": relevant_content, "context": context, "question": question}
+    return {"relevant_context": relevant_content, "context": context, "question": question, "attempts": attempts}
 
 is_distilled_content_grounded_on_content_prompt_template = """you receive some distilled content: {distilled_content} and the original context: {original_context}.
     you need to determine if the distilled content is grounded on the original context.
@@ -75,6 +93,7 @@ class IsDistilledContentGroundedOnContent(BaseModel):
     explanation: str = Field(description="An explanation of why the distilled content is or is not grounded on the original context.")
 
 # Initialize chains
+@cached_chain
 def init_is_distilled_content_grounded_on_content_chain():
     is_distilled_content_grounded_on_content_json_parser = JsonOutputParser(pydantic_object=IsDistilledContentGroundedOnContent)
 
@@ -84,14 +103,13 @@ def init_is_distilled_content_grounded_on_content_chain():
         partial_variables={"format_instructions": is_distilled_content_grounded_on_content_json_parser.get_format_instructions()},
     )
 
-    is_distilled_content_grounded_on_content_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    is_distilled_content_grounded_on_content_llm = get_llm()
 
-    is_distilled_content_grounded_on_content_chain = is_distilled_content_grounded_on_content_prompt | is_distilled_content_grounded_on_content_llm | is_distilled_content_grounded_on_content_json_parser
+    is_distilled_content_grounded_on_content_chain = is_distilled_content_grounded_on_content_prompt | with_response_cache(
+        is_distilled_content_grounded_on_content_llm | is_distilled_content_grounded_on_content_json_parser,
+        "is_distilled_content_grounded_on_content",
+        IsDistilledContentGroundedOnContent,
+    )
 
     return is_distilled_content_grounded_on_content_chain
 
@@ -100,19 +118,23 @@ def is_distilled_content_grounded_on_content(state):
     pprint("--------------------")
 
     """
-    Determines if the distilled content is grounded on the original context.
+    Determines if the distilled content is grounded on the original context. Extractive distilled content
+    is accepted without asking the LLM, see utils.grounding.is_extractive.
 
     Args:
         distilled_content: The distilled content.
         original_context: The original context.
 
     Returns:
-        Whether the distilled content is grounded on the original context.
+        Whether the distilled content is grounded on the original context, or whether the distillation
+        retries are exhausted.
     """
 
     print("Determining if the distilled content is grounded on the original context...")
     distilled_content = state["relevant_context"]
     original_context = state["context"]
+    if is_extractive_distillation(state):
+        return "grounded on the original context"
 
     input_data = {
         "distilled_content": distilled_content,
@@ -121,11 +143,40 @@ def is_distilled_content_grounded_on_content(state):
 
     is_distilled_content_grounded_on_content_chain = init_is_distilled_content_grounded_on_content_chain()
     output = is_distilled_content_grounded_on_content_chain.invoke(input_data)
+    return grounded_decision(output, state.get("attempts") or 1)
+
+async def ais_distilled_content_grounded_on_content(state):
+    """Async version of is_distilled_content_grounded_on_content."""
+    pprint("--------------------")
+    print("Determining if the distilled content is grounded on the original context...")
+    if is_extractive_distillation(state):
+        return "grounded on the original context"
+    input_data = {
+        "distilled_content": state["relevant_context"],
+        "original_context": state["context"]
+    }
+
+    is_distilled_content_grounded_on_content_chain = init_is_distilled_content_grounded_on_content_chain()
+    output = await is_distilled_content_grounded_on_content_chain.ainvoke(input_data)
+    return grounded_decision(output, state.get("attempts") or 1)
+
+def is_extractive_distillation(state):
+    """Whether the local pre-check accepts the distilled content, so the grounding LLM call can be skipped."""
+    if EnvConfig.EXTRACTIVE_PRECHECK and is_extractive(state["relevant_context"], state["context"]):
+        print("The distilled content is extracted from the original context.")
+        return True
+    return False
+
+def grounded_decision(output, attempts):
+    """Turns the output of the grounding chain and the number of distillations made into the name of the next edge."""
     grounded = output["grounded"]
 
     if grounded:
         print("The distilled content is grounded on the original context.")
         return "grounded on the original context"
+    elif attempts > EnvConfig.DISTILLATION_MAX_RETRIES:
+        print(f"The distilled content is not grounded on the original context after {attempts} attempts.")
+        return "distillation retries exhausted"
     else:
         print("The distilled content is not grounded on the original context.")
         return "not grounded on the original context"
\ No newline at end of file
@@ -1,7 +1,7 @@
 from langchain.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import AzureChatOpenAI
-from ..config.env_config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
 from ..utils.helper_functions import escape_quotes
 from pprint import pprint
 
@@ -23,18 +23,15 @@ output the filtered relevant content.
 """
 
 # Initialize chains
+@cached_chain
 def init_keep_relevant_chain():
-    llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    llm = get_llm()
     keep_relevant_prompt = PromptTemplate(
         template=keep_relevant_content_template,
         input_variables=["query", "retrieved_documents"],
     )
-    keep_relevant_chain = keep_relevant_prompt | llm.with_structured_output(KeepRelevantContent) | keep_relevant_content_parser
+    # Distillations are sampled again on purpose when they were not grounded, so they are never cached
+    keep_relevant_chain = keep_relevant_prompt | with_response_cache(llm.with_structured_output(KeepRelevantContent) | keep_relevant_content_parser, "keep_relevant_content", KeepRelevantContent, cacheable=False)
     return keep_relevant_chain
 
 def keep_only_relevant_content(state):
@@ -77,6 +74,7 @@ class IsDistilledContentGroundedOnContent(BaseModel):
     explanation: str = Field(description="An explanation of why the distilled content is or is not grounded on the original context.")
 
 # Initialize chains
+@cached_chain
 def init_is_distilled_content_grounded_on_content_chain():
     is_distilled_content_grounded_on_content_json_parser = JsonOutputParser(pydantic_object=IsDistilledContentGroundedOnContent)
 
@@ -86,14 +84,13 @@ def init_is_distilled_content_grounded_on_content_chain():
         partial_variables={"format_instructions": is_distilled_content_grounded_on_content_json_parser.get_format_instructions()},
     )
 
-    is_distilled_content_grounded_on_content_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    is_distilled_content_grounded_on_content_llm = get_llm()
 
-    is_distilled_content_grounded_on_content_chain = is_distilled_content_grounded_on_content_prompt | is_distilled_content_grounded_on_content_llm.with_structured_output(IsDistilledContentGroundedOnContent) | is_distilled_content_grounded_on_content_json_parser
+    is_distilled_content_grounded_on_content_chain = is_distilled_content_grounded_on_content_prompt | with_response_cache(
+        is_distilled_content_grounded_on_content_llm.with_structured_output(IsDistilledContentGroundedOnContent) | is_distilled_content_grounded_on_content_json_parser,
+        "is_distilled_content_grounded_on_content",
+        IsDistilledContentGroundedOnContent,
+    )
 
     return is_distilled_content_grounded_on_content_chain
 
@@ -0,0 +1,160 @@
+import asyncio
+from pprint import pprint
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, Field
+from typing import List
+
+from ..models.state_models import PlanExecute
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
+from ..utils.evidence import evidence_context
+from .plan_chain import can_be_answered_decision
+from .task_handler import apply_task_handler_output, retrieve_or_answer
+
+controller_prompt_template = """You are the controller of an agent answering a question about a book, step by step.
+After every executed step you decide at once whether the question can be answered, what the rest of the plan is and how to execute its next step.
+
+The question is:
+{question}
+
+The plan before the last step was:
+{plan}
+
+The steps done so far are:
+{past_steps}
+
+The context gathered so far is:
+{aggregated_context}
+
+1. Decide whether the question can be fully answered relying only on the gathered context. You have no prior knowledge of the question or the book.
+2. If it can't, update the plan: only the steps still needed to answer the question, never the steps already done, and never an empty plan.
+Every step has to be executable by one of the tools below and contain all the information needed to execute it.
+3. Choose the tool and the query of the first step of the updated plan:
+- retrieve_chunks: retrieves relevant information from a vector store of book chunks based on a query.
+- retrieve_summaries: retrieves relevant information from a vector store of chapter summaries based on a query.
+- retrieve_quotes: retrieves relevant information from a vector store of quotes from the book based on a query.
+- answer_from_context: answers a question from a given context, use it ONLY when the step can be answered by the gathered context.
+The last tool used was {last_tool}, if it was retrieve_chunks, use another tool.
+For a retrieval tool, output the query to retrieve. For answer_from_context, output the question to answer and the context to answer it from.
+4. Count how many steps at the beginning of the updated plan only retrieve information without needing what the steps before them find, so they can be executed at the same time.
+If the question can be answered, the plan, tool and query are ignored.
+"""
+
+
+class ControllerOutput(BaseModel):
+    """Output schema for the controller."""
+    can_be_answered: bool = Field(description="Whether the question can be fully answered or not based on the gathered context.")
+    steps: List[str] = Field(description="The updated plan, the steps still needed to answer the question in sorted order, the next step first.")
+    tool: str = Field(description="The tool of the next step should be either retrieve_chunks, retrieve_summaries, retrieve_quotes, or answer_from_context.")
+    query: str = Field(description="The query to be either retrieved from the vector store, or the question that should be answered from context.")
+    curr_context: str = Field(description="The context to be based on in order to answer the query.")
+    independent_steps: int = Field(default=1, description="The number of steps at the beginning of the updated plan that only retrieve information and don't need what the steps before them find. 1 when the second step needs the result of the first.")
+
+
+@cached_chain
+def init_controller_chain():
+    controller_prompt = PromptTemplate(
+        template=controller_prompt_template,
+        input_variables=["question", "plan", "past_steps", "aggregated_context", "last_tool"],
+    )
+
+    controller_llm = get_llm()
+    controller_chain = controller_prompt | with_response_cache(controller_llm.with_structured_output(ControllerOutput), "controller", ControllerOutput)
+    return controller_chain
+
+
+def controller_inputs(state: PlanExecute, aggregated_context=None):
+    """
+    Builds the controller chain inputs, the same as the replanner's plus the last tool of the task handler.
+    The evidence selected for the question is computed unless aggregated_context is given.
+    """
+    state.curr_state = "controller"
+    print("Deciding if the question can be answered, the next steps and the next tool")
+    pprint("--------------------")
+    if not state.past_steps:
+        state.past_steps = []
+    return {"question": state.question,
+            "plan": state.plan,
+            "past_steps": state.past_steps,
+            "aggregated_context": evidence_context(state, state.question) if aggregated_context is None else aggregated_context,
+            "last_tool": state.tool}
+
+
+def apply_controller_output(state: PlanExecute, output, next_step=True):
+    """
+    Updates the state with the answerability, the plan and its independent leading steps decided by the controller.
+    Unless the question can be answered, the first step of the plan is then popped with its tool and query
+    like the task handler does or, when next_step is False, kept with its tool and query in state.next_step
+    for the parallel steps node to run.
+    """
+    state.can_be_answered = output['can_be_answered']
+    state.next_step = None
+    if state.can_be_answered:
+        return state
+    state.plan = output['steps'] or [output['query']]
+    state.independent_steps = output.get('independent_steps') or 1
+    print("the current plan is:")
+    print(state.plan)
+    pprint("--------------------")
+    if next_step:
+        apply_task_handler_output(state, output)
+    else:
+        state.next_step = {"tool": output['tool'], "query": output['query'], "curr_context": output['curr_context']}
+    return state
+
+
+def controller_step(state: PlanExecute):
+    """
+    Replaces the replan, can be answered, break down plan and task handler LLM calls that follow every step
+    with a single one.
+    Args:
+        state: The current state of the plan execution.
+    Returns:
+        The updated state with the answerability, the plan and the tool and query of the next step.
+    """
+    controller_chain = init_controller_chain()
+    output = controller_chain.invoke(controller_inputs(state))
+    return apply_controller_output(state, output)
+
+
+async def acontroller_step(state: PlanExecute):
+    """Async version of controller_step."""
+    controller_chain = init_controller_chain()
+    aggregated_context = await asyncio.to_thread(evidence_context, state, state.question)
+    output = await controller_chain.ainvoke(controller_inputs(state, aggregated_context))
+    return apply_controller_output(state, output)
+
+
+def parallel_controller_step(state: PlanExecute):
+    """
+    Version of controller_step for the parallel execution mode: the tool and query of the next step are kept
+    for the parallel steps node, which only asks the task handler for the tools of the other steps it batches.
+    """
+    controller_chain = init_controller_chain()
+    output = controller_chain.invoke(controller_inputs(state))
+    return apply_controller_output(state, output, next_step=False)
+
+
+async def aparallel_controller_step(state: PlanExecute):
+    """Async version of parallel_controller_step."""
+    controller_chain = init_controller_chain()
+    aggregated_context = await asyncio.to_thread(evidence_context, state, state.question)
+    output = await controller_chain.ainvoke(controller_inputs(state, aggregated_context))
+    return apply_controller_output(state, output, next_step=False)
+
+
+def controller_can_be_answered(state: PlanExecute):
+    """
+    Turns the answerability decided by the controller into the name of the next edge. The whole evidence is
+    printed, so the edge never embeds anything on the event loop of the async graph.
+    """
+    context = "\n".join(item["content"] for item in state.evidence or [])
+    return can_be_answered_decision({"can_be_answered": state.can_be_answered}, context)
+
+
+def controller_decision(state: PlanExecute):
+    """Decides whether to get the final answer, or the tool executing the next step chosen by the controller."""
+    decision = controller_can_be_answered(state)
+    if decision == "can_be_answered_already":
+        return decision
+    return retrieve_or_answer(state)
@@ -1,11 +1,13 @@
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
 from pydantic import BaseModel, Field
 from typing import List
 from pprint import pprint
 
-from ..config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
 from ..models.state_models import PlanExecute
+from ..utils.deanonymizer import deanonymize_plan, deanonymize_text
+from ..config import EnvConfig
 
 class DeAnonymizePlan(BaseModel):
     """Possible results of the action."""
@@ -17,24 +19,22 @@ return the original list of tasks. in any case, just output the updated list of
 """
 
 
+@cached_chain
 def init_de_anonymize_plan_chain():
     de_anonymize_plan_prompt = PromptTemplate(
         template=de_anonymize_plan_prompt_template,
         input_variables=["plan", "mapping"],
     )
 
-    de_anonymize_plan_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
-    de_anonymize_plan_chain = de_anonymize_plan_prompt | de_anonymize_plan_llm.with_structured_output(DeAnonymizePlan)
+    de_anonymize_plan_llm = get_llm()
+    de_anonymize_plan_chain = de_anonymize_plan_prompt | with_response_cache(de_anonymize_plan_llm.with_structured_output(DeAnonymizePlan), "de_anonymize_plan", DeAnonymizePlan)
     return de_anonymize_plan_chain
 
 def deanonymize_queries(state: PlanExecute):
     """
     De-anonymizes the plan.
+    Placeholders are substituted locally, the LLM is only asked to de-anonymize the steps
+    the local substitution flagged as ambiguous (or every step if EnvConfig.DEANONYMIZE_MODE is 'llm').
     Args:
         state: The current state of the plan execution.
     Returns:
@@ -43,8 +43,49 @@ def deanonymize_queries(state: PlanExecute):
     state.curr_state = "de_anonymize_plan"
     print("De-anonymizing plan")
     pprint("--------------------")
-    de_anonymize_plan_chain = init_de_anonymize_plan_chain()
-    deanonimzed_plan = de_anonymize_plan_chain.invoke({"plan": state.plan, "mapping": state.mapping})
-    state.plan = deanonimzed_plan['plan']
+    plan, unresolved = local_deanonymize_plan(state)
+    if unresolved:
+        de_anonymize_plan_chain = init_de_anonymize_plan_chain()
+        deanonimzed_plan = de_anonymize_plan_chain.invoke({"plan": [state.plan[index] for index in unresolved], "mapping": state.mapping})
+        plan = merge_llm_deanonymized_steps(plan, unresolved, deanonimzed_plan['plan'], state.mapping)
+    state.plan = plan
     print(f'de-anonimized_plan: {state.plan}')
-    return state
\ No newline at end of file
+    return state
+
+async def adeanonymize_queries(state: PlanExecute):
+    """Async version of deanonymize_queries."""
+    state.curr_state = "de_anonymize_plan"
+    print("De-anonymizing plan")
+    pprint("--------------------")
+    plan, unresolved = local_deanonymize_plan(state)
+    if unresolved:
+        de_anonymize_plan_chain = init_de_anonymize_plan_chain()
+        deanonimzed_plan = await de_anonymize_plan_chain.ainvoke({"plan": [state.plan[index] for index in unresolved], "mapping": state.mapping})
+        plan = merge_llm_deanonymized_steps(plan, unresolved, deanonimzed_plan['plan'], state.mapping)
+    state.plan = plan
+    print(f'de-anonimized_plan: {state.plan}')
+    return state
+
+def local_deanonymize_plan(state: PlanExecute):
+    """
+    De-anonymizes the plan without the LLM.
+    Returns:
+        A (plan, unresolved) tuple, unresolved being the indexes of the steps left to the LLM.
+    """
+    if EnvConfig.DEANONYMIZE_MODE == "llm":
+        return list(state.plan), list(range(len(state.plan)))
+    plan, unresolved = deanonymize_plan(state.plan, state.mapping)
+    for index, placeholders in unresolved.items():
+        print(f"ambiguous placeholders {placeholders} in step: {state.plan[index]}")
+    return plan, sorted(unresolved)
+
+def merge_llm_deanonymized_steps(plan, unresolved, llm_steps, mapping):
+    """Puts the steps de-anonymized by the LLM back in their place in the plan."""
+    if len(llm_steps) != len(unresolved):
+        # The LLM merged or split steps, keep the best effort local substitution instead
+        print("The LLM returned a different number of steps, using the local de-anonymization.")
+        return [deanonymize_text(step, mapping)[0] if index in unresolved else step for index, step in enumerate(plan)]
+    plan = list(plan)
+    for index, step in zip(unresolved, llm_steps):
+        plan[index] = step
+    return plan
@@ -1,13 +1,15 @@
+import asyncio
 from pprint import pprint
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
 from pydantic import BaseModel, Field
 from typing import List
 from langchain_core.output_parsers.json import JsonOutputParser
 
 from ..models.state_models import PlanExecute
-from ..config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
 from ..utils.helper_functions import text_wrap
+from ..utils.evidence import evidence_context
 
 class Plan(BaseModel):
     """Plan to follow in future"""
@@ -17,6 +19,17 @@ class Plan(BaseModel):
     )
 
 
+class RefinedPlan(Plan):
+    """Refined plan to follow in future"""
+
+    independent_steps: int = Field(
+        default=1,
+        description="the number of steps at the beginning of the plan that only retrieve information and don't need what the steps before them find, "
+                    "so they can be executed at the same time. 1 when the second step needs the result of the first"
+    )
+
+
+@cached_chain
 def init_planner():
     planner_prompt =""" For the given query {question}, come up with a simple step by step plan of how to figure out the answer. 
 
@@ -30,14 +43,9 @@ def init_planner():
         input_variables=["question"],
     )
 
-    planner_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    planner_llm = get_llm()
 
-    planner = planner_prompt | planner_llm.with_structured_output(Plan)
+    planner = planner_prompt | with_response_cache(planner_llm.with_structured_output(Plan), "planner", Plan)
     return planner
 
 def plan_step(state: PlanExecute):
@@ -57,6 +65,17 @@ def plan_step(state: PlanExecute):
     print(f'plan: {state.plan}')
     return state
 
+async def aplan_step(state: PlanExecute):
+    """Async version of plan_step."""
+    state.curr_state = "planner"
+    print("Planning step")
+    pprint("--------------------")
+    planner = init_planner()
+    plan = await planner.ainvoke({"question": state.anonymized_question})
+    state.plan = plan['steps']
+    print(f'plan: {state.plan}')
+    return state
+
 
 break_down_plan_prompt_template = """You receive a plan {plan} which contains a series of steps to follow in order to answer a query. 
 you need to go through the plan refine it according to this:
@@ -66,24 +85,21 @@ you need to go through the plan refine it according to this:
     iii. retrieving relevant information from a vector store of book quotes
     iv. answering a question from a given context.
 2. every step should contain all the information needed to execute it.
+3. count how many steps at the beginning of the refined plan only retrieve information without needing what the steps before them find, so they can be executed at the same time.
 
 output the refined plan
 """
 
+@cached_chain
 def init_break_down_plan_chain():
     break_down_plan_prompt = PromptTemplate(
         template=break_down_plan_prompt_template,
         input_variables=["plan"],
     )
 
-    break_down_plan_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    break_down_plan_llm = get_llm()
 
-    break_down_plan_chain = break_down_plan_prompt | break_down_plan_llm.with_structured_output(Plan)
+    break_down_plan_chain = break_down_plan_prompt | with_response_cache(break_down_plan_llm.with_structured_output(RefinedPlan), "break_down_plan", RefinedPlan)
     return break_down_plan_chain
 
 def break_down_plan_step(state: PlanExecute):
@@ -92,7 +108,7 @@ def break_down_plan_step(state: PlanExecute):
     Args:
         state: The current state of the plan execution.
     Returns:
-        The updated state with the refined plan.
+        The updated state with the refined plan and the number of its leading steps that can run at the same time.
     """
     state.curr_state = "break_down_plan"
     print("Breaking down plan steps into retrievable or answerable tasks")
@@ -100,6 +116,18 @@ def break_down_plan_step(state: PlanExecute):
     break_down_plan_chain = init_break_down_plan_chain()
     refined_plan = break_down_plan_chain.invoke(state.plan)
     state.plan = refined_plan['steps']
+    state.independent_steps = refined_plan.get('independent_steps') or 1
+    return state
+
+async def abreak_down_plan_step(state: PlanExecute):
+    """Async version of break_down_plan_step."""
+    state.curr_state = "break_down_plan"
+    print("Breaking down plan steps into retrievable or answerable tasks")
+    pprint("--------------------")
+    break_down_plan_chain = init_break_down_plan_chain()
+    refined_plan = await break_down_plan_chain.ainvoke(state.plan)
+    state.plan = refined_plan['steps']
+    state.independent_steps = refined_plan.get('independent_steps') or 1
     return state
 
 class ActPossibleResults(BaseModel):
@@ -137,6 +165,7 @@ the format is json so escape quotes and new lines.
 
 """
 
+@cached_chain
 def init_replanner():
     replanner_prompt = PromptTemplate(
         template=replanner_prompt_template,
@@ -144,14 +173,9 @@ def init_replanner():
         partial_variables={"format_instructions": act_possible_results_parser.get_format_instructions()},
     )
 
-    replanner_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
+    replanner_llm = get_llm()
 
-    replanner = replanner_prompt | replanner_llm | act_possible_results_parser
+    replanner = replanner_prompt | with_response_cache(replanner_llm | act_possible_results_parser, "replanner", ActPossibleResults)
     return replanner
 
 def replan_step(state: PlanExecute):
@@ -165,12 +189,25 @@ def replan_step(state: PlanExecute):
     state.curr_state = "replan"
     print("Replanning step")
     pprint("--------------------")
-    inputs = {"question": state.question, "plan": state.plan, "past_steps": state.past_steps, "aggregated_context": state.aggregated_context}
+    inputs = {"question": state.question, "plan": state.plan, "past_steps": state.past_steps, "aggregated_context": evidence_context(state, state.question)}
     replanner = init_replanner()
     output = replanner.invoke(inputs)
     state.plan = output['plan']['steps']
     return state
 
+async def areplan_step(state: PlanExecute):
+    """Async version of replan_step."""
+    state.curr_state = "replan"
+    print("Replanning step")
+    pprint("--------------------")
+    # Selecting the evidence may embed it, which runs in a worker thread to keep the event loop free
+    aggregated_context = await asyncio.to_thread(evidence_context, state, state.question)
+    inputs = {"question": state.question, "plan": state.plan, "past_steps": state.past_steps, "aggregated_context": aggregated_context}
+    replanner = init_replanner()
+    output = await replanner.ainvoke(inputs)
+    state.plan = output['plan']['steps']
+    return state
+
 class CanBeAnsweredAlready(BaseModel):
     """Possible results of the action."""
     can_be_answered: bool = Field(description="Whether the question can be fully answered or not based on the given context.")
@@ -182,19 +219,15 @@ you have no prior knowledge of the question or the context.
 if you think the question can be answered based on the context, output 'true', otherwise output 'false'.
 """
 
+@cached_chain
 def init_can_be_answered_already_chain():
     can_be_answered_already_prompt = PromptTemplate(
         template=can_be_answered_already_prompt_template,
         input_variables=["question","context"],
     )
 
-    can_be_answered_already_llm = AzureChatOpenAI(
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-    )
-    can_be_answered_already_chain = can_be_answered_already_prompt | can_be_answered_already_llm.with_structured_output(CanBeAnsweredAlready)
+    can_be_answered_already_llm = get_llm()
+    can_be_answered_already_chain = can_be_answered_already_prompt | with_response_cache(can_be_answered_already_llm.with_structured_output(CanBeAnsweredAlready), "can_be_answered_already", CanBeAnsweredAlready)
     return can_be_answered_already_chain
 
 def can_be_answered(state: PlanExecute):
@@ -209,15 +242,30 @@ def can_be_answered(state: PlanExecute):
     print("Checking if the ORIGINAL QUESTION can be answered already")
     pprint("--------------------")
     question = state.question
-    context = state.aggregated_context
+    context = evidence_context(state, question)
     inputs = {"question": question, "context": context}
     can_be_answered_already_chain = init_can_be_answered_already_chain()
     output = can_be_answered_already_chain.invoke(inputs)
+    return can_be_answered_decision(output, context)
+
+async def acan_be_answered(state: PlanExecute):
+    """Async version of can_be_answered."""
+    state.curr_state = "can_be_answered_already"
+    print("Checking if the ORIGINAL QUESTION can be answered already")
+    pprint("--------------------")
+    context = await asyncio.to_thread(evidence_context, state, state.question)
+    inputs = {"question": state.question, "context": context}
+    can_be_answered_already_chain = init_can_be_answered_already_chain()
+    output = await can_be_answered_already_chain.ainvoke(inputs)
+    return can_be_answered_decision(output, context)
+
+def can_be_answered_decision(output, context):
+    """Turns the output of the can be answered already chain into the name of the next edge."""
     if output['can_be_answered'] == True:
         print("The ORIGINAL QUESTION can be fully answered already.")
         pprint("--------------------")
         print("the aggregated context is:")
-        print(text_wrap(state.aggregated_context))
+        print(text_wrap(context))
         print("--------------------")
         return "can_be_answered_already"
     else:
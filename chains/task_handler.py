@@ -1,9 +1,11 @@
+import asyncio
 from pprint import pprint
 from ..models.state_models import PlanExecute
 from langchain_core.prompts import PromptTemplate
-from langchain_openai import AzureChatOpenAI
 from pydantic import BaseModel, Field
-from ..config import EnvConfig
+from ..utils.llm_clients import get_llm, cached_chain
+from ..utils.llm_cache import with_response_cache
+from ..utils.evidence import evidence_context
 
 tasks_handler_prompt_template = """You are a task handler that receives a task {curr_task} and have to decide with tool to use to execute the task.
 You have the following tools at your disposal:
@@ -32,19 +34,15 @@ class TaskHandlerOutput(BaseModel):
     curr_context: str = Field(description="The context to be based on in order to answer the query.")
     tool: str = Field(description="The tool to be used should be either retrieve_chunks, retrieve_summaries, retrieve_quotes, or answer_from_context.")
 
+@cached_chain
 def init_task_handler_chain():
     task_handler_prompt = PromptTemplate(
         template=tasks_handler_prompt_template,
         input_variables=["curr_task", "aggregated_context", "last_tool" "past_steps", "question"],
     )
 
-    task_handler_llm = AzureChatOpenAI(
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-    )
-    task_handler_chain = task_handler_prompt | task_handler_llm.with_structured_output(TaskHandlerOutput)
+    task_handler_llm = get_llm()
+    task_handler_chain = task_handler_prompt | with_response_cache(task_handler_llm.with_structured_output(TaskHandlerOutput), "task_handler", TaskHandlerOutput)
     return task_handler_chain
 
 def run_task_handler_chain(state: PlanExecute):
@@ -54,6 +52,21 @@ def run_task_handler_chain(state: PlanExecute):
     Returns:
        The updated state of the plan execution.
     """
+    inputs = task_handler_inputs(state)
+    task_handler_chain = init_task_handler_chain()
+    output = task_handler_chain.invoke(inputs)
+    return apply_task_handler_output(state, output)
+
+async def arun_task_handler_chain(state: PlanExecute):
+    """Async version of run_task_handler_chain, the evidence is selected in a worker thread."""
+    aggregated_context = await asyncio.to_thread(evidence_context, state, state.plan[0])
+    inputs = task_handler_inputs(state, aggregated_context)
+    task_handler_chain = init_task_handler_chain()
+    output = await task_handler_chain.ainvoke(inputs)
+    return apply_task_handler_output(state, output)
+
+def task_handler_inputs(state: PlanExecute, aggregated_context=None):
+    """Builds the task handler chain inputs for the first step of the plan."""
     state.curr_state = "task_handler"
     print("the current plan is:")
     print(state.plan)
@@ -63,16 +76,25 @@ def run_task_handler_chain(state: PlanExecute):
         state.past_steps = []
 
     curr_task = state.plan[0]
+    return task_handler_inputs_for_task(state, curr_task, aggregated_context)
 
+def task_handler_inputs_for_task(state: PlanExecute, curr_task, aggregated_context=None):
+    """
+    Builds the task handler chain inputs for a given task of the plan. The evidence selected for the task
+    is computed unless aggregated_context is given.
+    """
+    if aggregated_context is None:
+        aggregated_context = evidence_context(state, curr_task)
     inputs = {"curr_task": curr_task,
-               "aggregated_context": state.aggregated_context,
+               "aggregated_context": aggregated_context,
                 "last_tool": state.tool,
                 "past_steps": state.past_steps,
                 "question": state.question}
-    
-    task_handler_chain = init_task_handler_chain()
-    output = task_handler_chain.invoke(inputs)
-  
+    return inputs
+
+def apply_task_handler_output(state: PlanExecute, output):
+    """Pops the first step of the plan and updates the state with the tool and query chosen for it."""
+    curr_task = state.plan[0]
     state.past_steps.append(curr_task)
     state.plan.pop(0)
 
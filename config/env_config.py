@@ -9,6 +9,44 @@ class EnvConfig:
     AZ_OAI_DEPLOYMENT = os.getenv("AZ_OAI_DEPLOYMENT")
     PDF_PATH = os.getenv("PDF_PATH")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    LLM_DEPLOYMENT_LIMITS = os.getenv("LLM_DEPLOYMENT_LIMITS", "")
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite")
+    LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    LLM_CACHE_DEFAULT_TTL = float(os.getenv("LLM_CACHE_DEFAULT_TTL", str(7 * 24 * 3600)))
+    LLM_CACHE_TTLS = os.getenv("LLM_CACHE_TTLS", "")
+    DEANONYMIZE_MODE = os.getenv("DEANONYMIZE_MODE", "local")
+    PLAN_EXECUTION_MODE = os.getenv("PLAN_EXECUTION_MODE", "serial")
+    CONTROLLER_MODE = os.getenv("CONTROLLER_MODE", "multi_call")
+    MAX_PARALLEL_STEPS = int(os.getenv("MAX_PARALLEL_STEPS", "4"))
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+    ANN_INDEX_TYPES = os.getenv("ANN_INDEX_TYPES", "")
+    ANN_INDEX_PARAMS = os.getenv("ANN_INDEX_PARAMS", "")
+    INDEX_COMPACTION = os.getenv("INDEX_COMPACTION", "")
+    INCREMENTAL_INDEXING = os.getenv("INCREMENTAL_INDEXING", "true").lower() in ("1", "true", "yes")
+    CORPUS_DIR = os.getenv("CORPUS_DIR")
+    SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+    MAX_LOADED_SHARDS = int(os.getenv("MAX_LOADED_SHARDS", "0"))
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    EVIDENCE_TOKEN_BUDGET = int(os.getenv("EVIDENCE_TOKEN_BUDGET", "2000"))
+    EVIDENCE_MAX_TOKENS = int(os.getenv("EVIDENCE_MAX_TOKENS", "8000"))
+    EVIDENCE_COMPACTED_TOKENS = int(os.getenv("EVIDENCE_COMPACTED_TOKENS", "150"))
+    EVIDENCE_TOKEN_MODEL = os.getenv("EVIDENCE_TOKEN_MODEL", "gpt-4o")
+    DISTILLATION_MAX_RETRIES = int(os.getenv("DISTILLATION_MAX_RETRIES", "2"))
+    ANSWER_MAX_RETRIES = int(os.getenv("ANSWER_MAX_RETRIES", "2"))
+    EXTRACTIVE_PRECHECK = os.getenv("EXTRACTIVE_PRECHECK", "true").lower() in ("1", "true", "yes")
+    EXTRACTIVE_NGRAM_SIZE = int(os.getenv("EXTRACTIVE_NGRAM_SIZE", "3"))
+    EXTRACTIVE_MIN_OVERLAP = float(os.getenv("EXTRACTIVE_MIN_OVERLAP", "0.9"))
+    INDEX_DIR = os.getenv("INDEX_DIR", ".index_store")
+    SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", ".summary_cache")
+    SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+    SUMMARY_MAX_RETRIES = int(os.getenv("SUMMARY_MAX_RETRIES", "6"))
+    INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "1"))
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+    EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", "0")) or None
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
     
 @classmethod
 def validate(cls):
@@ -1,36 +1,103 @@
+import argparse
+import asyncio
+import json
 import langgraph
+from .config import EnvConfig
 from .utils.helper_functions import text_wrap
-from .workflows.agent_workflow import agent_workflow
+from .workflows.agent_workflow import agent_workflow, async_plan_and_execute_app
+from .workflows.answer_workflow import ANSWER_NOT_FOUND
+from .utils.retriever_registry import retriever_registry
+from .utils.metrics import MetricsCallbackHandler, serve_metrics
+from .utils.tracing import TraceCallbackHandler, tracing
 
 
-def execute_plan_and_print_steps(inputs, recursion_limit=45):
+def write_metrics_summary(metrics, metrics_path):
+    """Writes the JSON metrics summary of a run, if a path is given."""
+    if metrics_path:
+        with open(metrics_path, 'w', encoding="utf-8") as f:
+            json.dump(metrics.summary(), f, indent=2)
+
+def run_callbacks(metrics, tracer):
+    """The callbacks of a run: its metrics, and its trace spans when the run is traced."""
+    return [metrics] + ([TraceCallbackHandler(tracer)] if tracer else [])
+
+def execute_plan_and_print_steps(inputs, recursion_limit=45, metrics_path=None, trace_path=None):
     """
     Execute the plan and print the steps.
     Args:
         inputs: The inputs to the plan.
         recursion_limit: The recursion limit.
+        metrics_path: Optional JSON file the per node and per chain metrics of the run are written to.
+        trace_path: Optional Chrome trace file the timeline of the run is written to (nodes, LLM calls,
+            embeddings and index searches), to be opened in chrome://tracing or https://ui.perfetto.dev.
     Returns:
         The response and the final state.
     """
     print(f'inputs: {inputs}')
-    config = {"recursion_limit": recursion_limit}
-    plan_and_execute_app = agent_workflow.compile()
-    try:    
-        for plan_output in plan_and_execute_app.stream(inputs, config=config):
-            for _, agent_state_value in plan_output.items():
-                pass
-                print(f' curr step: {agent_state_value}')
-        response = agent_state_value['response']
-    except langgraph.pregel.GraphRecursionError:
-        response = "The answer wasn't found in the data."
+    metrics = MetricsCallbackHandler()
+    with tracing(trace_path) as tracer:
+        config = {"recursion_limit": recursion_limit, "callbacks": run_callbacks(metrics, tracer)}
+        plan_and_execute_app = agent_workflow.compile()
+        try:
+            for plan_output in plan_and_execute_app.stream(inputs, config=config):
+                for _, agent_state_value in plan_output.items():
+                    pass
+                    print(f' curr step: {agent_state_value}')
+            response = agent_state_value['response']
+        except langgraph.pregel.GraphRecursionError:
+            response = ANSWER_NOT_FOUND
     final_state = agent_state_value
     print(text_wrap(f' the final answer is: {response}'))
+    write_metrics_summary(metrics, metrics_path)
+    return response, final_state
+
+async def aexecute_plan_and_print_steps(inputs, recursion_limit=45, metrics_path=None, trace_path=None):
+    """
+    Async version of execute_plan_and_print_steps, runs the graph of async nodes.
+    Args:
+        inputs: The inputs to the plan.
+        recursion_limit: The recursion limit.
+        metrics_path: Optional JSON file the per node and per chain metrics of the run are written to.
+        trace_path: Optional Chrome trace file the timeline of the run is written to, every asyncio task gets its own track.
+    Returns:
+        The response and the final state.
+    """
+    print(f'inputs: {inputs}')
+    metrics = MetricsCallbackHandler()
+    with tracing(trace_path) as tracer:
+        config = {"recursion_limit": recursion_limit, "callbacks": run_callbacks(metrics, tracer)}
+        try:
+            async for plan_output in async_plan_and_execute_app.astream(inputs, config=config):
+                for _, agent_state_value in plan_output.items():
+                    print(f' curr step: {agent_state_value}')
+            response = agent_state_value['response']
+        except langgraph.pregel.GraphRecursionError:
+            response = ANSWER_NOT_FOUND
+    final_state = agent_state_value
+    print(text_wrap(f' the final answer is: {response}'))
+    write_metrics_summary(metrics, metrics_path)
     return response, final_state
 
 def main():
+    if EnvConfig.METRICS_PORT:
+        serve_metrics(EnvConfig.METRICS_PORT)
+    retriever_registry.warm_up()
     input = {"question": "How many houses are there in Hogwarts?"}
     final_answer, final_state = execute_plan_and_print_steps(input)
     print(final_answer, final_state)
 
+async def amain():
+    if EnvConfig.METRICS_PORT:
+        serve_metrics(EnvConfig.METRICS_PORT)
+    await asyncio.to_thread(retriever_registry.warm_up)
+    input = {"question": "How many houses are there in Hogwarts?"}
+    final_answer, final_state = await aexecute_plan_and_print_steps(input)
+    print(final_answer, final_state)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Answer a sample question with the plan and execute agent.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="run the graph of async nodes on an event loop")
+    if parser.parse_args().use_async:
+        asyncio.run(amain())
+    else:
+        main()
@@ -8,11 +8,15 @@ class PlanExecute(BaseModel):
     anonymized_question: Optional[str] = None
     query_to_retrieve_or_answer: Optional[str] = None
     plan: Optional[List[str]] = None
+    independent_steps: Optional[int] = None
     past_steps: Optional[List[str]] = None
     mapping: Optional[dict] = None
     curr_context: Optional[str] = None
-    aggregated_context: Optional[str] = None
+    evidence: Optional[List[dict]] = None
+    distilled_ids: Optional[List[str]] = None
     tool: Optional[str] = None
+    can_be_answered: Optional[bool] = None
+    next_step: Optional[dict] = None
     response: Optional[str] = None
     
 class QualitativeAnswerGraphState(TypedDict):
@@ -24,6 +28,7 @@ class QualitativeAnswerGraphState(TypedDict):
     question: str
     context: str
     answer: str
+    attempts: int
     
 class QualitativeRetrievalGraphState(TypedDict):
     """
@@ -32,4 +37,7 @@ class QualitativeRetrievalGraphState(TypedDict):
 
     question: str
     context: str
-    relevant_context: str
\ No newline at end of file
+    relevant_context: str
+    seen_ids: List[str]
+    document_ids: List[str]
+    attempts: int
\ No newline at end of file
@@ -0,0 +1,324 @@
+import os
+import pickle
+import re
+
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from ..config import EnvConfig
+from ..utils.helper_functions import parse_key_value_pairs
+from ..utils.tracing import trace_span
+
+ANN_INDEX_TYPES = ("flat", "ivf", "hnsw", "hnswlib")
+
+DEFAULT_ANN_PARAMS = {
+    "nlist": 100,  # ivf: number of inverted lists (clusters)
+    "nprobe": 8,  # ivf: number of lists visited per query
+    "hnsw_m": 32,  # hnsw, hnswlib: neighbors per graph node
+    "ef_construction": 200,  # hnsw, hnswlib: candidate list size while building
+    "ef_search": 64,  # hnsw, hnswlib: candidate list size while searching
+}
+
+# The parameters of every index type, the search ones can change without rebuilding the index
+ANN_INDEX_PARAMS = {
+    "flat": (),
+    "ivf": ("nlist", "nprobe"),
+    "hnsw": ("hnsw_m", "ef_construction", "ef_search"),
+    "hnswlib": ("hnsw_m", "ef_construction", "ef_search"),
+}
+ANN_SEARCH_PARAMS = ("nprobe", "ef_search")
+
+# The index types vectors can be removed from, so a saved index can be updated instead of rebuilt. The LangChain
+# FAISS store renumbers its positions after a removal, which only matches flat indexes: IVF keeps the ids of its
+# vectors, so the next additions would reuse ids still in use.
+INCREMENTAL_INDEX_TYPES = ("flat",)
+
+COMPACTION_PATTERN = re.compile(r"^(?:pca(\d+))?\+?(fp16)?$")
+
+
+def ann_index_settings(store_name):
+    """
+    Reads the index type and parameters of a store from EnvConfig.ANN_INDEX_TYPES ('chunks=hnsw,quotes=ivf')
+    and EnvConfig.ANN_INDEX_PARAMS ('chunks.ef_search=128,quotes.nlist=256'). Stores default to 'flat'.
+
+    Args:
+        store_name: The name of the store (e.g. 'chunks', 'summaries', 'quotes').
+
+    Returns:
+        An (index type, parameters) tuple, the parameters being those of the index type only.
+    """
+    index_type = parse_key_value_pairs(EnvConfig.ANN_INDEX_TYPES, str).get(store_name, "flat")
+    if index_type not in ANN_INDEX_TYPES:
+        raise ValueError(f"Invalid index type '{index_type}' for store '{store_name}'. Must be one of {', '.join(ANN_INDEX_TYPES)}")
+    overrides = {}
+    for name, value in parse_key_value_pairs(EnvConfig.ANN_INDEX_PARAMS).items():
+        store, _, param = name.partition(".")
+        if store == store_name:
+            overrides[param] = value
+    params = {param: overrides.get(param, DEFAULT_ANN_PARAMS[param]) for param in ANN_INDEX_PARAMS[index_type]}
+    return index_type, params
+
+
+def parse_compaction(text):
+    """
+    Parses a compaction setting: 'none', 'fp16' (float16 storage), 'pca<d>' (PCA projection to d dimensions)
+    or 'pca<d>+fp16' (both).
+
+    Returns:
+        A (PCA dimension or None, float16 storage) tuple.
+    """
+    text = (text or "none").strip().lower()
+    if text == "none":
+        return None, False
+    match = COMPACTION_PATTERN.match(text)
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Invalid compaction '{text}'. Must be 'none', 'fp16', 'pca<d>' or 'pca<d>+fp16'")
+    return (int(match.group(1)) if match.group(1) else None), match.group(2) is not None
+
+
+def index_compaction(store_name):
+    """Reads the compaction of a store from EnvConfig.INDEX_COMPACTION ('chunks=fp16,quotes=pca256'), 'none' by default."""
+    compaction = parse_key_value_pairs(EnvConfig.INDEX_COMPACTION, str).get(store_name, "none")
+    parse_compaction(compaction)
+    return compaction
+
+
+def build_params(params):
+    """Returns the parameters a saved index depends on, leaving out the search time ones."""
+    return {param: value for param, value in params.items() if param not in ANN_SEARCH_PARAMS}
+
+
+def create_faiss_index(dimension, index_type, params, num_vectors, compaction=None):
+    """
+    Creates an empty FAISS index with faiss.index_factory.
+
+    Args:
+        dimension: The dimension of the vectors.
+        index_type: 'flat', 'ivf' or 'hnsw'.
+        params: The parameters of the index type.
+        num_vectors: The number of vectors the index will hold, IVF never gets more lists than vectors.
+        compaction: See parse_compaction. The PCA projection is learned when the index is trained
+            and FAISS applies it to the queries as well.
+    """
+    pca_dimension, fp16 = parse_compaction(compaction)
+    storage = "SQfp16" if fp16 else "Flat"
+    prefix = ""
+    if pca_dimension is not None:
+        # PCA can't learn more components than there are vectors
+        pca_dimension = max(1, min(pca_dimension, dimension, num_vectors))
+        prefix = f"PCA{pca_dimension},"
+    if index_type == "flat":
+        return faiss.index_factory(dimension, prefix + storage)
+    if index_type == "ivf":
+        nlist = max(1, min(params["nlist"], num_vectors))
+        return faiss.index_factory(dimension, f"{prefix}IVF{nlist},{storage}")
+    if index_type == "hnsw":
+        hnsw_storage = "_SQfp16" if fp16 else ",Flat"
+        index = faiss.index_factory(dimension, f"{prefix}HNSW{params['hnsw_m']}{hnsw_storage}")
+        hnsw_index = faiss.downcast_index(index.index) if pca_dimension is not None else index
+        hnsw_index.hnsw.efConstruction = params["ef_construction"]
+        return index
+    raise ValueError(f"'{index_type}' is not a FAISS index type")
+
+
+def apply_search_params(index, index_type, params):
+    """Sets the search time parameters of a FAISS index, they are not all saved with the index."""
+    parameter_space = faiss.ParameterSpace()
+    if index_type == "ivf":
+        parameter_space.set_index_parameter(index, "nprobe", params["nprobe"])
+    elif index_type == "hnsw":
+        parameter_space.set_index_parameter(index, "efSearch", params["ef_search"])
+
+
+def has_projection(vectorstore):
+    """
+    Whether a vector store compares its vectors in a projection learned from its own vectors (PCA compaction),
+    so its distances can't be compared with those of another store.
+    """
+    return isinstance(getattr(vectorstore, "index", None), faiss.IndexPreTransform)
+
+
+class FaissVectorStore(FAISS):
+    """The LangChain FAISS vector store, with its index searches traced (see utils.tracing)."""
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        with trace_span("faiss_search", "search", k=k, vectors=self.index.ntotal):
+            return super().similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+
+class HnswlibVectorStore(VectorStore):
+    """
+    Vector store backed by an hnswlib HNSW graph and an in memory docstore.
+    It mirrors the parts of the FAISS vector store the workflows use: similarity search with scores
+    (L2 distances), retrievers and save_local / load_local.
+    """
+
+    INDEX_FILE_NAME = "index.hnswlib"
+    DOCSTORE_FILE_NAME = "docstore.pkl"
+
+    def __init__(self, embedding, index, documents=None, space="l2", ef_search=64):
+        self.embedding = embedding
+        self.index = index
+        self.documents = documents if documents is not None else []
+        self.space = space
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    @classmethod
+    def create_index(cls, dimension, max_elements, hnsw_m=32, ef_construction=200, space="l2"):
+        import hnswlib
+        index = hnswlib.Index(space=space, dim=dimension)
+        index.init_index(max_elements=max(max_elements, 1), ef_construction=ef_construction, M=hnsw_m)
+        return index
+
+    def add_embeddings(self, texts, embeddings, metadatas=None):
+        """Adds already embedded texts, the labels of the graph are their positions in self.documents."""
+        metadatas = metadatas or [{} for _ in texts]
+        start = len(self.documents)
+        required = start + len(texts)
+        if required > self.index.get_max_elements():
+            self.index.resize_index(required)
+        self.index.add_items(np.asarray(embeddings, dtype="float32"), np.arange(start, required))
+        self.documents.extend(Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas))
+        return [str(label) for label in range(start, required)]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas)
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, hnsw_m=32, ef_construction=200, ef_search=64, **kwargs):
+        texts = list(texts)
+        vectors = embedding.embed_documents(texts)
+        index = cls.create_index(len(vectors[0]), len(vectors), hnsw_m, ef_construction)
+        vectorstore = cls(embedding, index, ef_search=ef_search)
+        vectorstore.add_embeddings(texts, vectors, metadatas)
+        return vectorstore
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        count = self.index.get_current_count()
+        if count == 0:
+            return []
+        k = min(k, count)
+        # hnswlib needs ef >= k to return k results
+        self.index.set_ef(max(self.ef_search, k))
+        with trace_span("hnswlib_search", "search", k=k, vectors=count):
+            labels, distances = self.index.knn_query(np.asarray([embedding], dtype="float32"), k=k)
+        return [(self.documents[label], float(distance)) for label, distance in zip(labels[0], distances[0])]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    def save_local(self, folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+        self.index.save_index(os.path.join(folder_path, self.INDEX_FILE_NAME))
+        with open(os.path.join(folder_path, self.DOCSTORE_FILE_NAME), 'wb') as f:
+            pickle.dump({"documents": self.documents, "space": self.space, "dimension": self.index.dim}, f)
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, ef_search=64):
+        import hnswlib
+        with open(os.path.join(folder_path, cls.DOCSTORE_FILE_NAME), 'rb') as f:
+            saved = pickle.load(f)
+        index = hnswlib.Index(space=saved["space"], dim=saved["dimension"])
+        index.load_index(os.path.join(folder_path, cls.INDEX_FILE_NAME))
+        return cls(embeddings, index, saved["documents"], saved["space"], ef_search)
+
+
+def build_vector_index(documents, embeddings, index_type="flat", params=None, compaction=None, ids=None):
+    """
+    Embeds documents and indexes them with the given index type.
+
+    Args:
+        documents: The Documents to index.
+        embeddings: The embeddings of the documents and of the queries.
+        index_type: 'flat', 'ivf', 'hnsw' or 'hnswlib'.
+        params: The parameters of the index type, see ann_index_settings.
+        compaction: The compaction of the stored vectors, see parse_compaction. FAISS index types only.
+        ids: The docstore ids of the documents, see utils.index_store.document_ids. FAISS index types only.
+
+    Returns:
+        A FAISS vector store, or an HnswlibVectorStore for 'hnswlib'.
+    """
+    params = params or {}
+    texts = [document.page_content for document in documents]
+    metadatas = [document.metadata for document in documents]
+    if index_type == "hnswlib":
+        if parse_compaction(compaction) != (None, False):
+            raise ValueError("Compaction is only supported by the FAISS index types")
+        return HnswlibVectorStore.from_texts(texts, embeddings, metadatas, **params)
+
+    vectors = embeddings.embed_documents(texts)
+    array = np.asarray(vectors, dtype="float32")
+    index = create_faiss_index(array.shape[1], index_type, params, len(vectors), compaction)
+    if not index.is_trained:
+        index.train(array)
+    vectorstore = FaissVectorStore(embeddings, index, InMemoryDocstore(), {})
+    vectorstore.add_embeddings(zip(texts, vectors), metadatas, ids=ids)
+    apply_search_params(vectorstore.index, index_type, params)
+    return vectorstore
+
+
+def update_vector_index(vectorstore, sources, ids, create_documents):
+    """
+    Updates a FAISS vector store to new source documents, embedding only the sources it doesn't hold yet.
+    Sources are identified by the hash of their content: the ids of the removed sources are deleted from the
+    index and the docstore, the new sources are turned into documents and embedded, and the unchanged ones
+    only get their metadata refreshed (their page or offset may have moved).
+
+    Args:
+        vectorstore: The FAISS vector store built with the content hashes of its sources as docstore ids.
+        sources: The current source Documents (chunks, chapters...).
+        ids: The content hash ids of the sources, see utils.index_store.document_ids.
+        create_documents: A callable turning a list of sources into the list of Documents to index.
+
+    Returns:
+        The updated vector store.
+    """
+    existing = set(vectorstore.index_to_docstore_id.values())
+    removed = list(existing - set(ids))
+    if removed:
+        vectorstore.delete(removed)
+
+    new_sources = [(id, source) for id, source in zip(ids, sources) if id not in existing]
+    if new_sources:
+        documents = create_documents([source for _, source in new_sources])
+        vectorstore.add_documents(documents, ids=[id for id, _ in new_sources])
+
+    kept = [(id, source) for id, source in zip(ids, sources) if id in existing]
+    if kept:
+        stored = {id: vectorstore.docstore.search(id) for id, _ in kept}
+        vectorstore.docstore.delete(list(stored))
+        vectorstore.docstore.add({
+            id: Document(page_content=stored[id].page_content, metadata=source.metadata) for id, source in kept
+        })
+
+    print(f"Embedded {len(new_sources)} new documents, removed {len(removed)} and kept {len(kept)}")
+    return vectorstore
+
+
+def load_vector_index(directory, embeddings, index_type="flat", params=None):
+    """Loads an index saved by the index store and applies the current search parameters."""
+    params = params or {}
+    if index_type == "hnswlib":
+        return HnswlibVectorStore.load_local(directory, embeddings, params["ef_search"])
+    vectorstore = FaissVectorStore.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+    apply_search_params(vectorstore.index, index_type, params)
+    return vectorstore
@@ -0,0 +1,170 @@
+import glob
+import heapq
+import os
+import threading
+
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from ..config import EnvConfig
+from ..utils.ann_index import has_projection
+from ..utils.embeddings import get_embedding_service
+
+
+def corpus_paths():
+    """
+    Returns the PDFs of the corpus: every PDF under EnvConfig.CORPUS_DIR, or EnvConfig.PDF_PATH alone
+    when no corpus directory is set.
+    """
+    if not EnvConfig.CORPUS_DIR:
+        return [EnvConfig.PDF_PATH]
+    paths = sorted(glob.glob(os.path.join(EnvConfig.CORPUS_DIR, "**", "*.pdf"), recursive=True))
+    if not paths:
+        raise ValueError(f"No PDF found in the corpus directory '{EnvConfig.CORPUS_DIR}'")
+    return paths
+
+
+def corpus_signature():
+    """
+    Identifies the current content of the corpus directory: the path, modification time and size of each of
+    its PDFs, so adding, removing or replacing a PDF changes it. Empty when no corpus directory is set.
+    """
+    if not EnvConfig.CORPUS_DIR:
+        return ()
+    signature = []
+    for path in corpus_paths():
+        try:
+            stat = os.stat(path)
+        except OSError:  # removed since it was listed
+            continue
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ShardSet:
+    """
+    The shards of a store, one per PDF of the corpus, searched in parallel on a thread pool.
+    A shard is loaded (or built) the first time it is searched and then stays in memory: every search fans
+    out to every shard, so dropping shards would reload them on every search. MAX_LOADED_SHARDS bounds
+    the number of PDFs a corpus may have instead.
+    """
+
+    def __init__(self, paths, load_shard, max_workers=None, max_loaded=None):
+        """
+        Args:
+            paths: The paths of the PDFs, one shard each.
+            load_shard: A callable (path) loading or building the index of a shard.
+            max_workers: The number of shards searched at the same time, EnvConfig.SHARD_SEARCH_WORKERS by default.
+            max_loaded: The number of shards a store may keep in memory, EnvConfig.MAX_LOADED_SHARDS by default
+                (0 for no limit). A corpus with more PDFs is refused.
+        """
+        self.paths = list(paths)
+        self.load_shard = load_shard
+        self.max_loaded = EnvConfig.MAX_LOADED_SHARDS if max_loaded is None else max_loaded
+        if self.max_loaded and len(self.paths) > self.max_loaded:
+            raise ValueError(
+                f"The corpus has {len(self.paths)} PDFs but MAX_LOADED_SHARDS only lets a store keep {self.max_loaded} shards "
+                f"in memory. Every search reads every shard, raise MAX_LOADED_SHARDS or split the corpus"
+            )
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self._load_locks = {path: threading.Lock() for path in self.paths}
+        # The searches run in the context of the caller, so callbacks and the run's tracer reach them
+        self._executor = ContextThreadPoolExecutor(max_workers=max_workers or EnvConfig.SHARD_SEARCH_WORKERS)
+        self._active_searches = 0
+        self._closed = False
+
+    def shard(self, path):
+        """Returns the index of a shard, loading it on first use."""
+        with self._lock:
+            if path in self._loaded:
+                return self._loaded[path]
+        with self._load_locks[path]:
+            with self._lock:
+                if path in self._loaded:
+                    return self._loaded[path]
+            index = self.load_shard(path)
+            with self._lock:
+                self._loaded[path] = index
+        return index
+
+    def map(self, search):
+        """
+        Runs search(index) on every shard in parallel and returns the results in shard order.
+        Once the shard set is closed, the shards are searched one after the other on the calling thread.
+        """
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._active_searches += 1
+        if closed:
+            return [search(self.shard(path)) for path in self.paths]
+        try:
+            return list(self._executor.map(lambda path: search(self.shard(path)), self.paths))
+        finally:
+            with self._lock:
+                self._active_searches -= 1
+                shutdown = self._closed and not self._active_searches
+            if shutdown:
+                self._executor.shutdown(wait=False)
+
+    def close(self):
+        """Shuts the thread pool down, once the searches running on it are done."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            shutdown = not self._active_searches
+        if shutdown:
+            self._executor.shutdown(wait=False)
+
+
+def merge_by_rank(shard_results, k):
+    """
+    Merges the (document, distance) rankings of several shards into the global top k by rank: the first
+    results of every shard, then the second ones, and so on. This is reciprocal rank fusion of rankings that
+    share no document, for distances that can't be compared across shards, they only order the results of a rank.
+    """
+    ranked = ((rank, result) for results in shard_results for rank, result in enumerate(results))
+    return [result for _, result in heapq.nsmallest(k, ranked, key=lambda item: (item[0], item[1][1]))]
+
+
+class ShardedVectorIndex:
+    """
+    Vector index made of one vector store per shard. The query is embedded once, every shard returns its
+    own top k and the results are merged into the global top k by distance. Shards compacted with PCA
+    compare vectors in a projection learned from their own vectors, so their results are merged by rank.
+    """
+
+    def __init__(self, shards, embeddings=None):
+        self.shards = shards
+        self.embeddings = embeddings or get_embedding_service()
+
+    def similarity_search_with_score(self, query, k=4):
+        embedding = self.embeddings.embed_query(query)
+        results = self.shards.map(lambda vectorstore: (vectorstore.similarity_search_with_score_by_vector(embedding, k), has_projection(vectorstore)))
+        if any(projected for _, projected in results):
+            return merge_by_rank([shard_results for shard_results, _ in results], k)
+        return heapq.nsmallest(k, (result for shard_results, _ in results for result in shard_results), key=lambda result: result[1])
+
+    def similarity_search(self, query, k=4):
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def close(self):
+        self.shards.close()
+
+
+class ShardedLexicalIndex:
+    """
+    BM25 index made of one BM25 index per shard, the shard results are merged into the global top k by score.
+    Every shard keeps its own term statistics, so scores of different shards are only approximately comparable.
+    """
+
+    def __init__(self, shards):
+        self.shards = shards
+
+    def search(self, query, k=4):
+        results = self.shards.map(lambda lexical_index: lexical_index.search(query, k))
+        return heapq.nlargest(k, (result for shard_results in results for result in shard_results), key=lambda result: result[1])
+
+    def close(self):
+        self.shards.close()
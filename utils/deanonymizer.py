@@ -0,0 +1,80 @@
+import re
+
+# Placeholders that are also English words, an occurrence may be the word and not the placeholder
+AMBIGUOUS_PLACEHOLDERS = {"A", "I"}
+
+
+def _placeholder_pattern(placeholders):
+    # Longest placeholders first so 'X1' is never matched as 'X'
+    alternation = "|".join(re.escape(placeholder) for placeholder in sorted(placeholders, key=len, reverse=True))
+    return re.compile(rf"(?<![\w-])({alternation})(?![\w-])")
+
+
+def find_ambiguous_placeholders(text, mapping):
+    """
+    Finds the placeholders whose occurrences in a text can't be substituted safely:
+    placeholders glued to a hyphen ('X-ray'), placeholders that are also English words ('A', 'I')
+    and placeholders that appear with another case ('x' for 'X').
+
+    Args:
+        text: The text to check.
+        mapping: The mapping of placeholders to the original name entities.
+
+    Returns:
+        The sorted list of ambiguous placeholders found in the text.
+    """
+    ambiguous = set()
+    for placeholder in mapping:
+        escaped = re.escape(placeholder)
+        if re.search(rf"(?<![\w-]){escaped}-|-{escaped}(?![\w-])", text):
+            ambiguous.add(placeholder)
+        if placeholder in AMBIGUOUS_PLACEHOLDERS and re.search(rf"(?<![\w-]){escaped}(?![\w-])", text):
+            ambiguous.add(placeholder)
+        if placeholder.lower() != placeholder and placeholder.lower() not in mapping \
+                and re.search(rf"(?<![\w-]){re.escape(placeholder.lower())}(?![\w-])", text):
+            ambiguous.add(placeholder)
+    return sorted(ambiguous)
+
+
+def deanonymize_text(text, mapping):
+    """
+    Replaces every placeholder of a text by its original name entity, in a single pass so
+    substituted entities are never substituted again. Only whole tokens are replaced:
+    'X' and "X's" are, 'XY' and 'X-ray' are not.
+
+    Args:
+        text: The anonymized text.
+        mapping: The mapping of placeholders to the original name entities.
+
+    Returns:
+        A (text, ambiguous placeholders) tuple.
+    """
+    if not mapping:
+        return text, []
+    mapping = {str(placeholder): str(entity) for placeholder, entity in mapping.items()}
+    ambiguous = find_ambiguous_placeholders(text, mapping)
+    deanonymized = _placeholder_pattern(mapping).sub(lambda match: mapping[match.group(1)], text)
+    return deanonymized, ambiguous
+
+
+def deanonymize_plan(plan, mapping):
+    """
+    De-anonymizes every step of a plan.
+
+    Args:
+        plan: The list of anonymized steps.
+        mapping: The mapping of placeholders to the original name entities.
+
+    Returns:
+        A (plan, unresolved) tuple, where unresolved maps the index of every step that still needs
+        to be de-anonymized by other means to its ambiguous placeholders.
+    """
+    deanonymized_plan = []
+    unresolved = {}
+    for index, step in enumerate(plan):
+        deanonymized_step, ambiguous = deanonymize_text(step, mapping)
+        if ambiguous:
+            unresolved[index] = ambiguous
+            deanonymized_step = step
+        deanonymized_plan.append(deanonymized_step)
+    return deanonymized_plan, unresolved
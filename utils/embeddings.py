@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from ..config import EnvConfig
+from .tracing import trace_span
+
+MODEL_NAME = "avsolatorio/GIST-large-Embedding-v0"
+
+
+class EmbeddingService(Embeddings):
+    """
+    Embeddings shared by every vector store of the process.
+    The model is loaded once, on first use, documents are encoded in batches of a configurable size
+    and query embeddings are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, batch_size=32, num_threads=None, query_cache_size=1024):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.query_cache_size = query_cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "model_loads": 0,
+            "documents_embedded": 0,
+            "batches": 0,
+            "max_batch_size": 0,
+            "queries_embedded": 0,
+            "query_cache_hits": 0,
+            "query_cache_misses": 0,
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    if self.num_threads:
+                        import torch
+                        torch.set_num_threads(self.num_threads)
+                    self._model = HuggingFaceEmbeddings(
+                        model_name=self.model_name,
+                        encode_kwargs={"batch_size": self.batch_size},
+                    )
+                    self._increment("model_loads")
+        return self._model
+
+    def embed_documents(self, texts):
+        """Embeds documents in batches of batch_size."""
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            with trace_span("embed_documents", "embedding", batch_size=len(batch)):
+                embeddings.extend(self.model.embed_documents(batch))
+            with self._metrics_lock:
+                self._metrics["batches"] += 1
+                self._metrics["documents_embedded"] += len(batch)
+                self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], len(batch))
+        return embeddings
+
+    def embed_query(self, text):
+        """Embeds a query, returning the cached embedding when the same query was embedded before."""
+        # Queries that only differ by whitespace share one cache entry
+        key = " ".join(text.split())
+        with self._cache_lock:
+            embedding = self._query_cache.get(key)
+            if embedding is not None:
+                self._query_cache.move_to_end(key)
+        if embedding is not None:
+            self._increment("query_cache_hits")
+            return list(embedding)
+
+        self._increment("query_cache_misses")
+        with trace_span("embed_query", "embedding"):
+            embedding = self.model.embed_query(key)
+        self._increment("queries_embedded")
+        with self._cache_lock:
+            self._query_cache[key] = tuple(embedding)
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+    def clear_query_cache(self):
+        with self._cache_lock:
+            self._query_cache.clear()
+
+    def metrics(self):
+        """
+        Returns the embedding metrics: model load count, documents and batches embedded,
+        query cache hits and misses and the query cache hit rate.
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        lookups = metrics["query_cache_hits"] + metrics["query_cache_misses"]
+        metrics["query_cache_hit_rate"] = metrics["query_cache_hits"] / lookups if lookups else 0.0
+        metrics["mean_batch_size"] = metrics["documents_embedded"] / metrics["batches"] if metrics["batches"] else 0.0
+        metrics["query_cache_size"] = len(self._query_cache)
+        return metrics
+
+    def _increment(self, name, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """Returns the embedding service of the process, creating it on first use."""
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(
+                    model_name=MODEL_NAME,
+                    batch_size=EnvConfig.EMBEDDING_BATCH_SIZE,
+                    num_threads=EnvConfig.EMBEDDING_NUM_THREADS,
+                    query_cache_size=EnvConfig.QUERY_EMBEDDING_CACHE_SIZE,
+                )
+    return _embedding_service
@@ -0,0 +1,128 @@
+import math
+
+import numpy as np
+
+from ..config import EnvConfig
+from .embeddings import get_embedding_service
+from .helper_functions import num_tokens_from_string
+
+_token_counter = None
+_embeddings = None
+
+
+def set_token_counter(counter):
+    """
+    Replaces the tiktoken based token count of the evidence, e.g. by a local approximation when the
+    tokenizer can't be downloaded. None restores the default.
+    """
+    global _token_counter
+    _token_counter = counter
+
+
+def set_evidence_embeddings(embeddings):
+    """
+    Replaces the shared embedding service in the evidence selection, e.g. by a local stand-in when the
+    model can't be downloaded. None restores the default.
+    """
+    global _embeddings
+    _embeddings = embeddings
+
+
+def count_tokens(text):
+    if _token_counter is not None:
+        return _token_counter(text)
+    return num_tokens_from_string(text, EnvConfig.EVIDENCE_TOKEN_MODEL)
+
+
+def add_evidence(state, tool, query, content):
+    """
+    Adds the content distilled or answered by a step to the evidence of the plan execution, then compacts
+    the oldest evidence if the evidence exceeds EnvConfig.EVIDENCE_MAX_TOKENS.
+
+    Args:
+        state: The current state of the plan execution.
+        tool: The tool of the step ('retrieve_chunks', 'retrieve_summaries', 'retrieve_quotes' or 'answer').
+        query: The query the step retrieved or answered.
+        content: The distilled content or answer.
+
+    Returns:
+        The state.
+    """
+    if not state.evidence:
+        state.evidence = []
+    if content and content.strip():
+        state.evidence.append({
+            "id": f"E{len(state.evidence) + 1}",
+            "tool": tool,
+            "query": query,
+            "content": content,
+            "tokens": count_tokens(content),
+            "compacted": False,
+        })
+    compact_evidence(state.evidence, EnvConfig.EVIDENCE_MAX_TOKENS, EnvConfig.EVIDENCE_COMPACTED_TOKENS)
+    return state
+
+
+def truncate_to_tokens(text, tokens, max_tokens):
+    """Keeps the leading words of a text of the given token count so it is about max_tokens long."""
+    words = text.split()
+    kept = words[:max(math.floor(len(words) * max_tokens / tokens), 1)]
+    return " ".join(kept) + (" ..." if len(kept) < len(words) else "")
+
+
+def compact_evidence(evidence, max_tokens, compacted_tokens):
+    """
+    Compacts the oldest evidence items, one at a time, to their first compacted_tokens tokens until the
+    evidence fits in max_tokens. The most recent item is never compacted.
+    """
+    total = sum(item["tokens"] for item in evidence)
+    for item in evidence[:-1]:
+        if total <= max_tokens:
+            break
+        if item["compacted"] or item["tokens"] <= compacted_tokens:
+            continue
+        item["content"] = truncate_to_tokens(item["content"], item["tokens"], compacted_tokens)
+        total -= item["tokens"]
+        item["tokens"] = count_tokens(item["content"])
+        item["compacted"] = True
+        total += item["tokens"]
+
+
+def select_evidence(evidence, task, max_tokens):
+    """
+    Selects the evidence a prompt gets within a token budget. When all the evidence fits, it is all selected;
+    otherwise the items most similar to the task (by embedding cosine similarity) are picked first until the
+    budget is spent. When no item fits, the most similar one is truncated to the budget rather than dropped.
+
+    Returns:
+        The selected items, in the order they were added.
+    """
+    if sum(item["tokens"] for item in evidence) <= max_tokens:
+        return list(evidence)
+    embeddings = _embeddings or get_embedding_service()
+    task_vector = np.asarray(embeddings.embed_query(task))
+    item_vectors = np.asarray([embeddings.embed_query(item["content"]) for item in evidence])
+    similarities = item_vectors @ task_vector / (np.linalg.norm(item_vectors, axis=1) * np.linalg.norm(task_vector) + 1e-12)
+    ranking = np.argsort(-similarities)
+    selected = set()
+    budget = max_tokens
+    for position in ranking:
+        if evidence[position]["tokens"] <= budget:
+            selected.add(position)
+            budget -= evidence[position]["tokens"]
+    if not selected:
+        item = evidence[ranking[0]]
+        content = truncate_to_tokens(item["content"], item["tokens"], max_tokens)
+        return [{**item, "content": content, "tokens": count_tokens(content)}]
+    return [item for position, item in enumerate(evidence) if position in selected]
+
+
+def evidence_context(state, task, max_tokens=None):
+    """
+    Returns the context a prompt gets for a task: the evidence selected within
+    EnvConfig.EVIDENCE_TOKEN_BUDGET tokens, see select_evidence.
+    """
+    if not state.evidence:
+        return ""
+    selected = select_evidence(state.evidence, task, max_tokens or EnvConfig.EVIDENCE_TOKEN_BUDGET)
+    return "\n".join(item["content"] for item in selected)
@@ -0,0 +1,47 @@
+import re
+
+from ..config import EnvConfig
+
+WORD_PATTERN = re.compile(r"\w+")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def normalized_words(text):
+    """The lowercased words of a text, without punctuation, quotes or escapes."""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def ngrams(words, n):
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def is_extractive(distilled_content, original_context, n=None, min_overlap=None):
+    """
+    Whether distilled content was provably extracted from the original context: every sentence of it appears
+    nearly verbatim in the context. A sentence of at least n words must have min_overlap of its word n-grams in
+    the context, a shorter one must appear in it as a whole. Words are compared normalized, so punctuation and
+    case changes don't matter.
+
+    Args:
+        distilled_content: The distilled content.
+        original_context: The context it was distilled from.
+        n: The n-gram size, EnvConfig.EXTRACTIVE_NGRAM_SIZE by default.
+        min_overlap: The share of the n-grams of a sentence the context must contain, EnvConfig.EXTRACTIVE_MIN_OVERLAP by default.
+    """
+    n = n or EnvConfig.EXTRACTIVE_NGRAM_SIZE
+    min_overlap = EnvConfig.EXTRACTIVE_MIN_OVERLAP if min_overlap is None else min_overlap
+    context_words = normalized_words(original_context)
+    context_ngrams = ngrams(context_words, n)
+    context_text = f" {' '.join(context_words)} "
+    for sentence in SENTENCE_END_PATTERN.split(distilled_content):
+        words = normalized_words(sentence)
+        if not words:
+            continue
+        if len(words) < n:
+            if f" {' '.join(words)} " not in context_text:
+                return False
+            continue
+        sentence_ngrams = [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+        if sum(ngram in context_ngrams for ngram in sentence_ngrams) < min_overlap * len(sentence_ngrams):
+            return False
+    return True
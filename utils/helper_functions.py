@@ -1,9 +1,17 @@
+from functools import lru_cache
 from typing import List
 from langchain.docstore.document import Document
 import tiktoken
 import re
 import PyPDF2
 
+# Chapter titles look like "CHAPTER ONE", "CHAPTER TWENTY ONE"... (adjust as needed)
+CHAPTER_TITLE_PATTERN = re.compile(r'(CHAPTER\s[A-Z]+(?:\s[A-Z]+)*)')
+
+def quote_pattern(min_length=50):
+    """Returns the pattern of quotes longer than min_length characters, including line breaks."""
+    return re.compile(rf'“(.{{{min_length},}}?)”', re.DOTALL)
+
 def replace_t_with_space(documents: List[Document]) -> List[Document]:
     """Replace 't' characters with spaces in document content."""
     cleaned_docs = []
@@ -29,6 +37,36 @@ def text_wrap(text: str, width: int = 100) -> str:
     import textwrap
     return textwrap.fill(text, width=width)
 
+def parse_key_value_pairs(text, value_type=int):
+    """
+    Parses settings written as 'key=value,key=value'.
+
+    Args:
+        text: The string to parse, may be empty or None.
+        value_type: The type the values are converted to.
+
+    Returns:
+        A dict mapping keys to their converted values.
+    """
+    parsed = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        key, value = item.split("=", 1)
+        parsed[key.strip()] = value_type(value.strip())
+    return parsed
+
+@lru_cache(maxsize=None)
+def get_token_encoding(encoding_name):
+    """
+    Returns the tiktoken encoding of a model name (e.g. 'gpt-4o') or an encoding name (e.g. 'cl100k_base').
+    Resolving an encoding loads its BPE ranks, so each one is resolved once per process.
+    """
+    try:
+        return tiktoken.encoding_for_model(encoding_name)
+    except KeyError:
+        return tiktoken.get_encoding(encoding_name)
+
 def num_tokens_from_string(string: str, encoding_name: str) -> int:
     """
     Calculates the number of tokens in a given string using a specified encoding.
@@ -41,7 +79,7 @@ def num_tokens_from_string(string: str, encoding_name: str) -> int:
         The number of tokens in the string according to the specified encoding.
     """
 
-    encoding = tiktoken.encoding_for_model(encoding_name)  # Get the encoding object
+    encoding = get_token_encoding(encoding_name)  # Get the encoding object
     num_tokens = len(encoding.encode(string))  # Encode the string and count tokens
     return num_tokens
 
@@ -64,7 +102,7 @@ def split_into_chapters(book_path):
         text = " ".join([doc.extract_text() for doc in documents])
 
         # Split text into chapters based on chapter title pattern (adjust as needed)
-        chapters = re.split(r'(CHAPTER\s[A-Z]+(?:\s[A-Z]+)*)', text)
+        chapters = CHAPTER_TITLE_PATTERN.split(text)
 
         # Create Document objects with chapter metadata
         chapter_docs = []
@@ -80,7 +118,7 @@ def split_into_chapters(book_path):
 def extract_book_quotes_as_documents(documents, min_length=50):
     quotes_as_documents = []
     # Correct pattern for quotes longer than min_length characters, including line breaks
-    quote_pattern_longer_than_min_length = re.compile(rf'“(.{{{min_length},}}?)”', re.DOTALL)
+    quote_pattern_longer_than_min_length = quote_pattern(min_length)
 
     for doc in documents:
         content = doc.page_content
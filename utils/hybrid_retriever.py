@@ -0,0 +1,107 @@
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from ..utils.corpus import ShardSet, ShardedVectorIndex, ShardedLexicalIndex
+from ..utils.index_store import document_id
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+
+
+def document_key(document):
+    """Identifies a document across indexes, the same chunk being a different object in each index."""
+    return (document.page_content, document.metadata.get("source"), document.metadata.get("offset"))
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    """
+    Fuses several rankings of documents with reciprocal rank fusion: every document scores
+    the sum of 1 / (rrf_k + rank) over the rankings it appears in.
+
+    Args:
+        rankings: Lists of documents, best first.
+        k: The number of documents to return.
+        rrf_k: The rank offset damping the weight of the first ranks.
+
+    Returns:
+        The k best documents, best first.
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining a BM25 lexical index with a dense vector store.
+    In 'hybrid' mode both rankings are fused with reciprocal rank fusion, in 'lexical' mode only
+    the BM25 index is searched (the embedding model is never used) and in 'dense' mode only the vector store.
+    Every returned document carries its stable id (see utils.index_store.document_id) in its 'id' metadata,
+    and the number of documents can be changed per call with a k keyword argument.
+    """
+
+    vectorstore: Optional[Any] = None
+    lexical_index: Optional[Any] = None
+    mode: str = "hybrid"
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, k: Optional[int] = None) -> List[Document]:
+        k = k or self.k
+        if self.mode == "lexical":
+            documents = [document for document, _ in self.lexical_index.search(query, k)]
+        elif self.mode == "dense":
+            documents = self.vectorstore.similarity_search(query, k=k)
+        else:
+            fetch_k = max(self.fetch_k, k)
+            lexical_ranking = [document for document, _ in self.lexical_index.search(query, fetch_k)]
+            dense_ranking = self.vectorstore.similarity_search(query, k=fetch_k)
+            documents = reciprocal_rank_fusion([lexical_ranking, dense_ranking], k, self.rrf_k)
+        # Copies, the indexed documents are shared by every search
+        return [Document(page_content=document.page_content, metadata={**document.metadata, "id": document_id(document)}) for document in documents]
+
+    def close(self):
+        """Releases the thread pools of sharded indexes, once their running searches are done."""
+        for index in (self.vectorstore, self.lexical_index):
+            if hasattr(index, "close"):
+                index.close()
+
+
+def create_query_retriever(encode_dense, encode_lexical, k, mode, paths):
+    """
+    Creates the retriever of a store for a retrieval mode.
+    With several PDFs, every PDF gets its own shard of the store, loaded on first use and searched in parallel.
+
+    Args:
+        encode_dense: A callable (path) returning the FAISS vector store of a PDF.
+        encode_lexical: A callable (path) returning the BM25 index of a PDF, None if the store has none.
+        k: The number of documents retrieved.
+        mode: 'dense', 'hybrid' or 'lexical'.
+        paths: The paths of the PDFs, see utils.corpus.corpus_paths.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Invalid retrieval mode '{mode}'. Must be one of {', '.join(RETRIEVAL_MODES)}")
+    if encode_lexical is None:
+        mode = "dense"
+    if len(paths) == 1:
+        if mode == "dense":
+            return HybridRetriever(vectorstore=encode_dense(paths[0]), mode=mode, k=k)
+        lexical_index = encode_lexical(paths[0])
+        vectorstore = encode_dense(paths[0]) if mode == "hybrid" else None
+        return HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, mode=mode, k=k)
+
+    vectorstore = ShardedVectorIndex(ShardSet(paths, encode_dense)) if mode != "lexical" else None
+    lexical_index = ShardedLexicalIndex(ShardSet(paths, encode_lexical)) if mode != "dense" else None
+    return HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index, mode=mode, k=k)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from time import monotonic
+
+from langchain.vectorstores import FAISS
+
+from ..config import EnvConfig
+
+MANIFEST_FILE_NAME = "manifest.json"
+
+# The key fields that describe the source content, a saved index differing only by them can be updated incrementally
+CONTENT_KEY_FIELDS = ("pdf_hash",)
+
+
+def file_content_hash(path, block_size=1 << 20):
+    """
+    Computes the sha256 hash of a file's content.
+
+    Args:
+        path: The path to the file.
+        block_size: The number of bytes read at a time.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def text_hash(text):
+    """Computes the sha256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_id(document):
+    """Returns the stable id of a document: the hash of its content, the same across ingestions and indexes."""
+    return text_hash(document.page_content)[:32]
+
+
+def document_ids(documents):
+    """
+    Returns stable ids for documents: the hash of their content, repeated contents getting an occurrence suffix.
+    The same text gets the same id across ingestions, wherever it moved in the source.
+    """
+    occurrences = {}
+    ids = []
+    for document in documents:
+        content_hash = document_id(document)
+        occurrence = occurrences.get(content_hash, 0)
+        occurrences[content_hash] = occurrence + 1
+        ids.append(content_hash if occurrence == 0 else f"{content_hash}-{occurrence}")
+    return ids
+
+
+def same_configuration(saved_key, key):
+    """Whether two index keys only differ by the source content."""
+    def configuration(k):
+        return {field: value for field, value in k.items() if field not in CONTENT_KEY_FIELDS}
+    return configuration(saved_key) == configuration(key)
+
+
+def index_directory(store_name, source_path):
+    """
+    Returns the directory in which the index of a given store and source is saved.
+
+    Args:
+        store_name: The name of the store (e.g. 'chunks', 'summaries', 'quotes').
+        source_path: The path to the source document the index is built from.
+    """
+    source_id = text_hash(os.path.abspath(source_path))[:16]
+    return os.path.join(EnvConfig.INDEX_DIR, store_name, source_id)
+
+
+def read_manifest(directory):
+    """Reads the manifest of a saved index, or returns None if there is none."""
+    manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_index(vectorstore, directory, key, save=None):
+    """
+    Saves a FAISS index and its docstore to disk together with the key it was built for.
+    The index is written to a temporary directory first and then moved in place, so a crash
+    never leaves a half written index behind.
+
+    Args:
+        vectorstore: The FAISS vector store to save.
+        directory: The directory to save the index in.
+        key: A json serializable dict identifying the content of the index.
+        save: A callable (index, directory) saving other kinds of indexes, FAISS save_local by default.
+    """
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    tmp_directory = tempfile.mkdtemp(dir=parent)
+    if save is None:
+        vectorstore.save_local(tmp_directory)
+    else:
+        save(vectorstore, tmp_directory)
+    with open(os.path.join(tmp_directory, MANIFEST_FILE_NAME), 'w', encoding="utf-8") as f:
+        json.dump({"key": key}, f, indent=2, sort_keys=True)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+
+
+def load_or_build_index(store_name, source_path, key, build_vectorstore, embeddings=None, load=None, save=None, update=None):
+    """
+    Loads a saved FAISS index if it was built for the same key, otherwise builds it and saves it.
+    When only the source content changed and an update function is given, the saved index is updated
+    incrementally instead of rebuilt.
+    Other kinds of indexes (e.g. lexical ones) are stored the same way by passing their load and save functions.
+
+    Args:
+        store_name: The name of the store (e.g. 'chunks', 'summaries', 'quotes').
+        source_path: The path to the source document the index is built from.
+        key: A json serializable dict of everything the index content depends on
+            (source content hash, splitting parameters, embedding model, preprocessing version...).
+        build_vectorstore: A callable with no arguments that builds the FAISS vector store.
+        embeddings: The embeddings used to embed queries against the loaded index.
+        load: A callable (directory) loading other kinds of indexes, FAISS load_local by default.
+        save: A callable (index, directory) saving other kinds of indexes, FAISS save_local by default.
+        update: A callable (index) updating a saved index to the current source content and returning it.
+
+    Returns:
+        The FAISS vector store (or the index built by build_vectorstore).
+    """
+    def load_index():
+        if load is None:
+            return FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+        return load(directory)
+
+    directory = index_directory(store_name, source_path)
+    manifest = read_manifest(directory)
+    if manifest is not None and manifest["key"] == key:
+        start_time = monotonic()
+        vectorstore = load_index()
+        print(f"Loaded {store_name} index from {directory} in {monotonic() - start_time:.3f}s")
+        return vectorstore
+
+    if manifest is not None and update is not None and same_configuration(manifest["key"], key):
+        print(f"Updating {store_name} index...")
+        start_time = monotonic()
+        vectorstore = update(load_index())
+        save_index(vectorstore, directory, key, save)
+        print(f"Updated and saved {store_name} index to {directory} in {monotonic() - start_time:.3f}s")
+        return vectorstore
+
+    print(f"Building {store_name} index...")
+    start_time = monotonic()
+    vectorstore = build_vectorstore()
+    save_index(vectorstore, directory, key, save)
+    print(f"Built and saved {store_name} index to {directory} in {monotonic() - start_time:.3f}s")
+    return vectorstore
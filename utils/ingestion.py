@@ -0,0 +1,170 @@
+import bisect
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+
+from ..config import EnvConfig
+from .helper_functions import CHAPTER_TITLE_PATTERN, quote_pattern, replace_t_with_space
+from .index_store import file_content_hash
+
+# Pages are joined with this separator when the book is seen as one text (chapters, offsets)
+PAGE_SEPARATOR = " "
+
+
+class IngestedBook:
+    """
+    The text of a PDF book, extracted once and shared by every derivation (chunks, chapters, quotes).
+
+    Attributes:
+        path: The path to the PDF file.
+        content_hash: The sha256 of the PDF file content.
+        pages: The extracted text of every page.
+        page_offsets: The character offset of every page in the joined book text.
+        text: The text of all pages joined with PAGE_SEPARATOR.
+    """
+
+    def __init__(self, path, content_hash, pages):
+        self.path = path
+        self.content_hash = content_hash
+        self.pages = pages
+        self.page_offsets = []
+        offset = 0
+        for page_text in pages:
+            self.page_offsets.append(offset)
+            offset += len(page_text) + len(PAGE_SEPARATOR)
+        self.text = PAGE_SEPARATOR.join(pages)
+
+    def page_at(self, offset):
+        """Returns the number (0-based) of the page a character offset of the joined text falls in."""
+        return max(bisect.bisect_right(self.page_offsets, offset) - 1, 0)
+
+
+def _extract_page_range(path, start, end):
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+def extract_pages(path, max_workers=None):
+    """
+    Extracts the text of every page of a PDF file.
+
+    Args:
+        path: The path to the PDF file.
+        max_workers: The number of processes extracting pages in parallel,
+            EnvConfig.INGESTION_WORKERS by default. 1 extracts in the current process.
+
+    Returns:
+        The list of page texts, in page order.
+    """
+    max_workers = max_workers or EnvConfig.INGESTION_WORKERS
+    num_pages = len(PdfReader(path).pages)
+    if max_workers <= 1 or num_pages < 2 * max_workers:
+        return _extract_page_range(path, 0, num_pages)
+
+    # Each worker opens the file itself and extracts a contiguous range of pages
+    range_size = -(-num_pages // max_workers)
+    ranges = [(start, min(start + range_size, num_pages)) for start in range(0, num_pages, range_size)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_extract_page_range, path, start, end) for start, end in ranges]
+        return [page_text for future in futures for page_text in future.result()]
+
+
+_ingested_books = {}
+_ingested_books_lock = threading.Lock()
+
+
+def ingest_pdf(path):
+    """
+    Extracts the text of a PDF book once per process and content.
+    Later calls for the same, unchanged file return the same IngestedBook.
+
+    Args:
+        path: The path to the PDF file.
+    """
+    content_hash = file_content_hash(path)
+    cache_key = (os.path.abspath(path), content_hash)
+    with _ingested_books_lock:
+        book = _ingested_books.get(cache_key)
+        if book is None:
+            book = IngestedBook(path, content_hash, extract_pages(path))
+            # Only the latest version of a file is worth keeping around
+            for key in [key for key in _ingested_books if key[0] == cache_key[0]]:
+                del _ingested_books[key]
+            _ingested_books[cache_key] = book
+    return book
+
+
+def page_documents(book):
+    """Returns one Document per page, with the same metadata as PyPDFLoader plus the page offset."""
+    return [
+        Document(page_content=page_text, metadata={"source": book.path, "page": page, "offset": book.page_offsets[page]})
+        for page, page_text in enumerate(book.pages)
+    ]
+
+
+def chunk_documents(book, chunk_size=1000, chunk_overlap=200):
+    """
+    Splits the pages of a book into chunks with a RecursiveCharacterTextSplitter.
+
+    Returns:
+        The list of chunk Documents, each with its page and its character offset in the book text.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        add_start_index=True,
+    )
+    chunks = text_splitter.split_documents(page_documents(book))
+    for chunk in chunks:
+        chunk.metadata["offset"] = chunk.metadata["offset"] + chunk.metadata.pop("start_index")
+    return replace_t_with_space(chunks)
+
+
+def chapter_documents(book):
+    """
+    Splits a book into chapters based on chapter title patterns.
+
+    Returns:
+        The list of chapter Documents, each with its chapter number, first and last page and character offset.
+    """
+    titles = list(CHAPTER_TITLE_PATTERN.finditer(book.text))
+    chapter_docs = []
+    for chapter_num, title in enumerate(titles, start=1):
+        start = title.start()
+        end = titles[chapter_num].start() if chapter_num < len(titles) else len(book.text)
+        chapter_docs.append(Document(
+            page_content=book.text[start:end],
+            metadata={
+                "chapter": chapter_num,
+                "source": book.path,
+                "page": book.page_at(start),
+                "end_page": book.page_at(max(end - 1, start)),
+                "offset": start,
+            },
+        ))
+    return replace_t_with_space(chapter_docs)
+
+
+def quote_documents(book, min_length=50):
+    """
+    Extracts the quotes longer than min_length characters from every page of a book.
+
+    Returns:
+        The list of quote Documents, each with its page and its character offset in the book text.
+    """
+    pattern = quote_pattern(min_length)
+    quotes = []
+    for page, page_text in enumerate(book.pages):
+        # Both replacements keep the text length, so match positions are valid page offsets
+        content = page_text.replace('\t', ' ').replace('\n', ' ')
+        for match in pattern.finditer(content):
+            quotes.append(Document(
+                page_content=match.group(1),
+                metadata={"source": book.path, "page": page, "offset": book.page_offsets[page] + match.start(1)},
+            ))
+    return quotes
@@ -0,0 +1,76 @@
+import math
+import os
+import pickle
+import re
+from collections import Counter
+
+from .tracing import trace_span
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+LEXICAL_INDEX_FILE_NAME = "bm25.pkl"
+
+
+def tokenize(text):
+    """Splits a text into lower case word tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over a list of documents.
+
+    Attributes:
+        documents: The indexed Documents, search results refer to them by position.
+        postings: For every term, the list of (document position, term frequency) pairs.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = []
+        for position, document in enumerate(documents):
+            term_frequencies = Counter(tokenize(document.page_content))
+            self.doc_lengths.append(sum(term_frequencies.values()))
+            for term, frequency in term_frequencies.items():
+                self.postings.setdefault(term, []).append((position, frequency))
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        num_documents = len(documents)
+        self.idf = {
+            term: math.log(1 + (num_documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k=4):
+        """
+        Scores the documents containing at least one query term.
+
+        Args:
+            query: The query text.
+            k: The number of results.
+
+        Returns:
+            The list of (Document, score) pairs of the k best documents, best first.
+        """
+        with trace_span("bm25_search", "search", k=k, documents=len(self.documents)):
+            scores = {}
+            for term in set(tokenize(query)):
+                idf = self.idf.get(term)
+                if idf is None:
+                    continue
+                for position, frequency in self.postings[term]:
+                    length_norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_doc_length
+                    scores[position] = scores.get(position, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+            best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(self.documents[position], score) for position, score in best]
+
+    def save(self, directory):
+        with open(os.path.join(directory, LEXICAL_INDEX_FILE_NAME), 'wb') as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, LEXICAL_INDEX_FILE_NAME), 'rb') as f:
+            return pickle.load(f)
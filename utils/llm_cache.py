@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.runnables import RunnableLambda
+
+from ..config import EnvConfig
+from .helper_functions import parse_key_value_pairs
+
+
+class ResponseCache:
+    """
+    SQLite backed cache of LLM chain outputs.
+    Entries expire after their chain's TTL and the least recently used entries are evicted
+    once the total size of the cached values exceeds max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                chain TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.commit()
+
+    def get(self, key, chain_name):
+        """Returns the cached value of a key, or None on a miss or if the entry expired."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                row = None
+            if row is None:
+                self._count(chain_name, "misses")
+                return None
+            self._connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self._count(chain_name, "hits")
+            return json.loads(row[0])
+
+    def put(self, key, chain_name, value, ttl=None):
+        """
+        Caches a json serializable value.
+
+        Args:
+            key: The cache key.
+            chain_name: The name of the chain the value was produced by.
+            value: The value to cache.
+            ttl: The time to live in seconds, None for no expiry.
+        """
+        now = time.time()
+        serialized = json.dumps(value)
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, chain, value, size, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, chain_name, serialized, len(serialized.encode("utf-8")), now, expires_at, now),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def stats(self):
+        """Returns the hit and miss counters per chain, plus the number of entries and total bytes cached."""
+        with self._lock:
+            entries, total_bytes = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {"chains": {name: dict(counters) for name, counters in self._stats.items()}, "entries": entries, "bytes": total_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def _evict(self):
+        total_bytes = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return
+        # Drop the least recently used entries until the cache fits again
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total_bytes -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def _count(self, chain_name, counter):
+        counters = self._stats.setdefault(chain_name, {"hits": 0, "misses": 0})
+        counters[counter] += 1
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the response cache of the process, creating it on first use."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(EnvConfig.LLM_CACHE_PATH, EnvConfig.LLM_CACHE_MAX_BYTES)
+    return _response_cache
+
+
+def chain_ttl(chain_name):
+    """Returns the TTL in seconds of a chain's cached responses, 0 meaning the chain is not cached."""
+    return parse_key_value_pairs(EnvConfig.LLM_CACHE_TTLS, float).get(chain_name, EnvConfig.LLM_CACHE_DEFAULT_TTL)
+
+
+def _schema_json(schema):
+    if schema is None:
+        return None
+    json_schema = schema.model_json_schema() if hasattr(schema, "model_json_schema") else schema.schema()
+    return json.dumps(json_schema, sort_keys=True)
+
+
+def _serialize(output):
+    if hasattr(output, "model_dump"):
+        return {"type": "model", "data": output.model_dump()}
+    if hasattr(output, "dict") and not isinstance(output, dict):
+        return {"type": "model", "data": output.dict()}
+    return {"type": "json", "data": output}
+
+
+def _deserialize(value, schema):
+    if value["type"] == "model":
+        return schema(**value["data"])
+    return value["data"]
+
+
+def with_response_cache(runnable, chain_name, schema=None, deployment=None, cacheable=True):
+    """
+    Wraps the LLM part of a chain (everything after the prompt) with the response cache.
+    The key is made of the deployment, the rendered prompt and the output schema. Caching only
+    happens when EnvConfig.LLM_CACHE_ENABLED is set and the chain's TTL is not 0.
+
+    Args:
+        runnable: The runnable receiving the rendered prompt, e.g. llm.with_structured_output(schema).
+        chain_name: The name the chain's TTL and counters are looked up by.
+        schema: The pydantic output schema of the chain.
+        deployment: The LLM deployment, EnvConfig.AZ_OAI_DEPLOYMENT by default.
+        cacheable: False for chains whose output must never be reused (e.g. non deterministic ones).
+
+    Returns:
+        A runnable with the same input and output as the wrapped one.
+    """
+    schema_json = _schema_json(schema)
+
+    def cache_key(prompt_value):
+        key = {
+            "chain": chain_name,
+            "deployment": deployment or EnvConfig.AZ_OAI_DEPLOYMENT,
+            "prompt": prompt_value.to_string(),
+            "schema": schema_json,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_enabled():
+        return cacheable and EnvConfig.LLM_CACHE_ENABLED and chain_ttl(chain_name) != 0
+
+    def invoke(prompt_value, config):
+        if not is_enabled():
+            return runnable.invoke(prompt_value, config)
+        cache = get_response_cache()
+        key = cache_key(prompt_value)
+        cached = cache.get(key, chain_name)
+        if cached is not None:
+            return _deserialize(cached, schema)
+        output = runnable.invoke(prompt_value, config)
+        cache.put(key, chain_name, _serialize(output), chain_ttl(chain_name))
+        return output
+
+    async def ainvoke(prompt_value, config):
+        if not is_enabled():
+            return await runnable.ainvoke(prompt_value, config)
+        cache = get_response_cache()
+        key = cache_key(prompt_value)
+        # SQLite calls block, so they run in a worker thread to keep the event loop free
+        cached = await asyncio.to_thread(cache.get, key, chain_name)
+        if cached is not None:
+            return _deserialize(cached, schema)
+        output = await runnable.ainvoke(prompt_value, config)
+        await asyncio.to_thread(cache.put, key, chain_name, _serialize(output), chain_ttl(chain_name))
+        return output
+
+    # The chain name is passed down as metadata so the LLM calls made by the chain can be attributed to it
+    return RunnableLambda(invoke, afunc=ainvoke, name=chain_name).with_config(metadata={"llm_chain": chain_name})
@@ -0,0 +1,126 @@
+import functools
+import threading
+
+import httpx
+from langchain_openai import AzureChatOpenAI
+
+from ..config import EnvConfig
+from .helper_functions import parse_key_value_pairs
+
+_lock = threading.RLock()
+_http_clients = {}
+_async_http_clients = {}
+_llms = {}
+_chains = {}
+_llm_factory = None
+
+
+def deployment_limits(deployment):
+    """The connection pool limits of a deployment, from EnvConfig.LLM_DEPLOYMENT_LIMITS or EnvConfig.LLM_MAX_CONNECTIONS."""
+    max_connections = parse_key_value_pairs(EnvConfig.LLM_DEPLOYMENT_LIMITS).get(deployment, EnvConfig.LLM_MAX_CONNECTIONS)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def get_http_client(deployment):
+    """
+    Returns the pooled HTTP client of a deployment, so keep-alive connections are reused across calls.
+
+    Args:
+        deployment: The name of the LLM deployment.
+    """
+    with _lock:
+        client = _http_clients.get(deployment)
+        if client is None:
+            client = httpx.Client(limits=deployment_limits(deployment), timeout=EnvConfig.LLM_TIMEOUT)
+            _http_clients[deployment] = client
+        return client
+
+
+def get_async_http_client(deployment):
+    """
+    Returns the pooled async HTTP client of a deployment, with the same limits as get_http_client, so the
+    questions sharing an event loop never open more connections to a deployment than it allows.
+
+    Args:
+        deployment: The name of the LLM deployment.
+    """
+    with _lock:
+        client = _async_http_clients.get(deployment)
+        if client is None:
+            client = httpx.AsyncClient(limits=deployment_limits(deployment), timeout=EnvConfig.LLM_TIMEOUT)
+            _async_http_clients[deployment] = client
+        return client
+
+
+def get_llm(deployment=None, **kwargs):
+    """
+    Returns the shared AzureChatOpenAI client of a deployment.
+
+    Args:
+        deployment: The name of the LLM deployment, EnvConfig.AZ_OAI_DEPLOYMENT by default.
+        kwargs: Additional AzureChatOpenAI parameters (e.g. max_retries). Clients with different
+            parameters are separate instances but share the deployment's connection pool.
+    """
+    deployment = deployment or EnvConfig.AZ_OAI_DEPLOYMENT
+    key = (deployment, tuple(sorted(kwargs.items())))
+    with _lock:
+        llm = _llms.get(key)
+        if llm is None and _llm_factory is not None:
+            llm = _llm_factory(deployment, **kwargs)
+            _llms[key] = llm
+        elif llm is None:
+            llm = AzureChatOpenAI(
+                azure_endpoint=EnvConfig.AZ_OAI_BASE,
+                api_key=EnvConfig.AZ_OPENAI_API_KEY,
+                api_version=EnvConfig.AZ_OAI_VERSION,
+                azure_deployment=deployment,
+                http_client=get_http_client(deployment),
+                http_async_client=get_async_http_client(deployment),
+                **kwargs,
+            )
+            _llms[key] = llm
+        return llm
+
+
+def cached_chain(init_chain):
+    """
+    Decorates a chain initializer so the chain is built lazily on first call and reused afterwards.
+    """
+    @functools.wraps(init_chain)
+    def get_chain():
+        key = f"{init_chain.__module__}.{init_chain.__qualname__}"
+        chain = _chains.get(key)
+        if chain is None:
+            with _lock:
+                chain = _chains.get(key)
+                if chain is None:
+                    chain = init_chain()
+                    _chains[key] = chain
+        return chain
+    return get_chain
+
+
+def set_llm_factory(factory):
+    """
+    Replaces the AzureChatOpenAI clients returned by get_llm, e.g. by a scripted chat model in offline runs.
+    The shared clients and prebuilt chains are dropped, so every chain is rebuilt with the new chat models.
+
+    Args:
+        factory: A callable (deployment, **kwargs) returning a chat model, None restores AzureChatOpenAI.
+    """
+    global _llm_factory
+    reset_llm_clients()
+    with _lock:
+        _llm_factory = factory
+
+
+def reset_llm_clients():
+    """Drops every shared client and prebuilt chain, e.g. after the LLM configuration changed."""
+    with _lock:
+        _chains.clear()
+        _llms.clear()
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
+        # Async clients can only be closed from their event loop, their connections are released when collected
+        _async_http_clients.clear()
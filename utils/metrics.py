@@ -0,0 +1,330 @@
+import math
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .run_stats import percentile
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+HITS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+CHARS_BUCKETS = (0, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+# Type, help text and histogram buckets of every metric, by name
+METRICS = {
+    "rag_run_latency_seconds": ("histogram", "Latency of whole agent runs.", LATENCY_BUCKETS),
+    "rag_node_runs_total": ("counter", "Executions of graph nodes, sub-workflow nodes are prefixed by the node running them.", None),
+    "rag_node_latency_seconds": ("histogram", "Latency of graph nodes.", LATENCY_BUCKETS),
+    "rag_node_loop_iterations_total": ("counter", "Executions of a node beyond its first one within the same graph run (grounding retries and replanning loops).", None),
+    "rag_chain_latency_seconds": ("histogram", "Latency of LLM chains, response cache hits included.", LATENCY_BUCKETS),
+    "rag_llm_calls_total": ("counter", "LLM calls.", None),
+    "rag_llm_errors_total": ("counter", "LLM calls that raised an error.", None),
+    "rag_llm_latency_seconds": ("histogram", "Latency of LLM calls.", LATENCY_BUCKETS),
+    "rag_llm_prompt_tokens_total": ("counter", "Prompt tokens sent to the LLM.", None),
+    "rag_llm_completion_tokens_total": ("counter", "Completion tokens returned by the LLM.", None),
+    "rag_retrievals_total": ("counter", "Retriever searches.", None),
+    "rag_retrieval_latency_seconds": ("histogram", "Latency of retriever searches.", LATENCY_BUCKETS),
+    "rag_retrieval_hits": ("histogram", "Documents returned per retriever search.", HITS_BUCKETS),
+    "rag_retrieval_chars": ("histogram", "Characters of the documents returned per retriever search.", CHARS_BUCKETS),
+    "rag_retrieval_duplicates_skipped_total": ("counter", "Retrieved documents skipped because they were already distilled in the run.", None),
+    "rag_distillations_skipped_total": ("counter", "Retrievals that found nothing new, so their distillation was skipped.", None),
+}
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class MetricsRegistry:
+    """Process wide counters and histograms, labeled by node and chain, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._histograms = {}
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {**value, "buckets": list(value["buckets"])} for key, value in self._histograms.items()}
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRICS.items():
+            if metric_type == "counter":
+                samples = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+            else:
+                samples = sorted((labels, value) for (metric, labels), value in histograms.items() if metric == name)
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if metric_type == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                for bound, count in zip(list(buckets) + [math.inf], value["buckets"] + [value["count"]]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def serve_metrics(port, host="0.0.0.0", registry=metrics_registry):
+    """
+    Serves the metrics of a registry on http://host:port/metrics from a daemon thread.
+
+    Returns:
+        The HTTP server, shutdown() stops it.
+    """
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def chain_run_kind(name, parent_run_id, tags, metadata):
+    """
+    Classifies a chain run from its callback arguments: 'root' for the outermost run, 'node' for the run of a
+    graph node, 'chain' for an LLM chain (see utils.llm_cache.with_response_cache) and 'other' for the rest.
+    """
+    metadata = metadata or {}
+    if parent_run_id is None:
+        return "root"
+    if name != "__start__" and name == metadata.get("langgraph_node") and any(tag.startswith("graph:step:") for tag in tags or []):
+        return "node"
+    if name is not None and name == metadata.get("llm_chain"):
+        return "chain"
+    return "other"
+
+
+def _summarize_samples(values):
+    return {
+        "count": len(values),
+        "total": round(sum(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "max": round(max(values), 4),
+    }
+
+
+def _short_name(name):
+    return name.removeprefix("rag_").removesuffix("_total")
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Measures one agent run: latency of every graph node (sub-workflow nodes included), LLM chain and LLM call,
+    LLM tokens, node loop iterations and retrieval hit sizes. The measures are labeled by node and chain name,
+    kept for the run's JSON summary and added to the process wide registry the Prometheus endpoint renders.
+
+    Nodes of the sub-workflows are labeled with the path of the node running them, e.g.
+    'retrieve_chunks/keep_only_relevant_content', and so are the LLM calls and retrievals made in them.
+    """
+
+    def __init__(self, registry=metrics_registry):
+        self.registry = registry
+        self.wall_time = None
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._node_runs = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._samples = defaultdict(list)
+
+    def _count(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+        self.registry.inc(name, labels, value)
+
+    def _observe(self, name, labels, value):
+        with self._lock:
+            self._samples[(name, labels)].append(value)
+        self.registry.observe(name, labels, value)
+
+    def _start_run(self, run_id, parent_run_id, kind, **fields):
+        with self._lock:
+            parent = self._runs.get(parent_run_id) if parent_run_id else None
+            run = {"kind": kind, "node": parent["node"] if parent else None, "parent": parent, "start": monotonic(), **fields}
+            if kind == "node":
+                run["node"] = f"{run['node']}/{fields['name']}" if run["node"] else fields["name"]
+                self._node_runs[(parent_run_id, fields["name"])] += 1
+                run["iteration"] = self._node_runs[(parent_run_id, fields["name"])]
+            self._runs[run_id] = run
+        return run
+
+    def _end_run(self, run_id):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is not None:
+            run["latency"] = monotonic() - run["start"]
+        return run
+
+    def _node_label(self, run):
+        return (("node", run["node"] or "unknown"),)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        kind = chain_run_kind(name, parent_run_id, tags, metadata)
+        run = self._start_run(run_id, parent_run_id, kind, name=name)
+        if kind == "node" and run["iteration"] > 1:
+            self._count("rag_node_loop_iterations_total", self._node_label(run))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        run = self._end_run(run_id)
+        if run is None:
+            return
+        if run["kind"] == "root":
+            self.wall_time = run["latency"]
+            self._observe("rag_run_latency_seconds", (), run["latency"])
+        elif run["kind"] == "node":
+            self._count("rag_node_runs_total", self._node_label(run))
+            self._observe("rag_node_latency_seconds", self._node_label(run), run["latency"])
+        elif run["kind"] == "chain":
+            self._observe("rag_chain_latency_seconds", self._node_label(run) + (("chain", run["name"]),), run["latency"])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self.on_chain_end(None, run_id=run_id, **kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, parent_run_id=parent_run_id, metadata=metadata, **kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        run = self._start_run(run_id, parent_run_id, "llm", name=(metadata or {}).get("llm_chain", "unknown"))
+        self._count("rag_llm_calls_total", self._node_label(run) + (("chain", run["name"]),))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._end_run(run_id)
+        if run is None:
+            return
+        labels = self._node_label(run) + (("chain", run["name"]),)
+        self._observe("rag_llm_latency_seconds", labels, run["latency"])
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        self._count("rag_llm_prompt_tokens_total", labels, token_usage.get("prompt_tokens", 0))
+        self._count("rag_llm_completion_tokens_total", labels, token_usage.get("completion_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._end_run(run_id)
+        if run is not None:
+            self._count("rag_llm_errors_total", self._node_label(run) + (("chain", run["name"]),))
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start_run(run_id, parent_run_id, "retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._end_run(run_id)
+        # Retrievers searching through other retrievers are measured once, at the outermost one
+        if run is None or (run["parent"] and run["parent"]["kind"] == "retriever"):
+            return
+        labels = self._node_label(run)
+        self._count("rag_retrievals_total", labels)
+        self._observe("rag_retrieval_latency_seconds", labels, run["latency"])
+        self._observe("rag_retrieval_hits", labels, len(documents))
+        self._observe("rag_retrieval_chars", labels, sum(len(document.page_content) for document in documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end_run(run_id)
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name != "retrieval_dedup":
+            return
+        with self._lock:
+            run = self._runs.get(run_id)
+        labels = self._node_label(run) if run else (("node", "unknown"),)
+        self._count("rag_retrieval_duplicates_skipped_total", labels, data["skipped_documents"])
+        self._count("rag_distillations_skipped_total", labels, int(data["skipped_distillation"]))
+
+    def _group(self, label):
+        groups = defaultdict(dict)
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {key: list(values) for key, values in self._samples.items()}
+        for (name, labels), value in counters.items():
+            key = dict(labels).get(label)
+            if key is not None:
+                groups[key][_short_name(name)] = groups[key].get(_short_name(name), 0) + value
+        merged_samples = defaultdict(list)
+        for (name, labels), values in samples.items():
+            key = dict(labels).get(label)
+            if key is not None:
+                merged_samples[(key, _short_name(name))] += values
+        for (key, name), values in merged_samples.items():
+            groups[key][name] = _summarize_samples(values)
+        return dict(groups)
+
+    def summary(self):
+        """
+        Returns the JSON serializable summary of the run: its wall time and totals, and the measures per node
+        and per chain. Latencies and retrieval sizes are summarized by their count, total, p50, p95 and max.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+
+        def total(name):
+            return sum(value for (metric, _), value in counters.items() if metric == name)
+
+        return {
+            "wall_time": round(self.wall_time, 4) if self.wall_time is not None else None,
+            "llm_calls": total("rag_llm_calls_total"),
+            "prompt_tokens": total("rag_llm_prompt_tokens_total"),
+            "completion_tokens": total("rag_llm_completion_tokens_total"),
+            "retrievals": total("rag_retrievals_total"),
+            "loop_iterations": total("rag_node_loop_iterations_total"),
+            "duplicate_documents_skipped": total("rag_retrieval_duplicates_skipped_total"),
+            "distillations_skipped": total("rag_distillations_skipped_total"),
+            "nodes": self._group("node"),
+            "chains": self._group("chain"),
+        }
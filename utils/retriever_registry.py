@@ -0,0 +1,102 @@
+import threading
+
+from ..config import EnvConfig
+from ..utils.corpus import corpus_signature
+
+
+class RetrieverRegistry:
+    """
+    Process wide registry of retrievers.
+    Every retriever is built (or loaded from the index store) at most once per process and the same
+    instance is handed to every workflow invocation. Retrievers are rebuilt when EnvConfig.PDF_PATH or EnvConfig.CORPUS_DIR
+    changes, or when a PDF of the corpus is added, removed or modified.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._retrievers = {}
+        self._source = None
+        self._lock = threading.RLock()
+        self._build_locks = {}
+
+    def register(self, name, factory):
+        """
+        Registers the factory used to build a retriever.
+
+        Args:
+            name: The name of the retriever (e.g. 'chunks', 'summaries', 'quotes').
+            factory: A callable with no arguments that builds the retriever.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._build_locks.setdefault(name, threading.Lock())
+            self._drop([name])
+
+    def get(self, name):
+        """
+        Returns the retriever registered under the given name, building it on first use.
+
+        Args:
+            name: The name of the retriever.
+        """
+        with self._lock:
+            self._check_source()
+            if name not in self._factories:
+                raise KeyError(f"No retriever registered under '{name}'")
+            retriever = self._retrievers.get(name)
+            if retriever is not None:
+                return retriever
+            build_lock = self._build_locks[name]
+
+        # Build outside the registry lock so different retrievers can be built concurrently
+        with build_lock:
+            with self._lock:
+                retriever = self._retrievers.get(name)
+                if retriever is not None:
+                    return retriever
+                factory = self._factories[name]
+                source = self._source
+            retriever = factory()
+            with self._lock:
+                if self._source == source:
+                    self._retrievers[name] = retriever
+        return retriever
+
+    def warm_up(self, names=None):
+        """
+        Builds the given retrievers (all registered ones by default) ahead of the first question.
+
+        Args:
+            names: The names of the retrievers to build.
+        """
+        with self._lock:
+            names = list(self._factories) if names is None else names
+        for name in names:
+            print(f"Warming up the {name} retriever...")
+            self.get(name)
+
+    def invalidate(self, names=None):
+        """
+        Drops the given retrievers (all of them by default) so they are rebuilt on next use.
+
+        Args:
+            names: The names of the retrievers to drop.
+        """
+        with self._lock:
+            self._drop(list(self._retrievers) if names is None else names)
+
+    def _drop(self, names):
+        """Drops retrievers and closes the ones holding resources (the thread pools of sharded indexes)."""
+        for name in names:
+            retriever = self._retrievers.pop(name, None)
+            if hasattr(retriever, "close"):
+                retriever.close()
+
+    def _check_source(self):
+        source = (EnvConfig.PDF_PATH, EnvConfig.CORPUS_DIR, corpus_signature())
+        if self._source != source:
+            self._drop(list(self._retrievers))
+            self._source = source
+
+
+retriever_registry = RetrieverRegistry()
@@ -0,0 +1,61 @@
+import math
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class RunStatsCallbackHandler(BaseCallbackHandler):
+    """
+    Counts the LLM calls, their tokens and the retrievals made while answering one question, and what the
+    session retrieval dedup saved: the already distilled documents skipped and the distillations skipped
+    because a retrieval found nothing new.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.retrievals = 0
+        self.duplicate_documents_skipped = 0
+        self.distillations_skipped = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        with self._lock:
+            self.llm_calls += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        with self._lock:
+            self.llm_calls += 1
+
+    def on_llm_end(self, response, **kwargs):
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        with self._lock:
+            self.prompt_tokens += token_usage.get("prompt_tokens", 0)
+            self.completion_tokens += token_usage.get("completion_tokens", 0)
+
+    def on_retriever_start(self, serialized, query, **kwargs):
+        with self._lock:
+            self.retrievals += 1
+
+    def on_custom_event(self, name, data, **kwargs):
+        if name != "retrieval_dedup":
+            return
+        with self._lock:
+            self.duplicate_documents_skipped += data["skipped_documents"]
+            self.distillations_skipped += int(data["skipped_distillation"])
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest rank percentile of a list of values.
+
+    Args:
+        values: The values, in any order.
+        percent: The percentile to compute, between 0 and 100.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
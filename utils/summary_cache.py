@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import time
+
+from ..config import EnvConfig
+from .index_store import text_hash
+
+
+def summary_cache_key(chapter_text, prompt_template, deployment):
+    """
+    Builds the content address of a chapter summary.
+
+    Args:
+        chapter_text: The text of the chapter.
+        prompt_template: The summarization prompt template.
+        deployment: The name of the LLM deployment used to summarize.
+
+    Returns:
+        The hex digest identifying the summary.
+    """
+    return text_hash("\n".join([text_hash(chapter_text), text_hash(prompt_template), str(deployment)]))
+
+
+def _entry_path(key):
+    return os.path.join(EnvConfig.SUMMARY_CACHE_DIR, key[:2], f"{key}.json")
+
+
+def get_cached_summary(key):
+    """
+    Returns the cached summary entry for a key, or None if the chapter was not summarized yet.
+    The entry is a dict with the 'summary', 'chain_type', 'run_time' and 'created_at' fields.
+    """
+    path = _entry_path(key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # A corrupt entry is treated as missing and gets overwritten by the next summarization
+        return None
+
+
+def put_cached_summary(key, summary, chain_type, run_time, metadata=None):
+    """
+    Saves a chapter summary in the cache. Each entry is written as soon as its chapter is done,
+    so an interrupted summarization run resumes from the chapters already summarized.
+
+    Args:
+        key: The key returned by summary_cache_key.
+        summary: The summary text.
+        chain_type: The summarize chain type used ('stuff' or 'map_reduce').
+        run_time: The summarization time in seconds.
+        metadata: The metadata of the summarized chapter.
+    """
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {
+        "summary": summary,
+        "chain_type": chain_type,
+        "run_time": run_time,
+        "created_at": time.time(),
+        "metadata": metadata or {},
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w', encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
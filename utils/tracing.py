@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .metrics import chain_run_kind
+
+# The tracer of the run being traced, if any. Worker threads and asyncio tasks started by the run inherit it.
+_current_tracer = ContextVar("langgraph_rag_tracer", default=None)
+
+
+class Tracer:
+    """
+    Records the spans of a run as Chrome trace events, to be opened in chrome://tracing or https://ui.perfetto.dev.
+    Every thread, and every asyncio task, gets its own track so nested spans stack up under their parents.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.events = []
+        self._origin = perf_counter_ns()
+        self._tracks = {}
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Microseconds since the tracer was created, the time unit of Chrome traces."""
+        return (perf_counter_ns() - self._origin) / 1000
+
+    def track(self):
+        """Returns the track id of the current asyncio task, or of the current thread outside of a task."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = task if task is not None else threading.get_ident()
+        with self._lock:
+            tid = self._tracks.get(key)
+            if tid is None:
+                tid = self._tracks[key] = len(self._tracks) + 1
+                name = f"task {task.get_name()}" if task is not None else threading.current_thread().name
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}})
+        return tid
+
+    def add_span(self, name, category, start, tid, args=None):
+        """Adds a span that started at start (see now) on track tid and ends now."""
+        event = {
+            "name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": tid,
+            "ts": round(start, 3), "dur": round(self.now() - start, 3), "args": args or {},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """Records the block as a span. The yielded args dict can be completed inside the block."""
+        start = self.now()
+        tid = self.track()
+        try:
+            yield args
+        finally:
+            self.add_span(name, category, start, tid, args)
+
+    def save(self, path):
+        """Writes the trace in the Chrome trace event format."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event.get("ts", -1))
+        with open(path, 'w', encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def trace_span(name, category, **args):
+    """Records the block as a span of the current tracer, it costs nothing when the run is not traced."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield args
+        return
+    with tracer.span(name, category, **args) as span_args:
+        yield span_args
+
+
+@contextmanager
+def tracing(path):
+    """
+    Traces what runs inside the block and writes the trace to path at its end.
+    Nothing is traced when path is None, so callers can make tracing opt-in.
+
+    Yields:
+        The tracer, or None when path is None.
+    """
+    if path is None:
+        yield None
+        return
+    tracer = Tracer()
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+        tracer.save(path)
+        print(f"Trace written to {path}")
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Adds a span to a tracer for the run, every graph node, LLM chain, LLM call and retriever search."""
+
+    # Called in the thread or task of the run, not in an executor, so spans land on the right track
+    run_inline = True
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, name, category, **args):
+        with self._lock:
+            self._starts[run_id] = (name, category, self.tracer.now(), self.tracer.track(), args)
+
+    def _end(self, run_id, **args):
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+        if start is not None:
+            name, category, ts, tid, start_args = start
+            self.tracer.add_span(name, category, ts, tid, {**start_args, **args})
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        kind = chain_run_kind(name, parent_run_id, tags, metadata)
+        if kind == "root":
+            self._start(run_id, name or "run", "graph")
+        elif kind == "node":
+            self._start(run_id, name, "node", step=(metadata or {}).get("langgraph_step"))
+        elif kind == "chain":
+            self._start(run_id, name, "chain")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=f"{type(error).__name__}: {error}")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", "llm", chain=(metadata or {}).get("llm_chain"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, "llm", "llm", chain=(metadata or {}).get("llm_chain"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, **((response.llm_output or {}).get("token_usage") or {}))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=f"{type(error).__name__}: {error}")
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieve", "retriever", query=query)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, hits=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=f"{type(error).__name__}: {error}")
@@ -1,19 +1,26 @@
-from langchain.document_loaders import PyPDFLoader
-from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_openai import AzureChatOpenAI
 from langchain.chains.summarize import load_summarize_chain
 from langchain.prompts import PromptTemplate
 from langchain.docstore.document import Document
-from ..utils.helper_functions import replace_t_with_space, num_tokens_from_string, replace_double_lines_with_one_line, split_into_chapters, extract_book_quotes_as_documents
+from openai import RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.helper_functions import num_tokens_from_string, replace_double_lines_with_one_line
+from ..utils.llm_clients import get_llm
+from ..utils.embeddings import MODEL_NAME, get_embedding_service
+from ..utils.lexical_index import BM25Index
+from ..utils.ann_index import INCREMENTAL_INDEX_TYPES, ann_index_settings, index_compaction, build_params
+from ..utils.ann_index import build_vector_index, load_vector_index, update_vector_index
+from ..utils.ingestion import ingest_pdf, chunk_documents, chapter_documents, quote_documents
+from ..utils.index_store import file_content_hash, text_hash, document_ids, load_or_build_index
+from ..utils.summary_cache import summary_cache_key, get_cached_summary, put_cached_summary
 
 from time import monotonic
 
 from ..config import EnvConfig
 
 
-MODEL_NAME = "avsolatorio/GIST-large-Embedding-v0"
+# Bump whenever the way documents are extracted or cleaned changes, so saved indexes get rebuilt
+PREPROCESSING_VERSION = 3
 
 summarization_prompt_template = """Write an extensive summary of the following:
 
@@ -23,48 +30,111 @@ SUMMARY:"""
 
 summarization_prompt = PromptTemplate(template=summarization_prompt_template, input_variables=["text"])
 
+@retry(
+    retry=retry_if_exception_type(RateLimitError),
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(EnvConfig.SUMMARY_MAX_RETRIES),
+    reraise=True,
+)
+def invoke_with_backoff(chain, inputs):
+    """Invokes a chain, retrying with exponential backoff when the LLM deployment is rate limited (HTTP 429)."""
+    return chain.invoke(inputs)
+
+def init_summarization_llm():
+    return get_llm(max_retries=0)  # Rate limits are retried by invoke_with_backoff
+
+def index_key(path, **params):
+    """
+    Builds the key a saved index is validated against.
+
+    Args:
+        path: The path to the PDF the index is built from.
+        params: Any additional parameters the index content depends on.
+    """
+    key = {
+        "pdf_hash": file_content_hash(path),
+        "model_name": MODEL_NAME,
+        "preprocessing_version": PREPROCESSING_VERSION,
+    }
+    key.update(params)
+    return key
+
+def encode_vector_index(store_name, path, key, create_sources, create_documents=None):
+    """
+    Encodes documents into the vector index configured for a store, reusing the saved index when nothing changed.
+    Every document is stored under the content hash of its source, so when the PDF changes only the new
+    sources are embedded (see update_vector_index), unless INCREMENTAL_INDEXING is off or the index type can't
+    remove vectors.
+
+    Args:
+        store_name: The name of the store (e.g. 'chunks', 'summaries', 'quotes').
+        path: The path to the PDF the documents come from.
+        key: The key of the index content, see index_key.
+        create_sources: A callable with no arguments returning the source Documents (chunks, chapters...).
+        create_documents: A callable turning a list of sources into the Documents to index, the sources themselves by default.
+    """
+    embeddings = get_embedding_service()
+    index_type, params = ann_index_settings(store_name)
+    compaction = index_compaction(store_name)
+    key = dict(key, index_type=index_type, index_params=build_params(params), compaction=compaction)
+    create_documents = create_documents or (lambda sources: sources)
+
+    def build():
+        sources = create_sources()
+        return build_vector_index(create_documents(sources), embeddings, index_type, params, compaction, ids=document_ids(sources))
+
+    def load(directory):
+        return load_vector_index(directory, embeddings, index_type, params)
+
+    def update(vectorstore):
+        sources = create_sources()
+        return update_vector_index(vectorstore, sources, document_ids(sources), create_documents)
+
+    incremental = EnvConfig.INCREMENTAL_INDEXING and index_type in INCREMENTAL_INDEX_TYPES
+    return load_or_build_index(store_name, path, key, build, embeddings, load=load, update=update if incremental else None)
+
 def encode_book(path, chunk_size=1000, chunk_overlap=200):
-    """Encodes a PDF book into a vector store."""
-    loader = PyPDFLoader(path)
-    documents = loader.load()
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, 
-        chunk_overlap=chunk_overlap, 
-        length_function=len
-    )
-    texts = text_splitter.split_documents(documents)
-    cleaned_texts = replace_t_with_space(texts)
+    """Encodes a PDF book into a vector store, reusing the saved index when nothing changed."""
+    def create_sources():
+        return chunk_documents(ingest_pdf(path), chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    key = index_key(path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return encode_vector_index("chunks", path, key, create_sources)
 
-    embeddings = HuggingFaceEmbeddings(model_name=MODEL_NAME)
-    vectorstore = FAISS.from_documents(cleaned_texts, embeddings)
+def encode_book_lexical(path, chunk_size=1000, chunk_overlap=200):
+    """Builds the BM25 index of the book chunks, reusing the saved index when nothing changed."""
+    def build():
+        return BM25Index(chunk_documents(ingest_pdf(path), chunk_size=chunk_size, chunk_overlap=chunk_overlap))
 
-    return vectorstore
+    key = index_key(path, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return load_or_build_index("chunks_bm25", path, key, build, load=BM25Index.load, save=BM25Index.save)
 
 def create_chapters(chapter_path):
-    chapters = split_into_chapters(chapter_path) 
-    chapters = replace_t_with_space(chapters)
-    return chapters
+    return chapter_documents(ingest_pdf(chapter_path))
 
-def create_chapter_summary(chapter):
+def create_chapter_summary(chapter, llm=None):
     """
     Creates a summary of a chapter using a large language model (LLM).
+    Summaries are cached by chapter text, prompt template and deployment, so a chapter is never summarized twice.
 
     Args:
         chapter: A Document object representing the chapter to summarize.
+        llm: The LLM client to use, a new one is created if not given.
 
     Returns:
         A Document object containing the summary of the chapter.
     """
 
     chapter_txt = chapter.page_content  # Extract chapter text
+    cache_key = summary_cache_key(chapter_txt, summarization_prompt_template, EnvConfig.AZ_OAI_DEPLOYMENT)
+    cached = get_cached_summary(cache_key)
+    if cached is not None:
+        print(f"Using cached summary for chapter {chapter.metadata.get('chapter')}")
+        return Document(page_content=cached["summary"], metadata=chapter.metadata)
+
     model_name = "gpt-4o"  # Specify LLM model
-    llm = AzureChatOpenAI(
-        azure_deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
-        api_version=EnvConfig.AZ_OAI_VERSION,
-        azure_endpoint=EnvConfig.AZ_OAI_BASE,
-        api_key=EnvConfig.AZ_OPENAI_API_KEY,
-    )  # Create LLM instance
+    if llm is None:
+        llm = init_summarization_llm()  # Create LLM instance
     gpt_4o_max_tokens = 128000  # Maximum token limit for the LLM
     verbose = False  # Set to True for more detailed output
 
@@ -73,40 +143,71 @@ def create_chapter_summary(chapter):
 
     # Choose appropriate chain type based on token count
     if num_tokens < gpt_4o_max_tokens:
-        chain = load_summarize_chain(llm, chain_type="stuff", prompt=summarization_prompt, verbose=verbose) 
+        chain_type = "stuff"
+        chain = load_summarize_chain(llm, chain_type=chain_type, prompt=summarization_prompt, verbose=verbose) 
     else:
-        chain = load_summarize_chain(llm, chain_type="map_reduce", map_prompt=summarization_prompt, combine_prompt=summarization_prompt, verbose=verbose)
+        chain_type = "map_reduce"
+        chain = load_summarize_chain(llm, chain_type=chain_type, map_prompt=summarization_prompt, combine_prompt=summarization_prompt, verbose=verbose)
 
     start_time = monotonic()  # Start timer
     doc_chapter = Document(page_content=chapter_txt)  # Create Document object for chapter
-    summary = chain.invoke([doc_chapter])  # Generate summary using the chain
-    print(f"Chain type: {chain.__class__.__name__}")  # Print chain type
-    print(f"Run time: {monotonic() - start_time}")  # Print execution time
+    summary = invoke_with_backoff(chain, [doc_chapter])  # Generate summary using the chain
+    run_time = monotonic() - start_time
+    print(f"Summarized chapter {chapter.metadata.get('chapter')} with {chain.__class__.__name__} in {run_time:.2f}s")
 
     # Clean up summary text
     summary = replace_double_lines_with_one_line(summary["output_text"])
+    put_cached_summary(cache_key, summary, chain_type, run_time, metadata=chapter.metadata)
 
     # Create Document object for summary
     doc_summary = Document(page_content=summary, metadata=chapter.metadata)
 
     return doc_summary
 
+def summarize_chapters(chapters, max_workers=None):
+    """
+    Summarizes chapters concurrently with a bounded thread pool sharing one LLM client.
+
+    Args:
+        chapters: A list of chapter Documents.
+        max_workers: The maximum number of chapters summarized at the same time,
+            EnvConfig.SUMMARY_MAX_WORKERS by default.
+
+    Returns:
+        The list of summary Documents, in chapter order.
+    """
+    max_workers = max_workers or EnvConfig.SUMMARY_MAX_WORKERS
+    llm = init_summarization_llm()
+    start_time = monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chapter_summaries = list(executor.map(lambda chapter: create_chapter_summary(chapter, llm), chapters))
+    print(f"Summarized {len(chapters)} chapters with {max_workers} workers in {monotonic() - start_time:.2f}s")
+    return chapter_summaries
+
 def encode_chapter_summaries(chapter_path):
-    """Encodes chapter summaries into a vector store."""
-    chapters = create_chapters(chapter_path)
-    chapter_summaries = [create_chapter_summary(chapter) for chapter in chapters]
-    embeddings = HuggingFaceEmbeddings(model_name=MODEL_NAME)
-    return FAISS.from_documents(chapter_summaries, embeddings)
+    """
+    Encodes chapter summaries into a vector store, reusing the saved index when nothing changed.
+    Summaries are indexed under the content hash of their chapter, so after an edit only the changed chapters are summarized again.
+    """
+    key = index_key(
+        chapter_path,
+        summarization_prompt_hash=text_hash(summarization_prompt_template),
+        deployment=EnvConfig.AZ_OAI_DEPLOYMENT,
+    )
+    return encode_vector_index("summaries", chapter_path, key, lambda: create_chapters(chapter_path), summarize_chapters)
 
 def create_book_quotes(book_path):
-    loader = PyPDFLoader(book_path)
-    document = loader.load()
-    document_cleaned = replace_t_with_space(document)
-    book_quotes = extract_book_quotes_as_documents(document_cleaned)
-    return book_quotes
+    return quote_documents(ingest_pdf(book_path))
 
 def encode_quotes(book_path):
-    """Encodes book quotes into a vector store."""
-    book_quotes = create_book_quotes(book_path)
-    embeddings = HuggingFaceEmbeddings(model_name=MODEL_NAME)
-    return FAISS.from_documents(book_quotes, embeddings)
+    """Encodes book quotes into a vector store, reusing the saved index when nothing changed."""
+    key = index_key(book_path)
+    return encode_vector_index("quotes", book_path, key, lambda: create_book_quotes(book_path))
+
+def encode_quotes_lexical(book_path):
+    """Builds the BM25 index of the book quotes, reusing the saved index when nothing changed."""
+    def build():
+        return BM25Index(create_book_quotes(book_path))
+
+    key = index_key(book_path)
+    return load_or_build_index("quotes_bm25", book_path, key, build, load=BM25Index.load, save=BM25Index.save)
@@ -2,88 +2,227 @@ from typing import TypedDict, List
 from langgraph.graph import StateGraph, END
 
 from ..models.state_models import PlanExecute
-from ..chains.anonymize_chain import anonymize_queries
-from ..chains.plan_chain import plan_step, break_down_plan_step, replan_step, can_be_answered
-from ..chains.deanonymize_chain import deanonymize_queries
-from ..workflows.chunks_workflow import run_qualitative_chunks_retrieval_workflow
-from ..workflows.summaries_workflow import run_qualitative_summaries_retrieval_workflow
-from ..workflows.quotes_workflow import run_qualitative_book_quotes_retrieval_workflow
-from ..workflows.answer_workflow import run_qualtative_answer_workflow, run_qualtative_answer_workflow_for_final_answer
-from ..chains.task_handler import run_task_handler_chain, retrieve_or_answer
+from ..chains.anonymize_chain import anonymize_queries, aanonymize_queries
+from ..chains.plan_chain import plan_step, break_down_plan_step, replan_step, can_be_answered, aplan_step, abreak_down_plan_step, areplan_step, acan_be_answered
+from ..chains.deanonymize_chain import deanonymize_queries, adeanonymize_queries
+from ..workflows.chunks_workflow import run_qualitative_chunks_retrieval_workflow, arun_qualitative_chunks_retrieval_workflow
+from ..workflows.summaries_workflow import run_qualitative_summaries_retrieval_workflow, arun_qualitative_summaries_retrieval_workflow
+from ..workflows.quotes_workflow import run_qualitative_book_quotes_retrieval_workflow, arun_qualitative_book_quotes_retrieval_workflow
+from ..workflows.answer_workflow import run_qualtative_answer_workflow, run_qualtative_answer_workflow_for_final_answer, arun_qualtative_answer_workflow, arun_qualtative_answer_workflow_for_final_answer
+from ..chains.task_handler import run_task_handler_chain, arun_task_handler_chain, retrieve_or_answer
+from ..chains.controller_chain import controller_step, acontroller_step, parallel_controller_step, aparallel_controller_step, controller_decision, controller_can_be_answered
+from ..workflows.parallel_steps_workflow import run_parallel_steps, arun_parallel_steps
+from ..config import EnvConfig
+
+
+# Node functions of the synchronous graph, by node name
+agent_nodes = {
+    "anonymize_question": anonymize_queries,
+    "planner": plan_step,
+    "break_down_plan": break_down_plan_step,
+    "de_anonymize_plan": deanonymize_queries,
+    "retrieve_chunks": run_qualitative_chunks_retrieval_workflow,
+    "retrieve_summaries": run_qualitative_summaries_retrieval_workflow,
+    "retrieve_book_quotes": run_qualitative_book_quotes_retrieval_workflow,
+    "answer": run_qualtative_answer_workflow,
+    "task_handler": run_task_handler_chain,
+    "replan": replan_step,
+    "controller": controller_step,
+    "parallel_controller": parallel_controller_step,
+    "get_final_answer": run_qualtative_answer_workflow_for_final_answer,
+    "parallel_steps": run_parallel_steps,
+}
+
+# Node functions of the asyncio graph, by node name
+async_agent_nodes = {
+    "anonymize_question": aanonymize_queries,
+    "planner": aplan_step,
+    "break_down_plan": abreak_down_plan_step,
+    "de_anonymize_plan": adeanonymize_queries,
+    "retrieve_chunks": arun_qualitative_chunks_retrieval_workflow,
+    "retrieve_summaries": arun_qualitative_summaries_retrieval_workflow,
+    "retrieve_book_quotes": arun_qualitative_book_quotes_retrieval_workflow,
+    "answer": arun_qualtative_answer_workflow,
+    "task_handler": arun_task_handler_chain,
+    "replan": areplan_step,
+    "controller": acontroller_step,
+    "parallel_controller": aparallel_controller_step,
+    "get_final_answer": arun_qualtative_answer_workflow_for_final_answer,
+    "parallel_steps": arun_parallel_steps,
+}
+
+
+def build_agent_workflow(nodes, can_be_answered_edge, execution_mode=None, controller_mode=None):
+    """
+    Builds the plan and execute agent workflow.
+
+    Args:
+        nodes: The node functions by node name (agent_nodes or async_agent_nodes).
+        can_be_answered_edge: The conditional edge function deciding if the question can be answered already.
+        execution_mode: 'serial' runs one plan step per loop, 'parallel' runs the independent steps at the
+            head of the plan concurrently before replanning. EnvConfig.PLAN_EXECUTION_MODE by default.
+        controller_mode: 'multi_call' replans, checks if the question can be answered, breaks down the plan and
+            chooses the next tool with one LLM call each after every step, 'fused' decides all of it with a single
+            controller call. EnvConfig.CONTROLLER_MODE by default.
+
+    Returns:
+        The (not compiled) workflow.
+    """
+    execution_mode = execution_mode or EnvConfig.PLAN_EXECUTION_MODE
+    controller_mode = controller_mode or EnvConfig.CONTROLLER_MODE
+    if controller_mode not in ("multi_call", "fused"):
+        raise ValueError(f"Invalid controller mode '{controller_mode}'. Must be either 'multi_call' or 'fused'")
+    if execution_mode == "parallel":
+        return build_parallel_agent_workflow(nodes, can_be_answered_edge, controller_mode)
+    if execution_mode != "serial":
+        raise ValueError(f"Invalid plan execution mode '{execution_mode}'. Must be either 'serial' or 'parallel'")
+    if controller_mode == "fused":
+        return build_fused_agent_workflow(nodes)
+
+    agent_workflow = StateGraph(PlanExecute)
+
+    # Add the anonymize node
+    agent_workflow.add_node("anonymize_question", nodes["anonymize_question"])
+
+    # Add the plan node
+    agent_workflow.add_node("planner", nodes["planner"])
+
+    # Add the break down plan node
+
+    agent_workflow.add_node("break_down_plan", nodes["break_down_plan"])
+
+    # Add the deanonymize node
+    agent_workflow.add_node("de_anonymize_plan", nodes["de_anonymize_plan"])
+
+    # Add the qualitative chunks retrieval node
+    agent_workflow.add_node("retrieve_chunks", nodes["retrieve_chunks"])
+
+    # Add the qualitative summaries retrieval node
+    agent_workflow.add_node("retrieve_summaries", nodes["retrieve_summaries"])
+
+    # Add the qualitative book quotes retrieval node
+    agent_workflow.add_node("retrieve_book_quotes", nodes["retrieve_book_quotes"])
+
+
+    # Add the qualitative answer node
+    agent_workflow.add_node("answer", nodes["answer"])
+
+    # Add the task handler node
+    agent_workflow.add_node("task_handler", nodes["task_handler"])
+
+    # Add a replan node
+    agent_workflow.add_node("replan", nodes["replan"])
+
+    # Add answer from context node
+    agent_workflow.add_node("get_final_answer", nodes["get_final_answer"])
+
+    # Set the entry point
+    agent_workflow.set_entry_point("anonymize_question")
+
+    # From anonymize we go to plan
+    agent_workflow.add_edge("anonymize_question", "planner")
 
+    # From plan we go to deanonymize
+    agent_workflow.add_edge("planner", "de_anonymize_plan")
 
-agent_workflow = StateGraph(PlanExecute)
+    # From deanonymize we go to break down plan
 
-# Add the anonymize node
-agent_workflow.add_node("anonymize_question", anonymize_queries)
+    agent_workflow.add_edge("de_anonymize_plan", "break_down_plan")
 
-# Add the plan node
-agent_workflow.add_node("planner", plan_step)
+    # From break_down_plan we go to task handler
+    agent_workflow.add_edge("break_down_plan", "task_handler")
 
-# Add the break down plan node
+    # From task handler we go to either retrieve or answer
+    agent_workflow.add_conditional_edges("task_handler", retrieve_or_answer, {"chosen_tool_is_retrieve_chunks": "retrieve_chunks", "chosen_tool_is_retrieve_summaries":
+                                                                               "retrieve_summaries", "chosen_tool_is_retrieve_quotes": "retrieve_book_quotes", "chosen_tool_is_answer": "answer"})
 
-agent_workflow.add_node("break_down_plan", break_down_plan_step)
+    # After retrieving we go to replan
+    agent_workflow.add_edge("retrieve_chunks", "replan")
 
-# Add the deanonymize node
-agent_workflow.add_node("de_anonymize_plan", deanonymize_queries)
+    agent_workflow.add_edge("retrieve_summaries", "replan")
 
-# Add the qualitative chunks retrieval node
-agent_workflow.add_node("retrieve_chunks", run_qualitative_chunks_retrieval_workflow)
+    agent_workflow.add_edge("retrieve_book_quotes", "replan")
 
-# Add the qualitative summaries retrieval node
-agent_workflow.add_node("retrieve_summaries", run_qualitative_summaries_retrieval_workflow)
+    # After answering we go to replan
+    agent_workflow.add_edge("answer", "replan")
 
-# Add the qualitative book quotes retrieval node
-agent_workflow.add_node("retrieve_book_quotes", run_qualitative_book_quotes_retrieval_workflow)
+    # After replanning we check if the question can be answered, if yes we go to get_final_answer, if not we go to task_handler
+    agent_workflow.add_conditional_edges("replan",can_be_answered_edge, {"can_be_answered_already": "get_final_answer", "cannot_be_answered_yet": "break_down_plan"})
 
+    # After getting the final answer we end
+    agent_workflow.add_edge("get_final_answer", END)
 
-# Add the qualitative answer node
-agent_workflow.add_node("answer", run_qualtative_answer_workflow)
+    return agent_workflow
 
-# Add the task handler node
-agent_workflow.add_node("task_handler", run_task_handler_chain)
 
-# Add a replan node
-agent_workflow.add_node("replan", replan_step)
+def build_fused_agent_workflow(nodes):
+    """
+    Builds the agent workflow where a single controller call follows every step: it decides if the question
+    can be answered, updates the plan and chooses the tool and query of the next step.
+    """
+    agent_workflow = StateGraph(PlanExecute)
 
-# Add answer from context node
-agent_workflow.add_node("get_final_answer", run_qualtative_answer_workflow_for_final_answer)
+    for node_name in ["anonymize_question", "planner", "de_anonymize_plan", "break_down_plan", "task_handler", "retrieve_chunks",
+                      "retrieve_summaries", "retrieve_book_quotes", "answer", "controller", "get_final_answer"]:
+        agent_workflow.add_node(node_name, nodes[node_name])
 
-# Set the entry point
-agent_workflow.set_entry_point("anonymize_question")
+    agent_workflow.set_entry_point("anonymize_question")
+    agent_workflow.add_edge("anonymize_question", "planner")
+    agent_workflow.add_edge("planner", "de_anonymize_plan")
+    agent_workflow.add_edge("de_anonymize_plan", "break_down_plan")
 
-# From anonymize we go to plan
-agent_workflow.add_edge("anonymize_question", "planner")
+    # The task handler only chooses the tool of the first step, the controller chooses the next ones
+    agent_workflow.add_edge("break_down_plan", "task_handler")
+    tool_nodes = {"chosen_tool_is_retrieve_chunks": "retrieve_chunks", "chosen_tool_is_retrieve_summaries": "retrieve_summaries",
+                  "chosen_tool_is_retrieve_quotes": "retrieve_book_quotes", "chosen_tool_is_answer": "answer"}
+    agent_workflow.add_conditional_edges("task_handler", retrieve_or_answer, tool_nodes)
 
-# From plan we go to deanonymize
-agent_workflow.add_edge("planner", "de_anonymize_plan")
+    for node_name in ["retrieve_chunks", "retrieve_summaries", "retrieve_book_quotes", "answer"]:
+        agent_workflow.add_edge(node_name, "controller")
 
-# From deanonymize we go to break down plan
+    # After the controller we either get the final answer or execute the next step with the tool it chose
+    agent_workflow.add_conditional_edges("controller", controller_decision, {"can_be_answered_already": "get_final_answer", **tool_nodes})
+    agent_workflow.add_edge("get_final_answer", END)
 
-agent_workflow.add_edge("de_anonymize_plan", "break_down_plan")
+    return agent_workflow
 
-# From break_down_plan we go to task handler
-agent_workflow.add_edge("break_down_plan", "task_handler")
 
-# From task handler we go to either retrieve or answer
-agent_workflow.add_conditional_edges("task_handler", retrieve_or_answer, {"chosen_tool_is_retrieve_chunks": "retrieve_chunks", "chosen_tool_is_retrieve_summaries":
-                                                                           "retrieve_summaries", "chosen_tool_is_retrieve_quotes": "retrieve_book_quotes", "chosen_tool_is_answer": "answer"})
+def build_parallel_agent_workflow(nodes, can_be_answered_edge, controller_mode="multi_call"):
+    """
+    Builds the agent workflow where the independent steps at the head of the plan run concurrently
+    and their contexts are merged before a single replan. With the fused controller, the replan, can be
+    answered and break down plan calls after the steps are replaced by one controller call, and the task
+    handler is only asked for the steps batched after the one the controller chose the tool of.
+    """
+    agent_workflow = StateGraph(PlanExecute)
 
-# After retrieving we go to replan
-agent_workflow.add_edge("retrieve_chunks", "replan")
+    loop_nodes = ["replan"] if controller_mode == "multi_call" else ["parallel_controller"]
+    for node_name in ["anonymize_question", "planner", "de_anonymize_plan", "break_down_plan", "parallel_steps", *loop_nodes, "get_final_answer"]:
+        agent_workflow.add_node(node_name, nodes[node_name])
 
-agent_workflow.add_edge("retrieve_summaries", "replan")
+    agent_workflow.set_entry_point("anonymize_question")
+    agent_workflow.add_edge("anonymize_question", "planner")
+    agent_workflow.add_edge("planner", "de_anonymize_plan")
+    agent_workflow.add_edge("de_anonymize_plan", "break_down_plan")
 
-agent_workflow.add_edge("retrieve_book_quotes", "replan")
+    # From break_down_plan we run the next independent steps, then replan once
+    agent_workflow.add_edge("break_down_plan", "parallel_steps")
+    if controller_mode == "multi_call":
+        agent_workflow.add_edge("parallel_steps", "replan")
+        agent_workflow.add_conditional_edges("replan",can_be_answered_edge, {"can_be_answered_already": "get_final_answer", "cannot_be_answered_yet": "break_down_plan"})
+    else:
+        agent_workflow.add_edge("parallel_steps", "parallel_controller")
+        agent_workflow.add_conditional_edges("parallel_controller", controller_can_be_answered, {"can_be_answered_already": "get_final_answer", "cannot_be_answered_yet": "parallel_steps"})
+    agent_workflow.add_edge("get_final_answer", END)
 
-# After answering we go to replan
-agent_workflow.add_edge("answer", "replan")
+    return agent_workflow
 
-# After replanning we check if the question can be answered, if yes we go to get_final_answer, if not we go to task_handler
-agent_workflow.add_conditional_edges("replan",can_be_answered, {"can_be_answered_already": "get_final_answer", "cannot_be_answered_yet": "break_down_plan"})
 
-# After getting the final answer we end
-agent_workflow.add_edge("get_final_answer", END)
+agent_workflow = build_agent_workflow(agent_nodes, can_be_answered)
 
+plan_and_execute_app = agent_workflow.compile()
 
-plan_and_execute_app = agent_workflow.compile()
\ No newline at end of file
+# The same graph with async nodes, to be run with ainvoke/astream so many questions can share one event loop
+async_agent_workflow = build_agent_workflow(async_agent_nodes, acan_be_answered)
+
+async_plan_and_execute_app = async_agent_workflow.compile()
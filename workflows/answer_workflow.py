@@ -1,48 +1,81 @@
+import asyncio
 from langgraph.graph import END, StateGraph
-from typing import TypedDict
 from pprint import pprint
 
 from ..models.state_models import QualitativeAnswerGraphState
-from ..chains.answer_chain import answer_question_from_context, is_answer_grounded_on_context
+from ..utils.evidence import add_evidence, evidence_context
+from ..chains.answer_chain import answer_question_from_context, is_answer_grounded_on_context, aanswer_question_from_context, ais_answer_grounded_on_context
 
 
-qualitative_answer_workflow = StateGraph(QualitativeAnswerGraphState)
+# The answer when none is grounded on the context, or the agent runs into the recursion limit
+ANSWER_NOT_FOUND = "The answer wasn't found in the data."
 
-# Define the nodes
 
-qualitative_answer_workflow.add_node("answer_question_from_context",answer_question_from_context)
+def build_qualitative_answer_workflow(answer_question, is_answer_grounded):
+    """
+    Builds the qualitative answer workflow: answer the question from the context and answer it again
+    until the answer is grounded on the context. After EnvConfig.ANSWER_MAX_RETRIES ungrounded retries,
+    the answer is that it wasn't found.
+    """
+    qualitative_answer_workflow = StateGraph(QualitativeAnswerGraphState)
+
+    # Define the nodes
+
+    qualitative_answer_workflow.add_node("answer_question_from_context",answer_question)
+    qualitative_answer_workflow.add_node("answer_not_found", answer_not_found)
+
+    # Build the graph
+    qualitative_answer_workflow.set_entry_point("answer_question_from_context")
 
-# Build the graph
-qualitative_answer_workflow.set_entry_point("answer_question_from_context")
+    qualitative_answer_workflow.add_conditional_edges(
+    "answer_question_from_context",is_answer_grounded ,{"hallucination":"answer_question_from_context", "grounded on context":END,
+                                                        "answer retries exhausted":"answer_not_found"}
 
-qualitative_answer_workflow.add_conditional_edges(
-"answer_question_from_context",is_answer_grounded_on_context ,{"hallucination":"answer_question_from_context", "grounded on context":END}
+    )
+    qualitative_answer_workflow.add_edge("answer_not_found", END)
+    return qualitative_answer_workflow
 
-)
+def answer_not_found(state):
+    """Best effort fallback when no answer was grounded: rather no answer than a hallucinated one."""
+    print("No answer grounded on the context was found.")
+    return {"answer": ANSWER_NOT_FOUND}
+
+qualitative_answer_workflow = build_qualitative_answer_workflow(answer_question_from_context, is_answer_grounded_on_context)
 
 qualitative_answer_workflow_app = qualitative_answer_workflow.compile()
 
+async_qualitative_answer_workflow_app = build_qualitative_answer_workflow(aanswer_question_from_context, ais_answer_grounded_on_context).compile()
+
+def add_answer_to_context(state, output):
+    """Adds the answer of a step to the evidence, unless no grounded answer was found: that is no evidence."""
+    pprint("--------------------")
+    if output["answer"] == ANSWER_NOT_FOUND:
+        return state
+    return add_evidence(state, "answer", state.query_to_retrieve_or_answer, output["answer"])
+
 def run_qualtative_answer_workflow(state):
     """
     Run the qualitative answer workflow.
     Args:
         state: The current state of the plan execution.
     Returns:
-        The state with the updated aggregated context.
+        The state with the new evidence.
     """
     state.curr_state = "answer"
     print("Running the qualitative answer workflow...")
     question = state.query_to_retrieve_or_answer
     context = state.curr_context
     inputs = {"question": question, "context": context}
-    for output in qualitative_answer_workflow_app.stream(inputs):
-        for _, _ in output.items():
-            pass 
-        pprint("--------------------")
-    if not state.aggregated_context:
-        state.aggregated_context = ""
-    state.aggregated_context += output["answer"]
-    return state
+    output = qualitative_answer_workflow_app.invoke(inputs)
+    return add_answer_to_context(state, output)
+
+async def arun_qualtative_answer_workflow(state):
+    """Async version of run_qualtative_answer_workflow."""
+    state.curr_state = "answer"
+    print("Running the qualitative answer workflow...")
+    inputs = {"question": state.query_to_retrieve_or_answer, "context": state.curr_context}
+    output = await async_qualitative_answer_workflow_app.ainvoke(inputs)
+    return add_answer_to_context(state, output)
 
 def run_qualtative_answer_workflow_for_final_answer(state):
     """
@@ -55,11 +88,20 @@ def run_qualtative_answer_workflow_for_final_answer(state):
     state.curr_state = "get_final_answer"
     print("Running the qualitative answer workflow for final answer...")
     question = state.question
-    context = state.aggregated_context
+    context = evidence_context(state, question)
     inputs = {"question": question, "context": context}
-    for output in qualitative_answer_workflow_app.stream(inputs):
-        for _, value in output.items():
-            pass  
-        pprint("--------------------")
-    state.response = value
-    return state
\ No newline at end of file
+    output = qualitative_answer_workflow_app.invoke(inputs)
+    pprint("--------------------")
+    state.response = output["answer"]
+    return state
+
+async def arun_qualtative_answer_workflow_for_final_answer(state):
+    """Async version of run_qualtative_answer_workflow_for_final_answer."""
+    state.curr_state = "get_final_answer"
+    print("Running the qualitative answer workflow for final answer...")
+    context = await asyncio.to_thread(evidence_context, state, state.question)
+    inputs = {"question": state.question, "context": context}
+    output = await async_qualitative_answer_workflow_app.ainvoke(inputs)
+    pprint("--------------------")
+    state.response = output["answer"]
+    return state
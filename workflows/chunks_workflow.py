@@ -1,17 +1,41 @@
-from langgraph.graph import END, StateGraph
-from pprint import pprint
+import asyncio
 
-from ..models.state_models import QualitativeRetrievalGraphState
-from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content
+from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content, akeep_only_relevant_content, ais_distilled_content_grounded_on_content
 from ..utils.helper_functions import escape_quotes
-from ..utils.vectorstore import encode_book
+from ..utils.vectorstore import encode_book, encode_book_lexical
+from ..utils.hybrid_retriever import create_query_retriever
+from ..utils.corpus import corpus_paths
+from ..utils.retriever_registry import retriever_registry
 from ..config import EnvConfig
+from .retrieval_workflow import build_qualitative_retrieval_workflow, run_retrieval_workflow, arun_retrieval_workflow, retrieve_unseen_documents, retrieval_node_output, aretrieval_node_output
 
 def create_chunks_query_retriever():
-    book_chunks = encode_book(EnvConfig.PDF_PATH, chunk_size=1000, chunk_overlap=200)
-    chunks_query_retriever = book_chunks.as_retriever(search_kwargs={"k": 1})
+    chunks_query_retriever = create_query_retriever(
+        lambda path: encode_book(path, chunk_size=1000, chunk_overlap=200),
+        lambda path: encode_book_lexical(path, chunk_size=1000, chunk_overlap=200),
+        k=1,
+        mode=EnvConfig.RETRIEVAL_MODE,
+        paths=corpus_paths(),
+    )
     return chunks_query_retriever
 
+retriever_registry.register("chunks", create_chunks_query_retriever)
+
+def retrieve_chunks_context(question, seen_ids=None):
+    """
+    Retrieves the book chunks relevant to a question, skipping the ones in seen_ids, and concatenates them.
+
+    Returns:
+        The context, the retrieved documents and the number of documents skipped because they were already distilled.
+    """
+    chunks_query_retriever = retriever_registry.get("chunks")
+    docs, skipped = retrieve_unseen_documents(chunks_query_retriever, question, seen_ids)
+
+    # Concatenate document content
+    context = " ".join(doc.page_content for doc in docs)
+    context = escape_quotes(context)
+    return context, docs, skipped
+
 def retrieve_chunks_context_per_question(state):
     """
     Retrieves relevant context for a given question. The context is retrieved from the book chunks and chapter summaries.
@@ -22,31 +46,31 @@ def retrieve_chunks_context_per_question(state):
     # Retrieve relevant documents
     print("Retrieving relevant chunks...")
     question = state["question"]
-    chunks_query_retriever = create_chunks_query_retriever()
-    docs = chunks_query_retriever.get_relevant_documents(question)
-
-    # Concatenate document content
-    context = " ".join(doc.page_content for doc in docs)
-    context = escape_quotes(context)
-    return {"context": context, "question": question}
+    context, docs, skipped = retrieve_chunks_context(question, state.get("seen_ids"))
+    return retrieval_node_output(question, context, docs, skipped)
 
-qualitative_chunks_retrieval_workflow = StateGraph(QualitativeRetrievalGraphState)
-
-# Define the nodes
-qualitative_chunks_retrieval_workflow.add_node("retrieve_chunks_context_per_question",retrieve_chunks_context_per_question)
-qualitative_chunks_retrieval_workflow.add_node("keep_only_relevant_content",keep_only_relevant_content)
+async def aretrieve_chunks_context_per_question(state):
+    """Async version of retrieve_chunks_context_per_question, the search runs in a worker thread."""
+    print("Retrieving relevant chunks...")
+    question = state["question"]
+    context, docs, skipped = await asyncio.to_thread(retrieve_chunks_context, question, state.get("seen_ids"))
+    return await aretrieval_node_output(question, context, docs, skipped)
 
-# Build the graph
-qualitative_chunks_retrieval_workflow.set_entry_point("retrieve_chunks_context_per_question")
+qualitative_chunks_retrieval_workflow = build_qualitative_retrieval_workflow(
+    "retrieve_chunks_context_per_question",
+    retrieve_chunks_context_per_question,
+    keep_only_relevant_content,
+    is_distilled_content_grounded_on_content,
+)
 
-qualitative_chunks_retrieval_workflow.add_edge("retrieve_chunks_context_per_question", "keep_only_relevant_content")
+qualitative_chunks_retrieval_workflow_app = qualitative_chunks_retrieval_workflow.compile()
 
-qualitative_chunks_retrieval_workflow.add_conditional_edges(
-    "keep_only_relevant_content",
-    is_distilled_content_grounded_on_content,
-    {"grounded on the original context":END,
-      "not grounded on the original context":"keep_only_relevant_content"},
-    )
+async_qualitative_chunks_retrieval_workflow_app = build_qualitative_retrieval_workflow(
+    "retrieve_chunks_context_per_question",
+    aretrieve_chunks_context_per_question,
+    akeep_only_relevant_content,
+    ais_distilled_content_grounded_on_content,
+).compile()
 
 def run_qualitative_chunks_retrieval_workflow(state):
     """
@@ -54,18 +78,14 @@ def run_qualitative_chunks_retrieval_workflow(state):
     Args:
         state: The current state of the plan execution.
     Returns:
-        The state with the updated aggregated context.
+        The state with the new evidence.
     """
     state.curr_state = "retrieve_chunks"
     print("Running the qualitative chunks retrieval workflow...")
-    question = state.query_to_retrieve_or_answer
-    inputs = {"question": question}
-    qualitative_chunks_retrieval_workflow_app = qualitative_chunks_retrieval_workflow.compile()
-    for output in qualitative_chunks_retrieval_workflow_app.stream(inputs):
-        for _, _ in output.items():
-            pass 
-        pprint("--------------------")
-    if not state.aggregated_context:
-        state.aggregated_context = ""
-    state.aggregated_context += output['relevant_context']
-    return state
\ No newline at end of file
+    return run_retrieval_workflow(state, qualitative_chunks_retrieval_workflow_app)
+
+async def arun_qualitative_chunks_retrieval_workflow(state):
+    """Async version of run_qualitative_chunks_retrieval_workflow."""
+    state.curr_state = "retrieve_chunks"
+    print("Running the qualitative chunks retrieval workflow...")
+    return await arun_retrieval_workflow(state, async_qualitative_chunks_retrieval_workflow_app)
@@ -0,0 +1,178 @@
+import asyncio
+import re
+from pprint import pprint
+
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from ..config import EnvConfig
+from ..models.state_models import PlanExecute
+from ..utils.evidence import evidence_context
+from ..chains.task_handler import init_task_handler_chain, task_handler_inputs_for_task, apply_task_handler_output
+from .chunks_workflow import qualitative_chunks_retrieval_workflow_app, async_qualitative_chunks_retrieval_workflow_app
+from .summaries_workflow import qualitative_summaries_retrieval_workflow_app, async_qualitative_summaries_retrieval_workflow_app
+from .quotes_workflow import qualitative_book_quotes_retrieval_workflow_app, async_qualitative_book_quotes_retrieval_workflow_app
+from .answer_workflow import run_qualtative_answer_workflow, arun_qualtative_answer_workflow
+from .retrieval_workflow import add_relevant_context, retrieval_inputs
+
+# Retrieval sub-workflows by the tool name output by the task handler
+retrieval_workflow_apps = {
+    "retrieve_chunks": qualitative_chunks_retrieval_workflow_app,
+    "retrieve_summaries": qualitative_summaries_retrieval_workflow_app,
+    "retrieve_quotes": qualitative_book_quotes_retrieval_workflow_app,
+}
+
+async_retrieval_workflow_apps = {
+    "retrieve_chunks": async_qualitative_chunks_retrieval_workflow_app,
+    "retrieve_summaries": async_qualitative_summaries_retrieval_workflow_app,
+    "retrieve_quotes": async_qualitative_book_quotes_retrieval_workflow_app,
+}
+
+
+# A step retrieving from one of the vector stores, the other steps answer from the gathered context
+RETRIEVAL_STEP_PATTERN = re.compile(r"\b(retriev\w*|search\w*|look\w* up)\b", re.IGNORECASE)
+
+# Words referring to something an earlier step finds. They may also refer to the question itself, in which
+# case the step just runs in a later batch
+DEPENDENT_STEP_PATTERN = re.compile(
+    r"\b(that|this|these|those|it|its|they|them|their|he|she|his|her|him|previous\w*|above|earlier|"
+    r"aforementioned|identified|found|result\w*|answer\w*|using|based on|from step)\b",
+    re.IGNORECASE,
+)
+
+
+def is_independent_retrieval(step):
+    """Whether a step reads as a retrieval only, without referring to the result of an earlier step."""
+    return bool(RETRIEVAL_STEP_PATTERN.search(step)) and not DEPENDENT_STEP_PATTERN.search(step)
+
+
+def next_steps_batch(state: PlanExecute):
+    """
+    Returns the steps at the head of the plan that run together: the first step, followed by the next
+    retrieval steps the break down plan chain or the controller counted as independent (up to
+    EnvConfig.MAX_PARALLEL_STEPS in total). A step that doesn't read as a retrieval only, or refers to what an
+    earlier step finds, ends the batch whatever the count. The first step runs alone when it is not a
+    retrieval, its answer may be needed next.
+    """
+    if not state.past_steps:
+        state.past_steps = []
+    steps = state.plan[:1]
+    if state.next_step:
+        first_is_retrieval = state.next_step['tool'] in retrieval_workflow_apps
+    else:
+        first_is_retrieval = bool(RETRIEVAL_STEP_PATTERN.search(steps[0]))
+    if not first_is_retrieval:
+        return steps
+    batch_size = min(state.independent_steps or 1, max(EnvConfig.MAX_PARALLEL_STEPS, 1))
+    for step in state.plan[1:batch_size]:
+        if not is_independent_retrieval(step):
+            break
+        steps.append(step)
+    return steps
+
+
+def undecided_steps(state: PlanExecute, steps):
+    """
+    Returns the tool and query of the first step when the fused controller already decided them, and the steps
+    of the batch the task handler still has to decide.
+    """
+    decided, state.next_step = state.next_step, None
+    return ([decided], steps[1:]) if decided else ([], steps)
+
+
+def independent_steps(outputs):
+    """
+    Returns how many of the leading task handler outputs can run concurrently. The batch only holds steps
+    that don't depend on each other (see next_steps_batch), but the task handler may still choose to
+    answer from context, which depends on everything retrieved before it, so it always runs alone.
+    """
+    for tool in (output['tool'] for output in outputs):
+        if tool not in retrieval_workflow_apps and tool != "answer_from_context":
+            raise ValueError("Invalid tool was outputed. Must be either 'retrieve' or 'answer_from_context'")
+    count = 0
+    for output in outputs:
+        if output['tool'] not in retrieval_workflow_apps:
+            break
+        count += 1
+    return count
+
+
+def merge_retrieval_outputs(state: PlanExecute, outputs, results):
+    """
+    Applies the retrieved steps to the state in plan order, so the merged context is deterministic.
+    The concurrent retrievals all skipped the documents distilled before the batch, but not each other's:
+    every distilled context is kept and the documents an earlier result of the batch already distilled are
+    only remembered once.
+
+    Returns:
+        The data of the retrieval_dedup event counting those duplicate documents, or None when there are none.
+    """
+    duplicates = 0
+    for output, result in zip(outputs, results):
+        apply_task_handler_output(state, output)
+        duplicates += len(set(result.get("document_ids", [])) & set(state.distilled_ids or []))
+        add_relevant_context(state, result)
+    return {"skipped_documents": duplicates, "skipped_distillation": False} if duplicates else None
+
+
+def run_parallel_steps(state: PlanExecute):
+    """
+    Runs the independent steps at the head of the plan concurrently.
+    The task handler decides the tool of the steps of the batch concurrently (except the first one when
+    the fused controller already decided it), then the leading run of retrieval steps is executed
+    concurrently and their distilled contexts are merged in plan order.
+    If the next step answers from context, it is executed alone.
+    Args:
+        state: The current state of the plan execution.
+    Returns:
+        The updated state of the plan execution.
+    """
+    state.curr_state = "parallel_steps"
+    steps = next_steps_batch(state)
+    outputs, steps = undecided_steps(state, steps)
+    if steps:
+        print(f"Deciding the tools of {len(steps)} independent steps concurrently" if len(steps) > 1 else "Deciding the tool of the next step")
+        pprint("--------------------")
+        task_handler_chain = init_task_handler_chain()
+        with ContextThreadPoolExecutor(max_workers=len(steps)) as executor:
+            outputs += executor.map(lambda step: task_handler_chain.invoke(task_handler_inputs_for_task(state, step)), steps)
+
+    count = independent_steps(outputs)
+    if count == 0:
+        apply_task_handler_output(state, outputs[0])
+        return run_qualtative_answer_workflow(state)
+
+    outputs = outputs[:count]
+    print(f"Running {count} retrieval steps concurrently")
+    with ContextThreadPoolExecutor(max_workers=count) as executor:
+        results = list(executor.map(lambda output: retrieval_workflow_apps[output['tool']].invoke(retrieval_inputs(state, output['query'])), outputs))
+    dedup = merge_retrieval_outputs(state, outputs, results)
+    if dedup:
+        dispatch_custom_event("retrieval_dedup", dedup)
+    return state
+
+
+async def arun_parallel_steps(state: PlanExecute):
+    """Async version of run_parallel_steps."""
+    state.curr_state = "parallel_steps"
+    steps = next_steps_batch(state)
+    outputs, steps = undecided_steps(state, steps)
+    if steps:
+        print(f"Deciding the tools of {len(steps)} independent steps concurrently" if len(steps) > 1 else "Deciding the tool of the next step")
+        pprint("--------------------")
+        task_handler_chain = init_task_handler_chain()
+        contexts = await asyncio.gather(*(asyncio.to_thread(evidence_context, state, step) for step in steps))
+        outputs += await asyncio.gather(*(task_handler_chain.ainvoke(task_handler_inputs_for_task(state, step, context)) for step, context in zip(steps, contexts)))
+
+    count = independent_steps(outputs)
+    if count == 0:
+        apply_task_handler_output(state, outputs[0])
+        return await arun_qualtative_answer_workflow(state)
+
+    outputs = outputs[:count]
+    print(f"Running {count} retrieval steps concurrently")
+    results = await asyncio.gather(*(async_retrieval_workflow_apps[output['tool']].ainvoke(retrieval_inputs(state, output['query'])) for output in outputs))
+    dedup = merge_retrieval_outputs(state, outputs, results)
+    if dedup:
+        await adispatch_custom_event("retrieval_dedup", dedup)
+    return state
@@ -1,64 +1,86 @@
-from langgraph.graph import END, StateGraph
-from pprint import pprint
-from ..models.state_models import QualitativeRetrievalGraphState
-from ..utils.vectorstore import encode_quotes
+import asyncio
+
+from ..utils.vectorstore import encode_quotes, encode_quotes_lexical
+from ..utils.hybrid_retriever import create_query_retriever
+from ..utils.corpus import corpus_paths
+from ..utils.retriever_registry import retriever_registry
 from ..utils.helper_functions import escape_quotes
-from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content
+from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content, akeep_only_relevant_content, ais_distilled_content_grounded_on_content
 from ..config import EnvConfig
+from .retrieval_workflow import build_qualitative_retrieval_workflow, run_retrieval_workflow, arun_retrieval_workflow, retrieve_unseen_documents, retrieval_node_output, aretrieval_node_output
 
 def create_quotes_query_retriever():
-    book_quotes = encode_quotes(EnvConfig.PDF_PATH)
-    quotes_query_retriever = book_quotes.as_retriever(search_kwargs={"k": 10})
+    quotes_query_retriever = create_query_retriever(
+        lambda path: encode_quotes(path),
+        lambda path: encode_quotes_lexical(path),
+        k=10,
+        mode=EnvConfig.RETRIEVAL_MODE,
+        paths=corpus_paths(),
+    )
     return quotes_query_retriever
 
-def retrieve_book_quotes_context_per_question(state):
-    question = state["question"]
+retriever_registry.register("quotes", create_quotes_query_retriever)
 
-    print("Retrieving relevant book quotes...")
-    book_quotes_query_retriever = create_quotes_query_retriever()
-    docs_book_quotes = book_quotes_query_retriever.get_relevant_documents(state["question"])
+def retrieve_book_quotes_context(question, seen_ids=None):
+    """
+    Retrieves the book quotes relevant to a question, skipping the ones in seen_ids, and concatenates them.
+
+    Returns:
+        The context, the retrieved documents and the number of documents skipped because they were already distilled.
+    """
+    book_quotes_query_retriever = retriever_registry.get("quotes")
+    docs_book_quotes, skipped = retrieve_unseen_documents(book_quotes_query_retriever, question, seen_ids)
     book_qoutes = " ".join(doc.page_content for doc in docs_book_quotes)
     book_qoutes_context = escape_quotes(book_qoutes)
+    return book_qoutes_context, docs_book_quotes, skipped
+
+def retrieve_book_quotes_context_per_question(state):
+    question = state["question"]
 
-    return {"context": book_qoutes_context, "question": question}
+    print("Retrieving relevant book quotes...")
+    book_qoutes_context, docs_book_quotes, skipped = retrieve_book_quotes_context(question, state.get("seen_ids"))
 
-qualitative_book_quotes_retrieval_workflow = StateGraph(QualitativeRetrievalGraphState)
+    return retrieval_node_output(question, book_qoutes_context, docs_book_quotes, skipped)
 
-# Define the nodes
-qualitative_book_quotes_retrieval_workflow.add_node("retrieve_book_quotes_context_per_question",retrieve_book_quotes_context_per_question)
-qualitative_book_quotes_retrieval_workflow.add_node("keep_only_relevant_content",keep_only_relevant_content)
+async def aretrieve_book_quotes_context_per_question(state):
+    """Async version of retrieve_book_quotes_context_per_question, the search runs in a worker thread."""
+    question = state["question"]
 
-# Build the graph
-qualitative_book_quotes_retrieval_workflow.set_entry_point("retrieve_book_quotes_context_per_question")
+    print("Retrieving relevant book quotes...")
+    book_qoutes_context, docs_book_quotes, skipped = await asyncio.to_thread(retrieve_book_quotes_context, question, state.get("seen_ids"))
 
-qualitative_book_quotes_retrieval_workflow.add_edge("retrieve_book_quotes_context_per_question", "keep_only_relevant_content")
+    return await aretrieval_node_output(question, book_qoutes_context, docs_book_quotes, skipped)
 
-qualitative_book_quotes_retrieval_workflow.add_conditional_edges(
-    "keep_only_relevant_content",
+qualitative_book_quotes_retrieval_workflow = build_qualitative_retrieval_workflow(
+    "retrieve_book_quotes_context_per_question",
+    retrieve_book_quotes_context_per_question,
+    keep_only_relevant_content,
     is_distilled_content_grounded_on_content,
-    {"grounded on the original context":END,
-      "not grounded on the original context":"keep_only_relevant_content"},
-    )
+)
 
 qualitative_book_quotes_retrieval_workflow_app = qualitative_book_quotes_retrieval_workflow.compile()
 
+async_qualitative_book_quotes_retrieval_workflow_app = build_qualitative_retrieval_workflow(
+    "retrieve_book_quotes_context_per_question",
+    aretrieve_book_quotes_context_per_question,
+    akeep_only_relevant_content,
+    ais_distilled_content_grounded_on_content,
+).compile()
+
 def run_qualitative_book_quotes_retrieval_workflow(state):
     """
     Run the qualitative book quotes retrieval workflow.
     Args:
         state: The current state of the plan execution.
     Returns:
-        The state with the updated aggregated context.
+        The state with the new evidence.
     """
     state.curr_state = "retrieve_book_quotes"
     print("Running the qualitative book quotes retrieval workflow...")
-    question = state.query_to_retrieve_or_answer
-    inputs = {"question": question}
-    for output in qualitative_book_quotes_retrieval_workflow_app.stream(inputs):
-        for _, _ in output.items():
-            pass 
-        pprint("--------------------")
-    if not state.aggregated_context:
-        state.aggregated_context = ""
-    state.aggregated_context += output['relevant_context']
-    return state
\ No newline at end of file
+    return run_retrieval_workflow(state, qualitative_book_quotes_retrieval_workflow_app)
+
+async def arun_qualitative_book_quotes_retrieval_workflow(state):
+    """Async version of run_qualitative_book_quotes_retrieval_workflow."""
+    state.curr_state = "retrieve_book_quotes"
+    print("Running the qualitative book quotes retrieval workflow...")
+    return await arun_retrieval_workflow(state, async_qualitative_book_quotes_retrieval_workflow_app)
@@ -0,0 +1,140 @@
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langgraph.graph import END, StateGraph
+from pprint import pprint
+
+from ..models.state_models import QualitativeRetrievalGraphState
+from ..utils.evidence import add_evidence
+
+
+def build_qualitative_retrieval_workflow(retrieve_node_name, retrieve_context, keep_relevant_content, is_grounded):
+    """
+    Builds a qualitative retrieval workflow: retrieve the context, keep only its relevant content and
+    distill it again until the distilled content is grounded on the retrieved context. After
+    EnvConfig.DISTILLATION_MAX_RETRIES ungrounded retries, the retrieved context is kept as is. When the
+    retrieval finds nothing that wasn't distilled before in the run, the workflow ends without distilling.
+
+    Args:
+        retrieve_node_name: The name of the retrieval node.
+        retrieve_context: The retrieval node function.
+        keep_relevant_content: The node function keeping only the relevant content.
+        is_grounded: The conditional edge function checking the distilled content is grounded.
+
+    Returns:
+        The (not compiled) workflow.
+    """
+    workflow = StateGraph(QualitativeRetrievalGraphState)
+
+    # Define the nodes
+    workflow.add_node(retrieve_node_name, retrieve_context)
+    workflow.add_node("keep_only_relevant_content", keep_relevant_content)
+    workflow.add_node("keep_retrieved_context", keep_retrieved_context)
+
+    # Build the graph
+    workflow.set_entry_point(retrieve_node_name)
+
+    workflow.add_conditional_edges(
+        retrieve_node_name,
+        has_new_context,
+        {"new context": "keep_only_relevant_content",
+          "nothing new": END},
+        )
+
+    workflow.add_conditional_edges(
+        "keep_only_relevant_content",
+        is_grounded,
+        {"grounded on the original context":END,
+          "not grounded on the original context":"keep_only_relevant_content",
+          "distillation retries exhausted":"keep_retrieved_context"},
+        )
+    workflow.add_edge("keep_retrieved_context", END)
+    return workflow
+
+
+def keep_retrieved_context(state):
+    """Best effort fallback when no distillation was grounded: the retrieved context is grounded by definition."""
+    print("Keeping the retrieved context instead of the distilled content.")
+    return {"relevant_context": state["context"]}
+
+
+def has_new_context(state):
+    """Whether the retrieval found documents to distill."""
+    return "new context" if state["context"] else "nothing new"
+
+
+def retrieve_unseen_documents(retriever, question, seen_ids=None):
+    """
+    Retrieves the documents relevant to a question that weren't distilled before in the run. For every
+    document already distilled one more candidate is fetched, so already seen documents give way to the
+    next best unseen ones.
+
+    Args:
+        retriever: A retriever returning documents with their stable id, see utils.hybrid_retriever.HybridRetriever.
+        question: The query.
+        seen_ids: The ids of the documents already distilled in the run.
+
+    Returns:
+        The unseen documents, best first, and the number of already seen documents skipped.
+    """
+    seen_ids = set(seen_ids or ())
+    if not seen_ids:
+        return retriever.invoke(question), 0
+    documents = []
+    skipped = 0
+    for document in retriever.invoke(question, k=retriever.k + len(seen_ids)):
+        if len(documents) == retriever.k:
+            break
+        if document.metadata["id"] in seen_ids:
+            skipped += 1
+        else:
+            documents.append(document)
+    return documents, skipped
+
+
+def retrieval_dedup_event(documents, skipped):
+    """The data of the retrieval_dedup event counting the documents (and distillations) saved by the dedup."""
+    return {"skipped_documents": skipped, "skipped_distillation": bool(skipped and not documents)}
+
+
+def retrieval_node_output(question, context, documents, skipped):
+    """Reports the dedup savings of a retrieval node to the run's callbacks and returns the node output."""
+    dispatch_custom_event("retrieval_dedup", retrieval_dedup_event(documents, skipped))
+    return {"context": context, "question": question, "document_ids": [document.metadata["id"] for document in documents]}
+
+
+async def aretrieval_node_output(question, context, documents, skipped):
+    """Async version of retrieval_node_output."""
+    await adispatch_custom_event("retrieval_dedup", retrieval_dedup_event(documents, skipped))
+    return {"context": context, "question": question, "document_ids": [document.metadata["id"] for document in documents]}
+
+
+def retrieval_inputs(state, question):
+    """The inputs of a retrieval workflow: the query and the ids of the documents already distilled in the run."""
+    return {"question": question, "seen_ids": state.distilled_ids or []}
+
+
+def add_relevant_context(state, output):
+    """
+    Adds the relevant context distilled by a retrieval workflow to the evidence of the plan execution
+    and remembers the distilled documents, so later retrievals skip them.
+    """
+    pprint("--------------------")
+    state.distilled_ids = list(dict.fromkeys((state.distilled_ids or []) + output.get("document_ids", [])))
+    return add_evidence(state, state.tool, state.query_to_retrieve_or_answer, output.get('relevant_context', ""))
+
+
+def run_retrieval_workflow(state, workflow_app):
+    """
+    Runs a compiled retrieval workflow for the current query of the plan execution.
+    Returns:
+        The state with the new evidence.
+    """
+    inputs = retrieval_inputs(state, state.query_to_retrieve_or_answer)
+    output = workflow_app.invoke(inputs)
+    return add_relevant_context(state, output)
+
+
+async def arun_retrieval_workflow(state, workflow_app):
+    """Async version of run_retrieval_workflow."""
+    inputs = retrieval_inputs(state, state.query_to_retrieve_or_answer)
+    output = await workflow_app.ainvoke(inputs)
+    return add_relevant_context(state, output)
@@ -1,50 +1,73 @@
-from langgraph.graph import END, StateGraph
-from pprint import pprint
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+import asyncio
 
-from ..models.state_models import QualitativeRetrievalGraphState
-from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content
+from ..chains.content_chain import keep_only_relevant_content, is_distilled_content_grounded_on_content, akeep_only_relevant_content, ais_distilled_content_grounded_on_content
 from ..utils.helper_functions import escape_quotes
 from ..utils.vectorstore import encode_chapter_summaries
+from ..utils.hybrid_retriever import create_query_retriever
+from ..utils.corpus import corpus_paths
+from ..utils.retriever_registry import retriever_registry
 from ..config import EnvConfig
+from .retrieval_workflow import build_qualitative_retrieval_workflow, run_retrieval_workflow, arun_retrieval_workflow, retrieve_unseen_documents, retrieval_node_output, aretrieval_node_output
 
 def create_summaries_query_retriever():
-    chapter_summaries = encode_chapter_summaries(EnvConfig.PDF_PATH)
-    summaries_query_retriever = chapter_summaries.as_retriever(search_kwargs={"k": 1})
+    summaries_query_retriever = create_query_retriever(
+        encode_chapter_summaries,
+        None,
+        k=1,
+        mode=EnvConfig.RETRIEVAL_MODE,
+        paths=corpus_paths(),
+    )
     return summaries_query_retriever
 
-qualitative_summaries_retrieval_workflow = StateGraph(QualitativeRetrievalGraphState)
+retriever_registry.register("summaries", create_summaries_query_retriever)
 
-def retrieve_summaries_context_per_question(state):
+def retrieve_summaries_context(question, seen_ids=None):
+    """
+    Retrieves the chapter summaries relevant to a question, skipping the ones in seen_ids, and concatenates
+    them with their chapter numbers.
 
-    print("Retrieving relevant chapter summaries...")
-    question = state["question"]
-    chapter_summaries_query_retriever = create_summaries_query_retriever()
-    docs_summaries = chapter_summaries_query_retriever.get_relevant_documents(state["question"])
+    Returns:
+        The context, the retrieved documents and the number of documents skipped because they were already distilled.
+    """
+    chapter_summaries_query_retriever = retriever_registry.get("summaries")
+    docs_summaries, skipped = retrieve_unseen_documents(chapter_summaries_query_retriever, question, seen_ids)
 
     # Concatenate chapter summaries with citation information
     context_summaries = " ".join(
         f"{doc.page_content} (Chapter {doc.metadata['chapter']})" for doc in docs_summaries
     )
     context_summaries = escape_quotes(context_summaries)
-    return {"context": context_summaries, "question": question}
+    return context_summaries, docs_summaries, skipped
 
-# Define the nodes
-qualitative_summaries_retrieval_workflow.add_node("retrieve_summaries_context_per_question",retrieve_summaries_context_per_question)
-qualitative_summaries_retrieval_workflow.add_node("keep_only_relevant_content",keep_only_relevant_content)
+def retrieve_summaries_context_per_question(state):
 
-# Build the graph
-qualitative_summaries_retrieval_workflow.set_entry_point("retrieve_summaries_context_per_question")
+    print("Retrieving relevant chapter summaries...")
+    question = state["question"]
+    context_summaries, docs_summaries, skipped = retrieve_summaries_context(question, state.get("seen_ids"))
+    return retrieval_node_output(question, context_summaries, docs_summaries, skipped)
 
-qualitative_summaries_retrieval_workflow.add_edge("retrieve_summaries_context_per_question", "keep_only_relevant_content")
+async def aretrieve_summaries_context_per_question(state):
+    """Async version of retrieve_summaries_context_per_question, the search runs in a worker thread."""
+    print("Retrieving relevant chapter summaries...")
+    question = state["question"]
+    context_summaries, docs_summaries, skipped = await asyncio.to_thread(retrieve_summaries_context, question, state.get("seen_ids"))
+    return await aretrieval_node_output(question, context_summaries, docs_summaries, skipped)
 
-qualitative_summaries_retrieval_workflow.add_conditional_edges(
-    "keep_only_relevant_content",
+qualitative_summaries_retrieval_workflow = build_qualitative_retrieval_workflow(
+    "retrieve_summaries_context_per_question",
+    retrieve_summaries_context_per_question,
+    keep_only_relevant_content,
     is_distilled_content_grounded_on_content,
-    {"grounded on the original context":END,
-      "not grounded on the original context":"keep_only_relevant_content"},
-    )
+)
+
+qualitative_summaries_retrieval_workflow_app = qualitative_summaries_retrieval_workflow.compile()
+
+async_qualitative_summaries_retrieval_workflow_app = build_qualitative_retrieval_workflow(
+    "retrieve_summaries_context_per_question",
+    aretrieve_summaries_context_per_question,
+    akeep_only_relevant_content,
+    ais_distilled_content_grounded_on_content,
+).compile()
 
 def run_qualitative_summaries_retrieval_workflow(state):
     """
@@ -52,18 +75,14 @@ def run_qualitative_summaries_retrieval_workflow(state):
     Args:
         state: The current state of the plan execution.
     Returns:
-        The state with the updated aggregated context.
+        The state with the new evidence.
     """
     state.curr_state = "retrieve_summaries"
     print("Running the qualitative summaries retrieval workflow...")
-    question = state.query_to_retrieve_or_answer
-    inputs = {"question": question}
-    qualitative_summaries_retrieval_workflow_app = qualitative_summaries_retrieval_workflow.compile()
-    for output in qualitative_summaries_retrieval_workflow_app.stream(inputs):
-        for _, _ in output.items():
-            pass 
-        pprint("--------------------")
-    if not state.aggregated_context:
-        state.aggregated_context = ""
-    state.aggregated_context += output['relevant_context']
-    return state
+    return run_retrieval_workflow(state, qualitative_summaries_retrieval_workflow_app)
+
+async def arun_qualitative_summaries_retrieval_workflow(state):
+    """Async version of run_qualitative_summaries_retrieval_workflow."""
+    state.curr_state = "retrieve_summaries"
+    print("Running the qualitative summaries retrieval workflow...")
+    return await arun_retrieval_workflow(state, async_qualitative_summaries_retrieval_workflow_app)